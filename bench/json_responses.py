@@ -0,0 +1,84 @@
+"""
+Benchmark de serialización de GET /products: camino anterior (ProductList +
+serialización de FastAPI + json de la stdlib) frente a orjson, por petición.
+
+Uso (desde la raíz del repositorio): python -m bench.json_responses [--products 100] [--repeat 2000]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+from httpx import ASGITransport, AsyncClient
+import orjson
+from pydantic import TypeAdapter
+
+from main import app
+from models.product_models import CategoryEnum, ProductList
+
+
+def _products(count: int):
+    return [
+        {
+            "id": product_id,
+            "name": f"Producto {product_id}",
+            "price": 10.0 + product_id / 100,
+            "description": "Descripción de prueba para el benchmark",
+            "category": list(CategoryEnum)[product_id % len(CategoryEnum)],
+            "in_stock": product_id % 3 != 0,
+            "stock_quantity": product_id % 50,
+            "created_at": datetime(2025, 7, 20, 10, 0, 0, 123456),
+            "updated_at": None
+        }
+        for product_id in range(1, count + 1)
+    ]
+
+
+def _per_call(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+async def _end_to_end(repeat: int, page_size: int) -> float:
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        params = {"page_size": page_size}
+        headers = {"X-Products-Cache": "bypass"}
+        await client.get("/products", params=params, headers=headers)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await client.get("/products", params=params, headers=headers)
+        return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=100, help="Productos por página")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    products = _products(args.products)
+    page = {"products": products, "total": 10_000, "page": 1, "page_size": args.products, "next_cursor": None}
+    adapter = TypeAdapter(ProductList)
+
+    def before():
+        # Lo que hacían el endpoint y FastAPI con response_model=ProductList:
+        # construir el modelo, revalidarlo, volcarlo a tipos JSON y json.dumps
+        model = adapter.validate_python(ProductList(**page))
+        return JSONResponse(adapter.dump_python(model, mode="json")).body
+
+    def after():
+        return orjson.dumps(page)
+
+    old, new = _per_call(before, args.repeat), _per_call(after, args.repeat)
+    print(f"GET /products ({args.products} productos), solo serialización:")
+    print(f"  ProductList + json stdlib: {old:9.1f} µs/petición")
+    print(f"  orjson:                    {new:9.1f} µs/petición  ({old / new:.1f}x)")
+    total = asyncio.run(_end_to_end(max(args.repeat // 10, 50), min(args.products, 100)))
+    print(f"  petición completa actual (ASGI, sin caché): {total:9.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
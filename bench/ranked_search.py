@@ -0,0 +1,113 @@
+"""
+Benchmark de RankedTextIndex.search con un catálogo sintético grande:
+puntuar todas las coincidencias (como hacía search antes de MaxScore)
+frente a search, que deja de recorrer las listas de las palabras comunes en
+cuanto ya no pueden cambiar los limit mejores. Comprueba además que los dos
+devuelven los mismos productos. Los arrays de cada palabra se construyen la
+primera vez que se busca; ese coste se mide aparte.
+
+Uso (desde la raíz del repositorio): python -m bench.ranked_search [--documents 1000000] [--limit 10]
+"""
+import argparse
+import heapq
+import math
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from data.indexes import BM25_B, BM25_K1, RankedTextIndex, tokenize
+
+_LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+
+
+def _vocabulary(size: int, rng: np.random.Generator) -> List[str]:
+    lengths = rng.integers(4, 10, size=size)
+    words = {"".join(rng.choice(_LETTERS, length)) for length in lengths.tolist()}
+    return sorted(words)
+
+
+def _build(documents: int, rng: np.random.Generator) -> Tuple[RankedTextIndex, List[str]]:
+    words = _vocabulary(20_000, rng)
+    # Frecuencias de Zipf: unas pocas palabras están en casi todos los productos
+    ranks = np.minimum(rng.zipf(1.3, size=(documents, 8)), len(words)) - 1
+    index = RankedTextIndex()
+    for product_id, row in enumerate(ranks.tolist(), start=1):
+        index.add(product_id, " ".join(words[rank] for rank in row[:3]), " ".join(words[rank] for rank in row[3:]))
+    return index, words
+
+
+def _exhaustive(index: RankedTextIndex, query: str, limit: int) -> List[Tuple[int, float]]:
+    documents = len(index._lengths)
+    average_length = index._total_length / documents
+    scores: Dict[int, float] = {}
+    for token in set(tokenize(query)):
+        best: Dict[int, float] = {}
+        for term, similarity in index.expand(token):
+            postings = index._postings[term]
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            weight = similarity * idf * (BM25_K1 + 1)
+            for product_id, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * index._lengths[product_id] / average_length)
+                score = weight * frequency / (frequency + norm)
+                if score > best.get(product_id, 0.0):
+                    best[product_id] = score
+        for product_id, score in best.items():
+            scores[product_id] = scores.get(product_id, 0.0) + score
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _queries(words: List[str], rng: np.random.Generator) -> Dict[str, List[str]]:
+    common, middle, rare = words[:5], words[50:500], words[5000:]
+    pick = lambda group: group[rng.integers(len(group))]
+    queries: Dict[str, List[str]] = {
+        "frecuente + común": [], "rara + frecuente + común": [], "rara + común": [], "errata + común": []
+    }
+    for _ in range(10):
+        rare_word = pick(rare)
+        queries["frecuente + común"].append(f"{pick(middle)} {pick(common)}")
+        queries["rara + frecuente + común"].append(f"{rare_word} {pick(middle)} {pick(common)}")
+        # Menos de limit coincidencias de la rara: el umbral no aparece hasta la común
+        queries["rara + común"].append(f"{rare_word} {pick(common)}")
+        # Con una errata: se amplía por trigramas
+        queries["errata + común"].append(f"{rare_word[:-1]} {pick(common)}")
+    return queries
+
+
+def _per_query(search, queries: List[str], limit: int) -> Tuple[float, List[list]]:
+    start = time.perf_counter()
+    results = [search(query, limit) for query in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    start = time.perf_counter()
+    index, words = _build(args.documents, rng)
+    print(f"Índice de {len(index)} productos construido en {time.perf_counter() - start:.1f} s")
+
+    queries_by_kind = _queries(words, rng)
+    start = time.perf_counter()
+    for queries in queries_by_kind.values():
+        for query in queries:
+            index.search(query, args.limit)
+    print(f"Primera búsqueda de cada consulta (construye los arrays): {time.perf_counter() - start:.1f} s")
+
+    print(f"ms por consulta, limit={args.limit} (todas las coincidencias / MaxScore):")
+    for kind, queries in queries_by_kind.items():
+        old, expected = _per_query(lambda query, limit: _exhaustive(index, query, limit), queries, args.limit)
+        new, results = _per_query(index.search, queries, args.limit)
+        same = all(
+            [product_id for product_id, _ in first] == [product_id for product_id, _ in second]
+            for first, second in zip(expected, results)
+        )
+        print(f"  {kind:26} {old:8.1f} / {new:8.1f}  ({old / new:4.1f}x){'' if same else '  RESULTADOS DISTINTOS'}")
+
+
+if __name__ == "__main__":
+    main()
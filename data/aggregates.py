@@ -0,0 +1,250 @@
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+import math
+
+import numpy as np
+
+from models.product_models import CategoryEnum
+from data.columnar import CATEGORIES, CATEGORY_CODES
+
+# Bocetos de cuantiles al estilo DDSketch: histogramas de cubetas de anchura
+# geométrica. Un valor cae en la primera cubeta cuyo límite superior es >= que
+# él, y cada cubeta (lo, hi] se representa por 2·lo·hi / (lo + hi), que está a
+# menos de SKETCH_RELATIVE_ERROR (en relativo) de cualquier valor de la cubeta.
+# Ocupan un número fijo de cubetas, dos bocetos se combinan sumándolas y, a
+# diferencia de t-digest o KLL, quitar un valor es exacto: basta con restar uno
+# en su cubeta. Por eso aguantan actualizaciones y borrados sin desviarse.
+SKETCH_RELATIVE_ERROR = 0.01
+_GAMMA = (1 + SKETCH_RELATIVE_ERROR) / (1 - SKETCH_RELATIVE_ERROR)
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+
+def _geometric_bounds(low: float, high: float) -> List[float]:
+    bounds = [low]
+    while bounds[-1] < high:
+        bounds.append(bounds[-1] * _GAMMA)
+    # Cubeta de desbordamiento, por si llegan valores fuera de los límites del modelo
+    bounds.append(math.inf)
+    return bounds
+
+
+def _representatives(bounds: List[float]) -> np.ndarray:
+    representatives = [bounds[0]]
+    for low, high in zip(bounds, bounds[1:]):
+        if high == math.inf:
+            representatives.append(low)
+        elif low <= 0:
+            representatives.append(high)
+        else:
+            representatives.append(2 * low * high / (low + high))
+    return np.array(representatives)
+
+
+# Precios: lo que no llega a un céntimo va a la primera cubeta. Stock: el cero
+# tiene su propia cubeta
+PRICE_BOUNDS = _geometric_bounds(0.01, 999999.99)
+STOCK_BOUNDS = [0.0] + _geometric_bounds(1.0, 9999)
+_PRICE_BOUNDS = np.array(PRICE_BOUNDS)
+_STOCK_BOUNDS = np.array(STOCK_BOUNDS)
+_PRICE_REPRESENTATIVES = _representatives(PRICE_BOUNDS)
+_STOCK_REPRESENTATIVES = _representatives(STOCK_BOUNDS)
+
+# Posiciones del vector de agregados: totales; por categoría, (productos, valor);
+# y por categoría, el boceto de precios seguido del de stock
+_COUNT, _STOCK, _PRICE, _VALUE = range(4)
+_CATEGORY_BASE = 4
+_SKETCH_BASE = _CATEGORY_BASE + 2 * len(CATEGORIES)
+_SKETCH_SIZE = len(PRICE_BOUNDS) + len(STOCK_BOUNDS)
+
+
+def price_cents(price: float) -> int:
+    """
+    Los agregados suman precios en céntimos enteros: las sumas y restas son
+    exactas, así que mantenerlos escritura a escritura no acumula error.
+    """
+    return round(price * 100)
+
+
+def sketch_buckets() -> List[Tuple[int, int, float]]:
+    """
+    Cubetas de un boceto como (posición, tipo, límite superior), con tipo 0
+    para precios y 1 para stock. Sirve para mantener los bocetos fuera de
+    Python (ver SQLiteProductBackend) con exactamente los mismos límites.
+    """
+    return (
+        [(bucket, 0, bound) for bucket, bound in enumerate(PRICE_BOUNDS)]
+        + [(len(PRICE_BOUNDS) + bucket, 1, bound) for bucket, bound in enumerate(STOCK_BOUNDS)]
+    )
+
+
+def _summary(histogram: np.ndarray, representatives: np.ndarray, digits: int) -> Optional[dict]:
+    """Mínimo, percentiles y máximo estimados de un boceto; None si está vacío."""
+    cumulative = np.cumsum(histogram)
+    total = int(cumulative[-1])
+    if total <= 0:
+        return None
+    nonzero = np.flatnonzero(histogram)
+
+    def value(bucket: int):
+        estimate = round(float(representatives[bucket]), digits)
+        return int(estimate) if digits == 0 else estimate
+
+    summary = {"min": value(nonzero[0])}
+    for name, quantile in QUANTILES:
+        # Rango más cercano, contando desde 0
+        rank = math.floor(quantile * (total - 1))
+        summary[name] = value(int(np.searchsorted(cumulative, rank, side="right")))
+    summary["max"] = value(nonzero[-1])
+    return summary
+
+
+class CatalogAggregates:
+    """
+    Agregados del catálogo que cada escritura ajusta en O(1): productos,
+    stock, suma de precios y valor del inventario (precio * stock_quantity),
+    en total y por categoría, más un boceto de cuantiles de precio y otro de
+    stock por categoría (ver SKETCH_RELATIVE_ERROR).
+
+    Los valores viven en un vector int64, que puede ser propio o una vista de
+    memoria compartida. Los totales y bocetos globales se obtienen sumando
+    los de cada categoría al leerlos.
+    """
+
+    SIZE = _SKETCH_BASE + len(CATEGORIES) * _SKETCH_SIZE
+
+    def __init__(self, values: Optional[np.ndarray] = None):
+        self.values = np.zeros(self.SIZE, dtype=np.int64) if values is None else values
+
+    def add(self, category, price: float, stock_quantity: int, sign: int = 1) -> None:
+        """Suma (sign=1) o resta (sign=-1) un producto."""
+        code = CATEGORY_CODES[category.value if isinstance(category, CategoryEnum) else category]
+        cents = price_cents(price)
+        values = self.values
+        values[_COUNT] += sign
+        values[_STOCK] += sign * stock_quantity
+        values[_PRICE] += sign * cents
+        values[_VALUE] += sign * cents * stock_quantity
+        values[_CATEGORY_BASE + 2 * code] += sign
+        values[_CATEGORY_BASE + 2 * code + 1] += sign * cents * stock_quantity
+        sketch = _SKETCH_BASE + code * _SKETCH_SIZE
+        values[sketch + bisect_left(PRICE_BOUNDS, price)] += sign
+        values[sketch + len(PRICE_BOUNDS) + bisect_left(STOCK_BOUNDS, stock_quantity)] += sign
+
+    def add_product(self, product: dict, sign: int = 1) -> None:
+        self.add(product["category"], product["price"], product["stock_quantity"], sign)
+
+    @classmethod
+    def from_columns(cls, categories: np.ndarray, prices: np.ndarray, stock_quantity: np.ndarray) -> "CatalogAggregates":
+        """Recalcula desde cero a partir de las columnas de las filas vivas."""
+        aggregates = cls()
+        codes = categories.astype(np.int64)
+        cents = np.rint(prices * 100).astype(np.int64)
+        stock = stock_quantity.astype(np.int64)
+        value = cents * stock
+        aggregates.values[_COUNT] = len(cents)
+        aggregates.values[_STOCK] = stock.sum()
+        aggregates.values[_PRICE] = cents.sum()
+        aggregates.values[_VALUE] = value.sum()
+        aggregates.values[_CATEGORY_BASE:_SKETCH_BASE:2] = np.bincount(codes, minlength=len(CATEGORIES))
+        # add.at suma en int64: bincount con pesos pasaría por float64
+        category_values = np.zeros(len(CATEGORIES), dtype=np.int64)
+        np.add.at(category_values, codes, value)
+        aggregates.values[_CATEGORY_BASE + 1:_SKETCH_BASE:2] = category_values
+        # Misma regla que bisect_left: primer límite >= valor
+        sketches = _SKETCH_BASE + codes * _SKETCH_SIZE
+        positions = np.concatenate((
+            sketches + np.searchsorted(_PRICE_BOUNDS, prices, side="left"),
+            sketches + len(PRICE_BOUNDS) + np.searchsorted(_STOCK_BOUNDS, stock, side="left")
+        ))
+        aggregates.values[_SKETCH_BASE:] = np.bincount(positions, minlength=cls.SIZE)[_SKETCH_BASE:]
+        return aggregates
+
+    @classmethod
+    def from_categories(
+        cls,
+        rows: Iterable[tuple],
+        buckets: Iterable[Tuple[str, int, int]] = ()
+    ) -> "CatalogAggregates":
+        """
+        Construye los agregados a partir de filas (categoría, productos, stock,
+        suma de precios, valor) por categoría, con los importes en céntimos, y
+        de las cubetas (categoría, posición, productos) de sus bocetos.
+        """
+        aggregates = cls()
+        values = aggregates.values
+        for category, count, stock, price, value in rows:
+            code = CATEGORY_CODES[category]
+            values[_COUNT] += count
+            values[_STOCK] += stock
+            values[_PRICE] += price
+            values[_VALUE] += value
+            values[_CATEGORY_BASE + 2 * code] += count
+            values[_CATEGORY_BASE + 2 * code + 1] += value
+        for category, bucket, count in buckets:
+            values[_SKETCH_BASE + CATEGORY_CODES[category] * _SKETCH_SIZE + bucket] += count
+        return aggregates
+
+    def copy(self) -> "CatalogAggregates":
+        return CatalogAggregates(self.values.copy())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CatalogAggregates) and bool(np.array_equal(self.values, other.values))
+
+    def _sketches(self) -> np.ndarray:
+        # Vista (categorías, cubetas) de los bocetos
+        return self.values[_SKETCH_BASE:].reshape(len(CATEGORIES), _SKETCH_SIZE)
+
+    @staticmethod
+    def _distributions(sketch: np.ndarray) -> dict:
+        return {
+            "price": _summary(sketch[:len(PRICE_BOUNDS)], _PRICE_REPRESENTATIVES, 2),
+            "stock": _summary(sketch[len(PRICE_BOUNDS):], _STOCK_REPRESENTATIVES, 0)
+        }
+
+    def as_dict(self) -> dict:
+        values = self.values[:_SKETCH_BASE].tolist()
+        sketches = self._sketches()
+        count = values[_COUNT]
+        return {
+            "total_products": count,
+            "total_stock": values[_STOCK],
+            "total_price": values[_PRICE] / 100,
+            "average_price": round(values[_PRICE] / 100 / count, 2) if count > 0 else 0,
+            "total_value": values[_VALUE] / 100,
+            **self._distributions(sketches.sum(axis=0)),
+            "quantile_relative_error": SKETCH_RELATIVE_ERROR,
+            "categories": {
+                category.value: {
+                    "products": values[_CATEGORY_BASE + 2 * code],
+                    "value": values[_CATEGORY_BASE + 2 * code + 1] / 100,
+                    **self._distributions(sketches[code])
+                }
+                for code, category in enumerate(CATEGORIES)
+            }
+        }
+
+    def drift(self, expected: "CatalogAggregates") -> Dict[str, float]:
+        """
+        Diferencias (mantenido - recalculado) de los campos que no coinciden.
+        Para los bocetos se da la suma de las diferencias de cada cubeta.
+        """
+        kept, fresh = self.as_dict(), expected.as_dict()
+        differences = {}
+        for field in ("total_products", "total_stock", "total_price", "total_value"):
+            if kept[field] != fresh[field]:
+                differences[field] = kept[field] - fresh[field]
+        for category, kept_category in kept["categories"].items():
+            for field in ("products", "value"):
+                if kept_category[field] != fresh["categories"][category][field]:
+                    differences[f"categories.{category}.{field}"] = (
+                        kept_category[field] - fresh["categories"][category][field]
+                    )
+        sketch_differences = np.abs(self._sketches() - expected._sketches())
+        for code, category in enumerate(CATEGORIES):
+            for field, buckets in (("price", sketch_differences[code, :len(PRICE_BOUNDS)]),
+                                   ("stock", sketch_differences[code, len(PRICE_BOUNDS):])):
+                misplaced = int(buckets.sum())
+                if misplaced:
+                    differences[f"categories.{category.value}.{field}_sketch"] = misplaced
+        return differences
@@ -0,0 +1,256 @@
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from exceptions.custom_exceptions import DuplicateProductNameError, ProductNotFoundError
+from data.aggregates import CatalogAggregates
+from data.columnar import CATEGORIES
+
+# Operación de write_many: ("create", None, datos), ("update", id, cambios) o ("delete", id, None)
+WriteOperation = Tuple[str, Optional[int], Optional[dict]]
+
+# Facetas que admite facet_counts
+FACETS = ("category", "in_stock", "price_bucket")
+
+# Tramos de precio de la faceta price_bucket: [0, 25), [25, 50)... [1000, ∞)
+PRICE_BUCKET_EDGES = (25, 50, 100, 250, 500, 1000)
+PRICE_BUCKETS = tuple(
+    f"{low}-{high}" for low, high in zip((0,) + PRICE_BUCKET_EDGES, PRICE_BUCKET_EDGES)
+) + (f"{PRICE_BUCKET_EDGES[-1]}+",)
+
+
+def check_writes(
+    operations: List[WriteOperation],
+    name_of: Callable[[int], Optional[str]],
+    id_by_name: Callable[[str], Optional[int]]
+) -> List[Optional[Exception]]:
+    """
+    Simula en orden las operaciones de un lote sin aplicarlas y devuelve, por
+    operación, el error que daría (o None). name_of(id) es el nombre actual
+    del producto (None si no existe) e id_by_name(nombre), el dueño actual del
+    nombre. Así un lote atómico se rechaza entero antes de tocar nada.
+    """
+    names = {}   # id -> nombre tras las operaciones ya simuladas (None si se borró)
+    owners = {}  # nombre normalizado -> id dueño tras las operaciones ya simuladas
+    errors: List[Optional[Exception]] = []
+    next_new_id = 0
+
+    def current_name(product_id: int) -> Optional[str]:
+        return names[product_id] if product_id in names else name_of(product_id)
+
+    def owner(name: str) -> Optional[int]:
+        key = name.casefold()
+        return owners[key] if key in owners else id_by_name(name)
+
+    for op, product_id, product_data in operations:
+        if op == "create":
+            # Los productos nuevos reciben IDs negativos que no chocan con nadie
+            next_new_id -= 1
+            product_id, old_name = next_new_id, None
+        else:
+            old_name = current_name(product_id)
+            if old_name is None:
+                errors.append(ProductNotFoundError(product_id))
+                continue
+
+        if op == "delete":
+            owners[old_name.casefold()] = None
+            names[product_id] = None
+            errors.append(None)
+            continue
+
+        name = product_data.get("name", old_name)
+        existing_id = owner(name)
+        if existing_id is not None and existing_id != product_id:
+            errors.append(DuplicateProductNameError(name, existing_id))
+            continue
+        if old_name is not None:
+            owners[old_name.casefold()] = None
+        owners[name.casefold()] = product_id
+        names[product_id] = name
+        errors.append(None)
+    return errors
+
+
+def empty_facets(facets: Iterable[str]) -> Dict[str, Dict[str, int]]:
+    """Todas las claves de cada faceta pedida, con cuenta cero."""
+    values = {
+        "category": [category.value for category in CATEGORIES],
+        "in_stock": ["true", "false"],
+        "price_bucket": list(PRICE_BUCKETS)
+    }
+    return {facet: dict.fromkeys(values[facet], 0) for facet in facets}
+
+
+def facets_from_columns(
+    facets: Iterable[str],
+    categories: np.ndarray,
+    in_stock: np.ndarray,
+    prices: np.ndarray
+) -> Dict[str, Dict[str, int]]:
+    """Cuentas de facetas a partir de las columnas de las filas que cumplen los filtros."""
+    counts = empty_facets(facets)
+    if "category" in counts:
+        by_code = np.bincount(categories.astype(np.int64), minlength=len(CATEGORIES))
+        counts["category"] = {category.value: int(count) for category, count in zip(CATEGORIES, by_code)}
+    if "in_stock" in counts:
+        available = int(np.count_nonzero(in_stock))
+        counts["in_stock"] = {"true": available, "false": len(in_stock) - available}
+    if "price_bucket" in counts:
+        by_bucket = np.bincount(
+            np.searchsorted(PRICE_BUCKET_EDGES, prices, side="right"), minlength=len(PRICE_BUCKETS)
+        )
+        counts["price_bucket"] = dict(zip(PRICE_BUCKETS, by_bucket.tolist()))
+    return counts
+
+
+class ProductBackend:
+    """
+    Contrato que cumple cada almacenamiento de productos.
+
+    Los productos entran y salen como dicts con las claves de ProductResponse.
+    Los filtros (category, in_stock, min_price, max_price, search, name)
+    significan lo mismo en todos los backends, y sort_by es "id" o "price".
+    search busca la subcadena en el nombre o la descripción; name, solo en el
+    nombre. Las dos sin distinguir mayúsculas.
+    """
+
+    name = "base"
+
+    # Identifica el origen de generation() y version(): dos valores solo son
+    # comparables si vienen del mismo instance_id
+    instance_id = "base"
+
+    # Si lo que escribe un proceso lo ven los demás y sobrevive a que el
+    # proceso termine. La CLI de importación no escribe en un backend que no
+    durable = True
+
+    def get(self, product_id: int) -> Optional[dict]:
+        raise NotImplementedError
+
+    def get_many(self, product_ids: Iterable[int]) -> List[dict]:
+        """Devuelve los productos en el mismo orden que product_ids, omitiendo los que ya no existan."""
+        raise NotImplementedError
+
+    def all(self) -> Iterator[dict]:
+        raise NotImplementedError
+
+    def generation(self) -> int:
+        """Generación del catálogo: cambia con cada escritura."""
+        raise NotImplementedError
+
+    def version(self, product_id: int) -> Optional[int]:
+        """Versión del producto: cambia cada vez que se escribe; None si no existe."""
+        raise NotImplementedError
+
+    def versions(self, product_ids: List[int]) -> List[Optional[int]]:
+        """version() de varios productos a la vez, en el mismo orden."""
+        return [self.version(product_id) for product_id in product_ids]
+
+    def aggregates(self) -> CatalogAggregates:
+        """Agregados del catálogo, mantenidos con cada escritura: O(1)."""
+        raise NotImplementedError
+
+    def check_aggregates(self) -> Tuple[CatalogAggregates, CatalogAggregates]:
+        """
+        Devuelve (mantenidos, recalculados desde cero), leídos sobre el mismo
+        estado del catálogo; si difieren, los agregados se han desviado.
+        """
+        raise NotImplementedError
+
+    def find_id_by_name(self, name: str) -> Optional[int]:
+        """Busca un ID por nombre sin distinguir mayúsculas."""
+        raise NotImplementedError
+
+    def create(self, product_data: dict) -> dict:
+        """Asigna ID y timestamps; lanza DuplicateProductNameError si el nombre existe."""
+        raise NotImplementedError
+
+    def update(self, product_id: int, product_data: dict) -> Optional[dict]:
+        """Mezcla product_data sobre el producto; None si no existe."""
+        raise NotImplementedError
+
+    def delete(self, product_id: int) -> bool:
+        raise NotImplementedError
+
+    def write_many(self, operations: List[WriteOperation], atomic: bool = False) -> Tuple[bool, List[object]]:
+        """
+        Aplica un lote de operaciones en una sola sección crítica y devuelve
+        (aplicado, resultados). Cada resultado es el producto (create/update),
+        True (delete) o la excepción que impidió la operación
+        (DuplicateProductNameError, ProductNotFoundError).
+
+        Con atomic=False se aplica todo lo que se pueda. Con atomic=True, si
+        alguna operación falla no se aplica ninguna: se devuelve
+        (False, errores), con None en las operaciones que sí habrían funcionado.
+        """
+        raise NotImplementedError
+
+    def iter_ids(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        sort_by: str = "id",
+        after: Optional[Tuple[float, int]] = None,
+        offset: int = 0,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Iterator[int]:
+        """
+        Genera perezosamente los IDs que cumplen los filtros, después de after.
+        tags (ya normalizadas) deja los productos con alguna etiqueta de la
+        lista si tags_mode es "any", o con todas si es "all".
+        """
+        raise NotImplementedError
+
+    def count(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> int:
+        raise NotImplementedError
+
+    def facet_counts(
+        self,
+        facets: List[str],
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        """
+        Entre los productos que cumplen los filtros, cuántos hay con cada valor
+        de cada faceta (ver FACETS), todas a la vez en una sola pasada. Cada
+        faceta suma lo mismo que count() con los mismos filtros.
+        """
+        raise NotImplementedError
+
+    def ranked_search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Los limit productos más relevantes para query según BM25 sobre las
+        palabras del nombre y la descripción, tolerando erratas (ver
+        data.indexes.RankedTextIndex), como (id, puntuación) de mayor a menor.
+        Las puntuaciones solo son comparables dentro de una misma respuesta.
+        """
+        raise NotImplementedError
+
+    def sort_key(self, product_id: int, sort_by: str = "id") -> Optional[Tuple[float, int]]:
+        """Pareja (clave de orden, id) que iter_ids acepta como after; None si ya no existe."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
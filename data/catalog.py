@@ -0,0 +1,187 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import json
+import mmap
+import os
+import struct
+import uuid
+
+import numpy as np
+
+from data.columnar import ColumnarProductStore
+from data.wal import _fsync_directory
+
+# Formato del fichero de catálogo:
+#   MAGIC | longitud de la cabecera (uint32) | cabecera JSON | columnas
+# La cabecera ocupa como mucho _HEADER_SPACE bytes y guarda el desplazamiento,
+# tipo y número de elementos de cada columna; las columnas empiezan alineadas
+# a _ALIGN bytes
+MAGIC = b"PRODCAT1"
+_HEADER_SPACE = 4096
+_ALIGN = 64
+_HEADER_LENGTH = struct.Struct("<I")
+
+# Columnas numéricas del almacén que se guardan tal cual
+_NUMERIC_COLUMNS = ("ids", "prices", "categories", "in_stock", "stock_quantity", "created_at", "updated_at")
+# Catálogos escritos antes de guardar las versiones no traen esta columna
+_VERSION_COLUMN = "versions"
+
+_MISSING = object()
+
+
+class LazyColumn:
+    """
+    Columna de solo lectura respaldada por el fichero, con los cambios aparte.
+
+    Los valores del fichero se decodifican al leerlos, uno a uno; lo que se
+    escribe o añade después se guarda en memoria del proceso, sin tocar las
+    páginas compartidas.
+    """
+
+    def __init__(self, decode: Callable[[int], object], size: int):
+        self._decode = decode
+        self._size = size
+        self._changed: Dict[int, object] = {}
+        self._appended: List[object] = []
+
+    def __len__(self) -> int:
+        return self._size + len(self._appended)
+
+    def __getitem__(self, row: int):
+        if row >= self._size:
+            return self._appended[row - self._size]
+        value = self._changed.get(row, _MISSING)
+        return self._decode(row) if value is _MISSING else value
+
+    def __setitem__(self, row: int, value) -> None:
+        if row >= self._size:
+            self._appended[row - self._size] = value
+        else:
+            self._changed[row] = value
+
+    def append(self, value) -> None:
+        self._appended.append(value)
+
+
+def _encode_strings(values: List[Optional[str]]) -> Tuple[np.ndarray, np.ndarray, bytes]:
+    """Devuelve (offsets, nulos, bytes UTF-8 concatenados)."""
+    encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    nulls = np.fromiter((value is None for value in values), dtype=np.bool_, count=len(values))
+    return offsets, nulls, b"".join(encoded)
+
+
+def write_catalog(path: str, lsn: int, next_id: int, store: ColumnarProductStore, generation: int = 0) -> None:
+    """
+    Escribe las filas vivas del almacén en formato de catálogo, de forma
+    atómica (fichero temporal, fsync y rename). Hay que llamarla sin
+    escrituras concurrentes sobre store, o sobre una copia.
+
+    Guarda también las versiones de las filas y la generación del catálogo,
+    con un instance_id nuevo que identifica este contenido (ver
+    MemoryProductBackend.open_catalog).
+    """
+    rows = store.alive_rows()
+    texts = [store.text_of(row) for row in rows.tolist()]
+    # Las etiquetas no pueden llevar comas (ver normalize_tags)
+    tags = [",".join(store.tags_of(row)) for row in rows.tolist()]
+
+    name_offsets, _, name_data = _encode_strings([name for name, _ in texts])
+    description_offsets, description_nulls, description_data = _encode_strings(
+        [description for _, description in texts]
+    )
+    columns = {name: getattr(store, name)[rows] for name in _NUMERIC_COLUMNS + (_VERSION_COLUMN,)}
+    columns.update({
+        "name_offsets": name_offsets,
+        "name_data": np.frombuffer(name_data, dtype=np.uint8),
+        "description_offsets": description_offsets,
+        "description_nulls": description_nulls,
+        "description_data": np.frombuffer(description_data, dtype=np.uint8)
+    })
+    tag_offsets, _, tag_data = _encode_strings(tags)
+    columns.update({"tag_offsets": tag_offsets, "tag_data": np.frombuffer(tag_data, dtype=np.uint8)})
+
+    layout = {}
+    position = _HEADER_SPACE
+    for name, column in columns.items():
+        layout[name] = [position, column.dtype.str, len(column)]
+        position += -(-column.nbytes // _ALIGN) * _ALIGN
+    header = {
+        "lsn": lsn, "next_id": next_id, "rows": len(rows), "columns": layout,
+        "generation": generation, "instance_id": uuid.uuid4().hex[:12]
+    }
+    header_bytes = json.dumps(header).encode()
+    if len(MAGIC) + _HEADER_LENGTH.size + len(header_bytes) > _HEADER_SPACE:
+        raise ValueError("La cabecera del catálogo no cabe en el espacio reservado")
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as catalog_file:
+        catalog_file.write(MAGIC + _HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+        for name, column in columns.items():
+            catalog_file.seek(layout[name][0])
+            catalog_file.write(column.tobytes())
+        catalog_file.truncate(position)
+        catalog_file.flush()
+        os.fsync(catalog_file.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(path)
+
+
+def read_catalog(path: str) -> Optional[Tuple[int, int, ColumnarProductStore, Optional[Tuple[str, int]]]]:
+    """
+    Abre un catálogo con mmap y devuelve (lsn, next_id, almacén, identidad),
+    o None si no existe. La identidad es (instance_id, generación) del
+    contenido, o None en catálogos que no guardan versiones. No copia ni
+    decodifica nada: las columnas numéricas (fechas y versiones incluidas)
+    son vistas del fichero y los textos se decodifican al leer cada fila.
+
+    El mapeo es privado (copy-on-write): todos los procesos que abren el mismo
+    fichero comparten las páginas de la caché del sistema, y solo se copia la
+    página que un proceso modifica.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as catalog_file:
+        mapped = mmap.mmap(catalog_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} no es un catálogo de productos")
+    (header_length,) = _HEADER_LENGTH.unpack_from(mapped, len(MAGIC))
+    header_start = len(MAGIC) + _HEADER_LENGTH.size
+    header = json.loads(mapped[header_start:header_start + header_length])
+
+    columns = {
+        name: np.frombuffer(mapped, dtype=np.dtype(dtype), count=count, offset=offset)
+        for name, (offset, dtype, count) in header["columns"].items()
+    }
+    size = header["rows"]
+
+    def string_decoder(prefix: str, nulls: Optional[np.ndarray] = None):
+        offsets, data = columns[f"{prefix}_offsets"], columns[f"{prefix}_data"]
+
+        def decode(row: int) -> Optional[str]:
+            if nulls is not None and nulls[row]:
+                return None
+            return data[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+        return decode
+
+    if "tag_offsets" in columns:
+        decode_tags = string_decoder("tag")
+
+        def tag_decoder(row: int) -> Tuple[str, ...]:
+            joined = decode_tags(row)
+            return tuple(joined.split(",")) if joined else ()
+    else:
+        # Catálogos escritos antes de que existieran las etiquetas
+        def tag_decoder(row: int) -> Tuple[str, ...]:
+            return ()
+
+    store = ColumnarProductStore.from_columns(size, {
+        **{name: columns[name] for name in _NUMERIC_COLUMNS},
+        "alive": np.ones(size, dtype=np.bool_),
+        "versions": columns.get(_VERSION_COLUMN, np.zeros(size, dtype=np.int64)),
+        "_names": LazyColumn(string_decoder("name"), size),
+        "_descriptions": LazyColumn(string_decoder("description", columns["description_nulls"]), size),
+        "_tags": LazyColumn(tag_decoder, size)
+    })
+    identity = (header["instance_id"], header["generation"]) if _VERSION_COLUMN in columns else None
+    return header["lsn"], header["next_id"], store, identity
@@ -0,0 +1,298 @@
+from datetime import datetime, timedelta
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from models.product_models import CategoryEnum
+
+# Las categorías se guardan como códigos enteros en la columna category
+CATEGORIES: List[CategoryEnum] = list(CategoryEnum)
+CATEGORY_CODES: Dict[str, int] = {category.value: code for code, category in enumerate(CATEGORIES)}
+
+# Las fechas se guardan como microsegundos desde la época; NO_TIMESTAMP es None
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def to_epoch_micros(value: Optional[datetime]) -> int:
+    return NO_TIMESTAMP if value is None else (value - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_micros(value: int) -> Optional[datetime]:
+    return None if value == NO_TIMESTAMP else _EPOCH + timedelta(microseconds=int(value))
+
+
+# Columnas guardadas en arrays de NumPy y en listas, respectivamente
+_ARRAY_COLUMNS = (
+    "ids", "prices", "categories", "in_stock", "stock_quantity", "created_at", "updated_at", "alive", "versions"
+)
+_LIST_COLUMNS = ("_names", "_descriptions", "_tags")
+
+# Número mínimo de filas borradas antes de compactar
+_MIN_DEAD_ROWS_TO_COMPACT = 1024
+
+
+class ColumnarProductStore:
+    """
+    Catálogo guardado en columnas paralelas de NumPy.
+
+    Los campos numéricos (id, price, category, in_stock, stock_quantity y las
+    fechas como enteros) viven en arrays; nombre y descripción en listas
+    indexadas por fila. Cada producto ocupa así unas pocas decenas de bytes
+    más sus textos, sin objetos por fila. Los dicts solo se materializan
+    cuando se piden, y la interfaz imita a un Dict[int, dict] para que el
+    resto del módulo no dependa de la representación.
+
+    Los borrados marcan la fila como muerta sin moverla. Cuando las filas
+    muertas superan un cuarto del total se compacta conservando el orden
+    relativo; como las filas se añaden en orden de ID, las páginas de un
+    listado no cambian tras una compactación.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._size = 0
+        self._dead = 0
+        # Las filas [0, _sorted_rows) están en orden estricto de ID y se buscan
+        # con searchsorted sobre ids, sin diccionario (ver from_columns). El
+        # resto de filas se buscan en _row_by_id, que si es None se construye
+        # al primer acceso
+        self._sorted_rows = 0
+        self._row_by_id: Optional[Dict[int, int]] = {}
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.prices = np.zeros(capacity, dtype=np.float64)
+        self.categories = np.zeros(capacity, dtype=np.int8)
+        self.in_stock = np.zeros(capacity, dtype=np.bool_)
+        self.stock_quantity = np.zeros(capacity, dtype=np.int32)
+        # Microsegundos desde la época; se convierten a datetime al materializar
+        self.created_at = np.zeros(capacity, dtype=np.int64)
+        self.updated_at = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=np.bool_)
+        # Versión de cada fila (ver set_version); no forma parte del producto
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self._names: List[str] = []
+        self._descriptions: List[Optional[str]] = []
+        self._tags: List[Tuple[str, ...]] = []
+
+    # -----------------------------
+    # Interfaz tipo diccionario
+    # -----------------------------
+    @classmethod
+    def from_columns(cls, size: int, columns: dict) -> "ColumnarProductStore":
+        """
+        Crea el almacén sobre columnas ya construidas (por ejemplo, vistas de
+        un fichero mapeado en memoria), sin copiarlas. Las columnas de texto y
+        fechas pueden ser cualquier secuencia indexable con append.
+        """
+        store = cls(capacity=0)
+        for name, column in columns.items():
+            setattr(store, name, column)
+        store._size = size
+        store._index_rows()
+        return store
+
+    def _index_rows(self) -> None:
+        """
+        Prepara la búsqueda por ID de todas las filas. Si los IDs ya están
+        ordenados (lo normal: las filas se añaden en orden de ID), basta con
+        searchsorted y no hace falta diccionario; la comprobación es una sola
+        pasada vectorizada.
+        """
+        ids = self.ids[:self._size]
+        if bool(np.all(ids[1:] > ids[:-1])):
+            self._sorted_rows, self._row_by_id = self._size, {}
+        else:
+            self._sorted_rows, self._row_by_id = 0, None
+
+    @property
+    def _rows_by_id(self) -> Dict[int, int]:
+        if self._row_by_id is None:
+            alive = self.alive_rows()
+            self._row_by_id = dict(zip(self.ids[alive].tolist(), alive.tolist()))
+        return self._row_by_id
+
+    def _row(self, product_id: int) -> Optional[int]:
+        if self._sorted_rows:
+            row = int(np.searchsorted(self.ids[:self._sorted_rows], product_id))
+            if row < self._sorted_rows and self.ids[row] == product_id and self.alive[row]:
+                return row
+        return self._rows_by_id.get(product_id)
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    def __contains__(self, product_id: int) -> bool:
+        return self._row(product_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids_for_rows(self.alive_rows()))
+
+    def __getitem__(self, product_id: int) -> dict:
+        return self.materialize(self.row_of(product_id))
+
+    def __setitem__(self, product_id: int, product: dict) -> None:
+        row = self._row(product_id)
+        if row is None:
+            row = self._append_row()
+            self._rows_by_id[product_id] = row
+        self._write_row(row, product)
+
+    def get(self, product_id: int, default=None) -> Optional[dict]:
+        row = self._row(product_id)
+        return default if row is None else self.materialize(row)
+
+    def pop(self, product_id: int) -> dict:
+        row = self.row_of(product_id)
+        self._rows_by_id.pop(product_id, None)
+        product = self.materialize(row)
+        self.alive[row] = False
+        self._dead += 1
+        if self._dead >= _MIN_DEAD_ROWS_TO_COMPACT and self._dead * 4 >= self._size:
+            self.compact()
+        return product
+
+    def values(self) -> Iterator[dict]:
+        for row in self.alive_rows():
+            yield self.materialize(int(row))
+
+    # -----------------------------
+    # Acceso por filas
+    # -----------------------------
+    @property
+    def row_count(self) -> int:
+        """Filas ocupadas, vivas o muertas."""
+        return self._size
+
+    def row_of(self, product_id: int) -> int:
+        row = self._row(product_id)
+        if row is None:
+            raise KeyError(product_id)
+        return row
+
+    def version_of(self, product_id: int) -> Optional[int]:
+        row = self._row(product_id)
+        return None if row is None else int(self.versions[row])
+
+    def set_version(self, product_id: int, version: int) -> None:
+        self.versions[self.row_of(product_id)] = version
+
+    def alive_rows(self) -> np.ndarray:
+        return np.flatnonzero(self.alive[:self._size])
+
+    def ids_for_rows(self, rows: np.ndarray) -> List[int]:
+        return self.ids[rows].tolist()
+
+    def materialize(self, row: int) -> dict:
+        return {
+            "id": int(self.ids[row]),
+            "name": self._names[row],
+            "price": float(self.prices[row]),
+            "description": self._descriptions[row],
+            "category": CATEGORIES[self.categories[row]],
+            "tags": list(self._tags[row]),
+            "in_stock": bool(self.in_stock[row]),
+            "stock_quantity": int(self.stock_quantity[row]),
+            "created_at": from_epoch_micros(self.created_at[row]),
+            "updated_at": from_epoch_micros(self.updated_at[row])
+        }
+
+    def mask(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Evalúa todos los filtros como una única máscara vectorizada, sobre
+        todas las filas o solo sobre las filas indicadas.
+        """
+        select = slice(0, self._size) if rows is None else rows
+        mask = self.alive[select].copy()
+        if category:
+            mask &= self.categories[select] == CATEGORY_CODES[category]
+        if in_stock is not None:
+            mask &= self.in_stock[select] == in_stock
+        if min_price is not None:
+            mask &= self.prices[select] >= min_price
+        if max_price is not None:
+            mask &= self.prices[select] <= max_price
+        return mask
+
+    def text_of(self, row: int) -> Tuple[str, Optional[str]]:
+        return self._names[row], self._descriptions[row]
+
+    def tags_of(self, row: int) -> Tuple[str, ...]:
+        return self._tags[row]
+
+    def text_matches(self, row: int, needle: str) -> bool:
+        """Comprueba si needle (en minúsculas) aparece en el nombre o la descripción."""
+        description = self._descriptions[row]
+        return needle in self._names[row].lower() or bool(description and needle in description.lower())
+
+    def _alive_columns(self, spare_capacity: bool) -> dict:
+        rows = self.alive_rows()
+        columns = {}
+        for name in _ARRAY_COLUMNS:
+            column = getattr(self, name)
+            copied = np.zeros(max(len(rows) * 2, 1024) if spare_capacity else len(rows), dtype=column.dtype)
+            copied[:len(rows)] = column[rows]
+            columns[name] = copied
+        for name in _LIST_COLUMNS:
+            column = getattr(self, name)
+            columns[name] = [column[row] for row in rows.tolist()]
+        return columns
+
+    def compact(self) -> None:
+        """Elimina las filas muertas conservando el orden relativo."""
+        size = len(self)
+        for name, column in self._alive_columns(spare_capacity=True).items():
+            setattr(self, name, column)
+        self._size = size
+        self._dead = 0
+        self._index_rows()
+
+    def copy(self) -> "ColumnarProductStore":
+        """Copia compacta de las filas vivas, independiente de las escrituras posteriores."""
+        return ColumnarProductStore.from_columns(len(self), self._alive_columns(spare_capacity=False))
+
+    # -----------------------------
+    # Escritura
+    # -----------------------------
+    def _append_row(self) -> int:
+        if self._size == len(self.ids):
+            self._grow()
+        row = self._size
+        self._size += 1
+        self._names.append("")
+        self._descriptions.append(None)
+        self._tags.append(())
+        return row
+
+    def _grow(self) -> None:
+        capacity = max(len(self.ids) * 2, 1024)
+        for name in _ARRAY_COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _write_row(self, row: int, product: dict) -> None:
+        category = product["category"]
+        self.ids[row] = product["id"]
+        self.prices[row] = product["price"]
+        self.categories[row] = CATEGORY_CODES[category.value if isinstance(category, CategoryEnum) else category]
+        self.in_stock[row] = product["in_stock"]
+        self.stock_quantity[row] = product["stock_quantity"]
+        self.alive[row] = True
+        self.created_at[row] = to_epoch_micros(product["created_at"])
+        self.updated_at[row] = to_epoch_micros(product.get("updated_at"))
+        self._names[row] = product["name"]
+        # Las descripciones se repiten mucho en catálogos importados: se
+        # internan para que filas iguales compartan el mismo objeto
+        description = product.get("description")
+        self._descriptions[row] = sys.intern(description) if description else description
+        # Las etiquetas también se repiten entre productos
+        self._tags[row] = tuple(sys.intern(tag) for tag in product.get("tags") or ())
@@ -0,0 +1,285 @@
+"""
+Importación de productos desde CSV de proveedores, por bloques.
+
+El fichero se lee con pandas de chunk_size en chunk_size filas. Las
+restricciones de ProductCreate (nombre, precio, categoría, stock...) se
+comprueban sobre columnas enteras; solo las filas que no pasan se validan
+una a una con Pydantic, que decide y da el mensaje de error. Cada bloque
+se inserta con write_products en una sola sección crítica, y el índice de
+nombres del backend rechaza los nombres que ya existen o que se repiten
+dentro del fichero.
+
+Uso desde la línea de comandos:
+    python -m data.csv_import proveedor.csv --report errores.csv
+
+La CLI escribe en el backend configurado (PRODUCTS_BACKEND). Con el
+backend en memoria sin WAL los productos se perderían al salir, y con WAL
+el servidor en marcha tiene el candado: en esos casos se niega y hay que
+importar a través del servidor con POST /products/import.
+"""
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+from pydantic import ValidationError
+
+from models.product_models import MAX_TAG_LENGTH, MAX_TAGS, CategoryEnum, ProductCreate
+from exceptions.custom_exceptions import DuplicateProductNameError, StorageUnavailableError
+
+# Columnas obligatorias; description, in_stock, stock_quantity y tags son
+# opcionales. tags lleva las etiquetas separadas por comas en una celda
+# ("rojo,oferta"), la misma forma que no admite comas dentro de una etiqueta
+REQUIRED_COLUMNS = ("name", "price", "category")
+
+# Límites de ProductCreate, comprobados por columnas
+_NAME_MAX_LENGTH = 100
+_DESCRIPTION_MAX_LENGTH = 500
+_MAX_PRICE = 999999.99
+_MAX_STOCK = 9999
+_CATEGORIES = {category.value: category for category in CategoryEnum}
+# Textos que Pydantic acepta como booleanos
+_BOOLEANS = {
+    "true": True, "1": True, "yes": True, "on": True, "t": True, "y": True,
+    "false": False, "0": False, "no": False, "off": False, "f": False, "n": False
+}
+
+# Etiquetas que seguro aceptaría normalize_tags (imprimibles y sin comas);
+# las demás no se rechazan aquí, sino que pasan a la validación con Pydantic
+_SAFE_TAG = r"[\w .&+'/-]+"
+
+# Errores que se devuelven en el resumen; el resto solo va al informe
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    """Resumen de una importación, con los errores de cada fila rechazada."""
+
+    def __init__(self, error_writer: Optional[IO[str]] = None, max_errors: int = MAX_REPORTED_ERRORS):
+        self.rows = 0
+        self.created = 0
+        self.rejected = 0
+        self.errors: List[dict] = []
+        self.max_errors = max_errors
+        self._writer = None
+        if error_writer is not None:
+            self._writer = csv.writer(error_writer)
+            self._writer.writerow(["row", "name", "error"])
+
+    def reject(self, row: int, name: Optional[str], error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "name": name, "error": error})
+        if self._writer is not None:
+            self._writer.writerow([row, name, error])
+
+    def summary(self) -> dict:
+        return {
+            "rows": self.rows,
+            "created": self.created,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "errors_truncated": self.rejected > len(self.errors)
+        }
+
+
+def _read_chunks(source, chunk_size: int) -> Iterator[pd.DataFrame]:
+    # Todo como texto: las conversiones las hace la validación, que así
+    # puede informar del valor original
+    return pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False, skipinitialspace=False)
+
+
+def _check_columns(columns) -> None:
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"Faltan columnas obligatorias en el CSV: {', '.join(missing)}")
+
+
+def _validate_chunk(chunk: pd.DataFrame) -> Tuple[Dict[str, pd.Series], np.ndarray]:
+    """
+    Comprueba las restricciones por columnas. Devuelve los valores ya
+    convertidos y la máscara de filas que las cumplen todas.
+    """
+    size = len(chunk)
+    empty = pd.Series([""] * size, index=chunk.index)
+
+    name = chunk["name"]
+    stripped = name.str.strip()
+    valid = (name.str.len() <= _NAME_MAX_LENGTH) & (stripped != "")
+
+    price = pd.to_numeric(chunk["price"], errors="coerce")
+    valid &= (price > 0) & (price <= _MAX_PRICE)
+
+    category = chunk["category"]
+    valid &= category.isin(list(_CATEGORIES))
+
+    description = chunk.get("description", empty)
+    valid &= description.str.len() <= _DESCRIPTION_MAX_LENGTH
+
+    in_stock_text = chunk.get("in_stock", empty).str.strip().str.lower()
+    in_stock = in_stock_text.map(_BOOLEANS)
+    valid &= (in_stock_text == "") | in_stock.notna()
+
+    stock_text = chunk.get("stock_quantity", empty).str.strip()
+    stock = pd.to_numeric(stock_text.where(stock_text.str.fullmatch(r"\d+"), None), errors="coerce")
+    valid &= (stock_text == "") | (stock <= _MAX_STOCK)
+
+    # Una fila por etiqueta, con el índice de su fila, para comprobarlas
+    # todas a la vez
+    tags_text = chunk.get("tags", empty)
+    has_tags = (tags_text.str.strip() != "").to_numpy()
+    tags = tags_text.str.split(",").explode().str.strip().str.lower()
+    bad_tags = (tags.str.len() > MAX_TAG_LENGTH) | ~tags.str.fullmatch(_SAFE_TAG)
+    by_row = bad_tags.groupby(level=0)
+    valid &= ~(by_row.any().to_numpy() & has_tags) & (by_row.size().to_numpy() <= MAX_TAGS)
+
+    values = {
+        # Mismo resultado que el validador de ProductBase
+        "name": stripped.str.title(),
+        "price": price,
+        "category": category,
+        "description": description,
+        "in_stock": in_stock.where(in_stock_text != "", True),
+        "stock_quantity": stock.where(stock_text != "", 0),
+        "tags": tags_text
+    }
+    return values, valid.to_numpy()
+
+
+def _valid_products(values: Dict[str, pd.Series], mask: np.ndarray) -> List[dict]:
+    columns = {name: column[mask].tolist() for name, column in values.items()}
+    return [
+        {
+            "name": name,
+            "price": float(price),
+            "description": description or None,
+            "category": _CATEGORIES[category],
+            "in_stock": bool(in_stock),
+            "stock_quantity": int(stock_quantity),
+            # Como normalize_tags: sin repetir y en el orden de la celda
+            "tags": list(dict.fromkeys(tag.strip().lower() for tag in tags.split(","))) if tags.strip() else []
+        }
+        for name, price, description, category, in_stock, stock_quantity, tags in zip(
+            columns["name"], columns["price"], columns["description"],
+            columns["category"], columns["in_stock"], columns["stock_quantity"], columns["tags"]
+        )
+    ]
+
+
+def _validate_row(record: dict) -> Tuple[Optional[dict], Optional[str]]:
+    """Validación completa de una fila con Pydantic; devuelve (producto, error)."""
+    # Las celdas vacías cuentan como ausentes, igual que en la validación por columnas
+    fields = {key: value for key, value in record.items() if value != "" and key in ProductCreate.model_fields}
+    if "tags" in fields:
+        fields["tags"] = fields["tags"].split(",")
+    try:
+        return ProductCreate(**fields).dict(), None
+    except ValidationError as error:
+        messages = [
+            f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}"
+            for detail in error.errors(include_url=False)
+        ]
+        return None, "; ".join(messages)
+
+
+def import_csv(
+    source,
+    chunk_size: int = 50_000,
+    error_writer: Optional[IO[str]] = None,
+    max_errors: int = MAX_REPORTED_ERRORS
+) -> dict:
+    """
+    Importa los productos de source (ruta o fichero abierto) y devuelve el
+    resumen. Si se pasa error_writer, cada fila rechazada se escribe ahí
+    como CSV (row, name, error). Las filas se numeran desde 1 sin contar
+    la cabecera.
+    """
+    # products_data abre el backend al importarse; ver _cli_backend
+    from data import products_data
+
+    report = ImportReport(error_writer, max_errors)
+    first_row = 1
+    for chunk in _read_chunks(source, chunk_size):
+        _check_columns(chunk.columns)
+        report.rows += len(chunk)
+        rows = np.arange(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+
+        values, valid = _validate_chunk(chunk)
+        products = _valid_products(values, valid)
+        product_rows = rows[valid].tolist()
+
+        # Fallback fila a fila, solo para lo que no pasó las comprobaciones vectoriales
+        failed = ~valid
+        for row, record in zip(rows[failed].tolist(), chunk[failed].to_dict("records")):
+            product, error = _validate_row(record)
+            if error is not None:
+                report.reject(row, record.get("name"), error)
+            else:
+                products.append(product)
+                product_rows.append(row)
+
+        if not products:
+            continue
+        # En orden de fila, así un nombre repetido conserva su primera aparición.
+        # El índice de nombres del backend rechaza tanto los que ya existían
+        # como los repetidos dentro del fichero, sin guardar aquí los nombres vistos
+        pairs = sorted(zip(product_rows, products), key=lambda pair: pair[0])
+        batch_rows = [row for row, _ in pairs]
+        batch = [("create", None, product) for _, product in pairs]
+        _, results = products_data.write_products(batch)
+        for row, (_, _, product), result in zip(batch_rows, batch, results):
+            if isinstance(result, DuplicateProductNameError):
+                report.reject(row, product["name"], result.message)
+            else:
+                report.created += 1
+    return report.summary()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Importa productos desde un CSV")
+    parser.add_argument("path", help="Fichero CSV con cabecera (name, price, category, ...)")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Filas por bloque")
+    parser.add_argument("--report", help="Fichero CSV donde escribir todas las filas rechazadas")
+    args = parser.parse_args(argv)
+
+    try:
+        backend = _cli_backend()
+    except StorageUnavailableError as error:
+        print(f"error: {error.message}", file=sys.stderr)
+        return 2
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as report_file:
+            summary = import_csv(args.path, args.chunk_size, report_file)
+    else:
+        summary = import_csv(args.path, args.chunk_size)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    backend.close()
+    return 0 if summary["rejected"] == 0 else 1
+
+
+def _cli_backend():
+    """
+    Backend configurado, si la CLI puede escribir en él. products_data lo
+    abre al importarse, por eso se importa aquí: un WAL que ya tiene abierto
+    el servidor se convierte en un error claro y no en una traza. Lanza
+    StorageUnavailableError.
+    """
+    hint = "importa a través del servidor con POST /products/import"
+    try:
+        from data import products_data
+    except StorageUnavailableError as error:
+        raise StorageUnavailableError(f"{error.reason}; {hint}") from error
+    backend = products_data.get_backend()
+    if not backend.durable:
+        raise StorageUnavailableError(
+            f"el backend {backend.name} sin WAL perdería los productos al salir; {hint}"
+        )
+    return backend
+
+
+if __name__ == "__main__":
+    sys.exit(main())
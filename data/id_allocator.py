@@ -0,0 +1,84 @@
+import fcntl
+import os
+import struct
+import threading
+
+# El contador compartido es un entero de 8 bytes al principio del fichero
+_COUNTER = struct.Struct("<q")
+
+
+class IdAllocator:
+    """Contador de IDs del proceso, seguro entre hilos."""
+
+    def __init__(self, start: int = 1):
+        self._lock = threading.Lock()
+        self._next = start
+
+    def allocate(self) -> int:
+        with self._lock:
+            product_id = self._next
+            self._next += 1
+            return product_id
+
+    def observe(self, product_id: int) -> None:
+        """Garantiza que no se repartirá ningún ID menor o igual que product_id."""
+        with self._lock:
+            self._next = max(self._next, product_id + 1)
+
+    def peek(self) -> int:
+        """Siguiente ID que repartiría este proceso (para las instantáneas)."""
+        with self._lock:
+            return self._next
+
+
+class LeasedIdAllocator(IdAllocator):
+    """
+    Reparte IDs únicos entre procesos arrendando bloques de un contador en fichero.
+
+    Cada proceso toma block_size IDs de golpe, con un flock sobre el fichero
+    compartido, y los reparte después desde memoria con un candado local.
+    Solo se coordina con los demás procesos una vez por bloque, así que el
+    coste por ID no crece con el número de workers. Los IDs de un bloque que
+    no se lleguen a usar se pierden; nunca se repiten.
+    """
+
+    def __init__(self, path: str, block_size: int = 1000):
+        super().__init__(start=0)
+        self.path = path
+        self.block_size = block_size
+        # Bloque arrendado: [_next, _end)
+        self._end = 0
+        self._floor = 1
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._lease()
+            product_id = self._next
+            self._next += 1
+            return product_id
+
+    def observe(self, product_id: int) -> None:
+        with self._lock:
+            self._floor = max(self._floor, product_id + 1)
+            if self._next < self._floor:
+                # Lo que quede del bloque por debajo del mínimo no se usa
+                self._next = min(self._floor, self._end)
+
+    def peek(self) -> int:
+        with self._lock:
+            return max(self._next, self._floor)
+
+    def _lease(self) -> None:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, _COUNTER.size, 0)
+            stored = _COUNTER.unpack(raw)[0] if len(raw) == _COUNTER.size else 1
+            start = max(stored, self._floor)
+            os.pwrite(fd, _COUNTER.pack(start + self.block_size), 0)
+            # Si el contador retrocediera tras una caída se repetirían IDs
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._next, self._end = start, start + self.block_size
@@ -0,0 +1,429 @@
+from collections import Counter
+import bisect
+import heapq
+import math
+import re
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Centinelas para acotar las búsquedas por (price, id)
+_MIN_ID = float("-inf")
+_MAX_ID = float("inf")
+_EMPTY_IDS: Set[int] = frozenset()
+
+
+class PriceIndex:
+    """Índice ordenado de pares (price, id) para consultas por rango de precio."""
+
+    def __init__(self):
+        self._entries: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, price: float, product_id: int) -> None:
+        bisect.insort(self._entries, (price, product_id))
+
+    def bulk_add(self, entries: Iterable[Tuple[float, int]]) -> None:
+        """
+        Añade muchos pares (price, id) con una sola ordenación, en lugar de un
+        insort O(N) por cada uno. Para la carga inicial y la recuperación.
+        """
+        self._entries.extend(entries)
+        self._entries.sort()
+
+    def remove(self, price: float, product_id: int) -> None:
+        entry = (price, product_id)
+        index = bisect.bisect_left(self._entries, entry)
+        if index < len(self._entries) and self._entries[index] == entry:
+            del self._entries[index]
+
+    def _bounds(self, min_price: Optional[float], max_price: Optional[float]) -> Tuple[int, int]:
+        start = 0 if min_price is None else bisect.bisect_left(self._entries, (min_price, _MIN_ID))
+        end = len(self._entries) if max_price is None else bisect.bisect_right(self._entries, (max_price, _MAX_ID))
+        return start, end
+
+    def count(self, min_price: Optional[float] = None, max_price: Optional[float] = None) -> int:
+        """Cuenta los IDs del rango en O(log N)."""
+        start, end = self._bounds(min_price, max_price)
+        return max(end - start, 0)
+
+    def range(
+        self,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None
+    ) -> List[int]:
+        """Devuelve los IDs con min_price <= price <= max_price, ordenados por precio."""
+        start, end = self._bounds(min_price, max_price)
+        return [product_id for _, product_id in self._entries[start:end]]
+
+    def entries_after(
+        self,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        after: Optional[Tuple[float, int]] = None,
+        limit: int = 1024
+    ) -> List[Tuple[float, int]]:
+        """
+        Devuelve hasta limit pares (price, id) del rango, en orden y después de
+        after. Quien recorre el índice por bloques reanuda desde el último par
+        devuelto, así que las inserciones y borrados entre bloques no hacen que
+        se salte o repita ninguno.
+        """
+        start, end = self._bounds(min_price, max_price)
+        if after is not None:
+            start = max(start, bisect.bisect_right(self._entries, tuple(after)))
+        return self._entries[start:min(start + limit, end)]
+
+
+class ValueIndex:
+    """Índice invertido valor -> conjunto de IDs (categoría, in_stock, ...)."""
+
+    def __init__(self):
+        self._ids_by_value: Dict[Hashable, Set[int]] = {}
+
+    def add(self, value: Hashable, product_id: int) -> None:
+        self._ids_by_value.setdefault(value, set()).add(product_id)
+
+    def add_many(self, value: Hashable, product_ids: Iterable[int]) -> None:
+        ids = self._ids_by_value.setdefault(value, set())
+        ids.update(product_ids)
+        if not ids:
+            del self._ids_by_value[value]
+
+    def remove(self, value: Hashable, product_id: int) -> None:
+        ids = self._ids_by_value.get(value)
+        if ids is not None:
+            ids.discard(product_id)
+            if not ids:
+                del self._ids_by_value[value]
+
+    def get(self, value: Hashable) -> Set[int]:
+        """Devuelve el conjunto de IDs con ese valor (no modificar)."""
+        return self._ids_by_value.get(value, _EMPTY_IDS)
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Índice invertido de trigramas sobre textos normalizados en minúsculas.
+
+    Solo devuelve candidatos: quien lo usa debe verificar la subcadena, ya
+    que compartir todos los trigramas no garantiza que aparezca completa.
+    """
+
+    def __init__(self):
+        self._ids_by_trigram: Dict[str, Set[int]] = {}
+
+    def add(self, product_id: int, *texts: Optional[str]) -> None:
+        for trigram in self._text_trigrams(texts):
+            self._ids_by_trigram.setdefault(trigram, set()).add(product_id)
+
+    def remove(self, product_id: int, *texts: Optional[str]) -> None:
+        for trigram in self._text_trigrams(texts):
+            ids = self._ids_by_trigram.get(trigram)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._ids_by_trigram[trigram]
+
+    def candidates(self, needle: str) -> Optional[Set[int]]:
+        """
+        Devuelve los IDs que contienen todos los trigramas de needle, o None
+        si needle es demasiado corto para usar el índice.
+        """
+        trigrams = _trigrams(needle.lower())
+        if not trigrams:
+            return None
+        # Se intersecta empezando por la lista más corta
+        posting_lists = sorted((self._ids_by_trigram.get(t, _EMPTY_IDS) for t in trigrams), key=len)
+        result = set(posting_lists[0])
+        for ids in posting_lists[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    @staticmethod
+    def _text_trigrams(texts) -> Set[str]:
+        trigrams: Set[str] = set()
+        for text in texts:
+            if text:
+                trigrams |= _trigrams(text.lower())
+        return trigrams
+
+
+class NameIndex:
+    """Índice único nombre normalizado (casefold) -> ID."""
+
+    def __init__(self):
+        self._id_by_name: Dict[str, int] = {}
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.casefold()
+
+    def get(self, name: str) -> Optional[int]:
+        return self._id_by_name.get(self.normalize(name))
+
+    def add(self, name: str, product_id: int) -> None:
+        self._id_by_name[self.normalize(name)] = product_id
+
+    def remove(self, name: str, product_id: int) -> None:
+        key = self.normalize(name)
+        if self._id_by_name.get(key) == product_id:
+            del self._id_by_name[key]
+
+
+# Búsqueda por relevancia: BM25 sobre las palabras del nombre y la
+# descripción. Las palabras del nombre cuentan NAME_WEIGHT veces
+NAME_WEIGHT = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Cada palabra de la consulta se busca tal cual y, para tolerar erratas,
+# también con las MAX_EXPANSIONS palabras del vocabulario más parecidas cuya
+# similitud de trigramas llegue a SIMILARITY_THRESHOLD (el mismo umbral por
+# defecto que pg_trgm)
+SIMILARITY_THRESHOLD = 0.3
+MAX_EXPANSIONS = 3
+
+# Las listas de RankedTextIndex se rehacen como arrays cuando los productos
+# cambiados desde la última vez pasan de esta fracción de la lista
+_STALE_FRACTION = 0.125
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Palabras de text en minúsculas, en orden y con repeticiones."""
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def _merge_scores(
+    first: Tuple[np.ndarray, np.ndarray], second: Tuple[np.ndarray, np.ndarray], combine: np.ufunc
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Une dos listas (IDs ordenados, puntuaciones) combinando las de un mismo ID."""
+    ids = np.concatenate((first[0], second[0]))
+    if not len(ids):
+        return first
+    scores = np.concatenate((first[1], second[1]))
+    # Dos tramos ya ordenados: la ordenación estable (timsort) los mezcla en tiempo lineal
+    order = np.argsort(ids, kind="stable")
+    ids, scores = ids[order], scores[order]
+    starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+    return ids[starts], combine.reduceat(scores, starts)
+
+
+def term_trigrams(token: str) -> Set[str]:
+    """
+    Trigramas de una palabra para medir su parecido con otras (coeficiente
+    de Jaccard). Con relleno, como pg_trgm: los principios y finales de
+    palabra también cuentan.
+    """
+    return _trigrams(f"  {token} ")
+
+
+class RankedTextIndex:
+    """
+    Índice invertido palabra -> {id: frecuencia} para ordenar por BM25, más
+    un índice trigrama -> palabras del vocabulario para tolerar erratas.
+
+    Se mantiene producto a producto como TrigramIndex: quien lo usa pasa los
+    mismos textos al añadir y al quitar.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # Frecuencia más alta de cada palabra, para acotar su puntuación (ver
+        # search). Al quitar productos no baja: sigue siendo una cota válida
+        self._max_frequencies: Dict[str, int] = {}
+        self._lengths: Dict[int, int] = {}
+        self._total_length = 0
+        self._terms_by_trigram: Dict[str, Set[str]] = {}
+        # Listas de las palabras ya buscadas como arrays ordenados por ID (IDs,
+        # frecuencias y longitudes), y los productos de cada una que cambiaron
+        # después (ver _term_arrays)
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._stale: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    @staticmethod
+    def _frequencies(name: Optional[str], description: Optional[str]) -> Counter:
+        frequencies = Counter(tokenize(description))
+        for token in tokenize(name):
+            frequencies[token] += NAME_WEIGHT
+        return frequencies
+
+    def add(self, product_id: int, name: Optional[str], description: Optional[str]) -> None:
+        frequencies = self._frequencies(name, description)
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                for trigram in term_trigrams(term):
+                    self._terms_by_trigram.setdefault(trigram, set()).add(term)
+            postings[product_id] = frequency
+            self._mark_stale(term, product_id)
+            if frequency > self._max_frequencies.get(term, 0):
+                self._max_frequencies[term] = frequency
+        length = sum(frequencies.values())
+        self._lengths[product_id] = length
+        self._total_length += length
+
+    def remove(self, product_id: int, name: Optional[str], description: Optional[str]) -> None:
+        if product_id not in self._lengths:
+            return
+        for term in self._frequencies(name, description):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            self._mark_stale(term, product_id)
+            if not postings:
+                del self._postings[term]
+                del self._max_frequencies[term]
+                self._arrays.pop(term, None)
+                self._stale.pop(term, None)
+                for trigram in term_trigrams(term):
+                    terms = self._terms_by_trigram[trigram]
+                    terms.discard(term)
+                    if not terms:
+                        del self._terms_by_trigram[trigram]
+        self._total_length -= self._lengths.pop(product_id)
+
+    def _mark_stale(self, term: str, product_id: int) -> None:
+        stale = self._stale.get(term)
+        if stale is None:
+            return
+        stale.add(product_id)
+        # Con tantos cambios se rehará al buscarla: no hace falta seguir apuntando
+        if len(stale) > _STALE_FRACTION * len(self._postings[term]):
+            del self._arrays[term], self._stale[term]
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        La lista de term como arrays ordenados por ID: IDs, frecuencias y
+        longitudes de los productos. Se guardan entre consultas; los productos
+        que cambian después se mezclan al leer desde el diccionario, hasta que
+        pasan de _STALE_FRACTION de la lista y se tiran los arrays (ver
+        _mark_stale).
+        """
+        postings = self._postings[term]
+        stale = self._stale.get(term)
+        if stale is None:
+            ids = np.fromiter(postings, dtype=np.int64, count=len(postings))
+            order = np.argsort(ids)
+            ids = ids[order]
+            frequencies = np.fromiter(postings.values(), dtype=np.float64, count=len(postings))[order]
+            lengths = np.fromiter(
+                (self._lengths[product_id] for product_id in ids.tolist()), dtype=np.float64, count=len(ids)
+            )
+            self._arrays[term] = ids, frequencies, lengths
+            self._stale[term] = set()
+            return self._arrays[term]
+        ids, frequencies, lengths = self._arrays[term]
+        if not stale:
+            return ids, frequencies, lengths
+        changed = np.array(sorted(stale), dtype=np.int64)
+        keep = ~np.isin(ids, changed)
+        fresh = [product_id for product_id in changed.tolist() if product_id in postings]
+        ids = np.concatenate((ids[keep], np.array(fresh, dtype=np.int64)))
+        frequencies = np.concatenate((frequencies[keep], [postings[product_id] for product_id in fresh]))
+        lengths = np.concatenate((lengths[keep], [self._lengths[product_id] for product_id in fresh]))
+        order = np.argsort(ids, kind="stable")
+        return ids[order], frequencies[order], lengths[order]
+
+    def expand(self, token: str) -> List[Tuple[str, float]]:
+        """
+        Palabras del vocabulario con las que se busca token, con su similitud:
+        la propia palabra (1.0) si existe y las más parecidas por trigramas.
+        """
+        trigrams = term_trigrams(token)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._terms_by_trigram.get(trigram, ()))
+        similar = []
+        for term, common in shared.items():
+            # Cota superior de la similitud sin calcular los trigramas de term
+            if term == token or common < SIMILARITY_THRESHOLD * len(trigrams):
+                continue
+            similarity = common / (len(trigrams) + len(term_trigrams(term)) - common)
+            if similarity >= SIMILARITY_THRESHOLD:
+                similar.append((term, similarity))
+        expansions = heapq.nlargest(MAX_EXPANSIONS, similar, key=lambda item: (item[1], item[0]))
+        if token in self._postings:
+            expansions.insert(0, (token, 1.0))
+        return expansions
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        Los limit productos con mayor puntuación BM25, como (id, puntuación)
+        de mayor a menor. Cada palabra de la consulta puntúa con la mejor de
+        sus ampliaciones, multiplicada por su similitud.
+
+        Las listas se puntúan enteras con NumPy (ver _term_arrays), y las
+        palabras se recorren de mayor a menor cota de puntuación (MaxScore).
+        Cuando lo que les queda por sumar no llega al último de los limit
+        mejores, ningún producto nuevo puede entrar: se descartan los
+        candidatos que ya no alcanzan y las palabras que faltan solo se
+        buscan, por bisección, para los que quedan. El resultado es el mismo
+        que puntuando todas las coincidencias.
+        """
+        if not self._lengths or limit <= 0:
+            return []
+        documents = len(self._lengths)
+        average_length = self._total_length / documents
+        groups = []
+        for token in set(tokenize(query)):
+            terms = []
+            for term, similarity in self.expand(token):
+                matches = len(self._postings[term])
+                idf = math.log(1 + (documents - matches + 0.5) / (matches + 0.5))
+                weight = similarity * idf * (BM25_K1 + 1)
+                # Cota: la frecuencia más alta de la palabra en un producto de longitud 0
+                top = self._max_frequencies[term]
+                terms.append((term, weight, weight * top / (top + BM25_K1 * (1 - BM25_B))))
+            if terms:
+                groups.append((max(bound for _, _, bound in terms), terms))
+        groups.sort(key=lambda group: group[0], reverse=True)
+
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        scores = empty
+        candidates = None
+        for position, (_, terms) in enumerate(groups):
+            best = empty
+            for term, weight, _ in terms:
+                best = _merge_scores(best, self._term_scores(term, weight, average_length, candidates), np.maximum)
+            scores = _merge_scores(scores, best, np.add)
+            # Lo más que pueden sumar las palabras que faltan; se suma cada vez
+            # (y no restando) para que al final sea 0 exacto
+            remaining = sum(bound for bound, _ in groups[position + 1:])
+            if len(scores[0]) > limit:
+                threshold = np.partition(scores[1], -limit)[-limit]
+                # Con empate entra el ID menor: solo se descarta lo que no alcanza
+                keep = scores[1] + remaining >= threshold
+                scores = scores[0][keep], scores[1][keep]
+                if remaining < threshold:
+                    candidates = scores[0]
+        ids, values = scores
+        # A igual puntuación, antes el ID menor
+        order = np.lexsort((ids, -values))[:limit]
+        return list(zip(ids[order].tolist(), values[order].tolist()))
+
+    def _term_scores(
+        self, term: str, weight: float, average_length: float, candidates: Optional[np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Puntuación de term en los productos que la tienen, o solo en los candidatos (ordenados)."""
+        ids, frequencies, lengths = self._term_arrays(term)
+        if candidates is not None:
+            positions = np.minimum(np.searchsorted(ids, candidates), len(ids) - 1)
+            positions = positions[ids[positions] == candidates]
+            ids, frequencies, lengths = ids[positions], frequencies[positions], lengths[positions]
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+        return ids, weight * frequencies / (frequencies + norms)
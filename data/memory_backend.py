@@ -0,0 +1,854 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from models.product_models import CategoryEnum
+from exceptions.custom_exceptions import DuplicateProductNameError, ProductNotFoundError
+from data.aggregates import CatalogAggregates
+from data.backend import (
+    PRICE_BUCKET_EDGES, PRICE_BUCKETS, ProductBackend, WriteOperation, check_writes,
+    empty_facets, facets_from_columns
+)
+from data.catalog import read_catalog, write_catalog
+from data.columnar import CATEGORIES, ColumnarProductStore
+from data.id_allocator import IdAllocator
+from data.indexes import NameIndex, PriceIndex, RankedTextIndex, TrigramIndex, ValueIndex
+from data.wal import (
+    WriteAheadLog, decode_product, encode_product, lock_wal, read_records, unlock_wal
+)
+
+# Un índice solo se usa si descarta al menos 15 de cada 16 productos;
+# si no, sale más barato evaluar la máscara sobre las columnas
+_INDEX_SELECTIVITY = 16
+
+# Filas evaluadas por bloque al recorrer las columnas de forma perezosa
+_SCAN_CHUNK_ROWS = 4096
+
+# Subcadenas que verificar en cada candidato, en minúsculas: (search, name).
+# search se busca en el nombre y la descripción, name solo en el nombre
+Needle = Tuple[Optional[str], Optional[str]]
+
+
+def category_key(category) -> str:
+    return category.value if isinstance(category, CategoryEnum) else category
+
+
+class MemoryProductBackend(ProductBackend):
+    """Catálogo en memoria: columnas de NumPy más índices mantenidos en cada escritura."""
+
+    name = "memory"
+
+    def __init__(self, seed: Iterable[dict] = ()):
+        # Simulamos una base de datos en memoria, guardada por columnas
+        self.products_db = ColumnarProductStore()
+        self._price_index = PriceIndex()
+        self._category_index = ValueIndex()
+        self._in_stock_index = ValueIndex()
+        self._text_index = TrigramIndex()
+        self._ranked_index = RankedTextIndex()
+        self._name_index = NameIndex()
+        # Posting lists etiqueta -> IDs
+        self._tag_index = ValueIndex()
+        # False mientras los índices estén pendientes de construir (ver open_catalog)
+        self._indexes_ready = True
+        # Las escrituras lo toman entero (la comprobación de nombre y la escritura
+        # son atómicas); las lecturas, solo mientras evalúan cada bloque. Así una
+        # compactación nunca cambia las filas a mitad de un bloque, y entre bloques
+        # los recorridos se reanudan por ID o por (price, id), no por número de fila
+        self._lock = threading.RLock()
+        # Generación del catálogo: sube con cada escritura, y cada producto
+        # guarda la generación en que se escribió por última vez como versión.
+        # Los contadores empiezan de cero en cada instancia, por eso se
+        # publican junto con instance_id
+        self._generation = 0
+        self.instance_id = uuid.uuid4().hex[:12]
+        # True mientras instance_id sea la de un catálogo abierto con
+        # open_catalog, que comparten todos los procesos que lo abren
+        self._shared_identity = False
+        # Totales del catálogo, ajustados en _put, _remove y _load
+        self._aggregates = CatalogAggregates()
+        # Reparto de IDs autoincrementales (ver set_id_allocator)
+        self._ids = IdAllocator()
+        # Durabilidad opcional (ver open_durable)
+        self._wal: Optional[WriteAheadLog] = None
+        self._wal_lock_fd: Optional[int] = None
+        self._snapshot_path: Optional[str] = None
+        self._snapshot_every = 0
+        self._records_since_snapshot = 0
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+        self._load(seed)
+
+    # -----------------------------
+    # Durabilidad: WAL + instantáneas
+    # -----------------------------
+    @property
+    def durable(self) -> bool:
+        # Sin WAL, las escrituras solo viven en este proceso
+        return self._wal is not None
+
+    @classmethod
+    def open_durable(
+        cls,
+        wal_path: str,
+        seed: Iterable[dict] = (),
+        flush_interval: float = 0.005,
+        batch_size: int = 128,
+        snapshot_every: int = 10000
+    ) -> "MemoryProductBackend":
+        """
+        Recupera el catálogo desde la última instantánea más la cola del WAL y
+        deja el WAL activo. Los productos iniciales solo se usan si todavía no
+        hay nada en disco.
+        """
+        # Un único proceso puede ser dueño del WAL; si ya lo es otro se falla al arrancar
+        lock_fd = lock_wal(wal_path)
+        try:
+            backend = cls._recover(wal_path, seed, flush_interval, batch_size, snapshot_every)
+        except BaseException:
+            unlock_wal(lock_fd)
+            raise
+        backend._wal_lock_fd = lock_fd
+        return backend
+
+    @classmethod
+    def _recover(cls, wal_path, seed, flush_interval, batch_size, snapshot_every) -> "MemoryProductBackend":
+        snapshot_path = f"{wal_path}.snapshot"
+        old_wal_path = f"{wal_path}.old"
+        has_wal = os.path.exists(wal_path) or os.path.exists(old_wal_path)
+        snapshot = read_catalog(snapshot_path)
+
+        if snapshot is not None:
+            # La instantánea es un catálogo binario: se mapea sin decodificarla
+            last_lsn = snapshot[0]
+            backend = cls.open_catalog(snapshot_path)
+        else:
+            last_lsn = 0
+            backend = cls(seed=() if has_wal else seed)
+
+        for record in read_records(old_wal_path, wal_path):
+            if record["lsn"] > last_lsn:
+                backend._replay(record)
+                last_lsn = record["lsn"]
+
+        backend._wal = WriteAheadLog(wal_path, start_lsn=last_lsn, flush_interval=flush_interval, batch_size=batch_size)
+        backend._snapshot_path = snapshot_path
+        backend._snapshot_every = snapshot_every
+        if snapshot is None and not has_wal:
+            # Los productos iniciales también tienen que sobrevivir al reinicio
+            backend.snapshot()
+        return backend
+
+    @classmethod
+    def open_catalog(cls, path: str) -> "MemoryProductBackend":
+        """
+        Abre un catálogo binario (ver data.catalog) sin leerlo entero: las
+        columnas se mapean en memoria y los índices se construyen la primera
+        vez que hacen falta (una búsqueda, un orden por precio o una escritura).
+        Los listados, los filtros por columnas y las lecturas por ID (con
+        searchsorted sobre la columna de IDs, ordenada) funcionan desde el
+        primer momento.
+
+        Lo que se pospone se paga una vez en cada proceso: la primera
+        búsqueda, orden por precio o escritura construye todos los índices
+        (precio, categoría, stock, nombre, trigramas y relevancia), O(N) en
+        Python, y la primera escritura copia además las columnas mapeadas a
+        memoria propia para poder crecer. Para 1M de productos son segundos,
+        así que conviene calentar cada worker antes de darle tráfico.
+
+        Las versiones y la generación vienen del fichero, con su instance_id:
+        todos los procesos que abren el mismo catálogo dan las mismas ETags
+        hasta su primera escritura, en la que cada uno pasa a una identidad
+        propia.
+        """
+        _, next_id, store, identity = read_catalog(path)
+        backend = cls()
+        backend.products_db = store
+        backend._aggregates = backend._recompute_aggregates()
+        backend._ids.observe(next_id - 1)
+        backend._indexes_ready = False
+        if identity is not None:
+            backend.instance_id, backend._generation = identity
+            backend._shared_identity = True
+        return backend
+
+    def save_catalog(self, path: str, lsn: int = 0) -> None:
+        """Escribe el catálogo actual en formato binario para open_catalog."""
+        with self._lock:
+            store, next_id, generation = self.products_db.copy(), self._ids.peek(), self._generation
+        write_catalog(path, lsn, next_id, store, generation)
+
+    def _replay(self, record: dict) -> None:
+        if record["op"] == "delete":
+            self._remove(record["id"])
+        else:
+            self._put(decode_product(record["product"]))
+
+    def _log(self, record: dict) -> Optional[int]:
+        # Se llama con el candado de escritura tomado, así el orden del WAL
+        # es el mismo en que se aplicaron los cambios
+        if self._wal is None:
+            return None
+        lsn = self._wal.append(record)
+        self._records_since_snapshot += 1
+        if self._snapshot_every and self._records_since_snapshot >= self._snapshot_every:
+            self._start_snapshot()
+        return lsn
+
+    def _check_available(self) -> None:
+        # Si el WAL falló, la memoria puede tener cambios que no llegaron a
+        # disco y que desaparecerían al reiniciar: no se sirve nada más
+        if self._wal is not None:
+            self._wal.check()
+
+    def _wait_durable(self, lsn: Optional[int]) -> None:
+        # Fuera del candado: mientras se espera el fsync otras peticiones
+        # siguen escribiendo y se suman al mismo grupo
+        if lsn is not None:
+            self._wal.wait_durable(lsn)
+
+    def _start_snapshot(self) -> None:
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        self._records_since_snapshot = 0
+        self._snapshot_thread = threading.Thread(target=self.snapshot, name="products-snapshot", daemon=True)
+        self._snapshot_thread.start()
+
+    def snapshot(self) -> None:
+        """Guarda una instantánea y descarta el segmento del WAL que cubre."""
+        old_wal_path = f"{self._wal.path}.old"
+        with self._lock:
+            lsn, next_id, generation = self._wal.last_lsn, self._ids.peek(), self._generation
+            store = self.products_db.copy()
+            # Si quedó un segmento viejo de una instantánea fallida no se rota:
+            # los registros ya cubiertos se saltan al recuperar
+            if not os.path.exists(old_wal_path):
+                self._wal.rotate(old_wal_path)
+        write_catalog(self._snapshot_path, lsn, next_id, store, generation)
+        if os.path.exists(old_wal_path):
+            os.remove(old_wal_path)
+
+    def close(self) -> None:
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        if self._wal is not None:
+            self._wal.close()
+        if self._wal_lock_fd is not None:
+            unlock_wal(self._wal_lock_fd)
+            self._wal_lock_fd = None
+
+    # -----------------------------
+    # Índices
+    # -----------------------------
+    def _index_product(self, product: dict) -> None:
+        self._price_index.add(product["price"], product["id"])
+        self._index_attributes(product)
+
+    def _index_attributes(self, product: dict) -> None:
+        self._name_index.add(product["name"], product["id"])
+        self._category_index.add(category_key(product["category"]), product["id"])
+        self._in_stock_index.add(product["in_stock"], product["id"])
+        self._text_index.add(product["id"], product["name"], product.get("description"))
+        self._ranked_index.add(product["id"], product["name"], product.get("description"))
+        for tag in product.get("tags") or ():
+            self._tag_index.add(tag, product["id"])
+
+    def _load(self, products: Iterable[dict]) -> None:
+        """
+        Carga masiva (productos iniciales o instantánea) en una sola pasada.
+        El índice de precios se ordena una vez al final: insertar fila a fila
+        con insort costaría O(N²).
+        """
+        price_entries = []
+        for product in products:
+            current_product = self.products_db.get(product["id"])
+            if current_product is not None:
+                # Un ID repetido sustituye al anterior, igual que en _put
+                self._price_index.bulk_add(price_entries)
+                price_entries = []
+                self._unindex_product(current_product)
+                self._aggregates.add_product(current_product, -1)
+            self.products_db[product["id"]] = product
+            self._aggregates.add_product(product)
+            self._generation += 1
+            self.products_db.set_version(product["id"], self._generation)
+            self._index_attributes(product)
+            price_entries.append((product["price"], product["id"]))
+            self._ids.observe(product["id"])
+        self._price_index.bulk_add(price_entries)
+
+    def _ensure_indexes(self) -> None:
+        """Construye de una vez los índices de un catálogo abierto con open_catalog."""
+        if self._indexes_ready:
+            return
+        with self._lock:
+            if self._indexes_ready:
+                return
+            store = self.products_db
+            rows = store.alive_rows()
+            ids, prices = store.ids[rows], store.prices[rows]
+            order = np.lexsort((ids, prices))
+            self._price_index.bulk_add(zip(prices[order].tolist(), ids[order].tolist()))
+            categories, in_stock = store.categories[rows], store.in_stock[rows]
+            for code, category in enumerate(CATEGORIES):
+                self._category_index.add_many(category.value, ids[categories == code].tolist())
+            for value in (True, False):
+                self._in_stock_index.add_many(value, ids[in_stock == value].tolist())
+            for row, product_id in zip(rows.tolist(), ids.tolist()):
+                name, description = store.text_of(row)
+                self._name_index.add(name, product_id)
+                self._text_index.add(product_id, name, description)
+                self._ranked_index.add(product_id, name, description)
+                for tag in store.tags_of(row):
+                    self._tag_index.add(tag, product_id)
+            self._indexes_ready = True
+
+    def _unindex_product(self, product: dict) -> None:
+        self._name_index.remove(product["name"], product["id"])
+        self._price_index.remove(product["price"], product["id"])
+        self._category_index.remove(category_key(product["category"]), product["id"])
+        self._in_stock_index.remove(product["in_stock"], product["id"])
+        self._text_index.remove(product["id"], product["name"], product.get("description"))
+        self._ranked_index.remove(product["id"], product["name"], product.get("description"))
+        for tag in product.get("tags") or ():
+            self._tag_index.remove(tag, product["id"])
+
+    def _put(self, product: dict) -> None:
+        # Mientras los índices estén pendientes basta con escribir la fila:
+        # se construirán a partir del almacén ya actualizado
+        current_product = self.products_db.get(product["id"]) if self._indexes_ready else None
+        if current_product is not None:
+            self._unindex_product(current_product)
+        self._unaggregate_row(product["id"])
+        self.products_db[product["id"]] = product
+        self._aggregates.add_product(product)
+        self.products_db.set_version(product["id"], self._next_generation())
+        if self._indexes_ready:
+            self._index_product(product)
+        self._ids.observe(product["id"])
+
+    def _remove(self, product_id: int) -> Optional[dict]:
+        if product_id not in self.products_db:
+            return None
+        product = self.products_db.pop(product_id)
+        self._aggregates.add_product(product, -1)
+        self._next_generation()
+        if self._indexes_ready:
+            self._unindex_product(product)
+        return product
+
+    def _next_generation(self) -> int:
+        if self._shared_identity:
+            # Otros procesos pueden tener abierto el mismo catálogo con la misma
+            # identidad: desde la primera escritura propia el contenido es otro
+            self.instance_id = uuid.uuid4().hex[:12]
+            self._shared_identity = False
+        self._generation += 1
+        return self._generation
+
+    def _unaggregate_row(self, product_id: int) -> None:
+        # Resta la versión anterior leyendo las columnas, sin materializar el producto
+        store = self.products_db
+        if product_id in store:
+            row = store.row_of(product_id)
+            self._aggregates.add(
+                CATEGORIES[store.categories[row]], float(store.prices[row]), int(store.stock_quantity[row]), -1
+            )
+
+    def _recompute_aggregates(self) -> CatalogAggregates:
+        store = self.products_db
+        rows = store.alive_rows()
+        return CatalogAggregates.from_columns(store.categories[rows], store.prices[rows], store.stock_quantity[rows])
+
+    def _check_name_available(self, name: str, product_id: Optional[int] = None) -> None:
+        self._ensure_indexes()
+        existing_id = self._name_index.get(name)
+        if existing_id is not None and existing_id != product_id:
+            raise DuplicateProductNameError(name, existing_id)
+
+    def get_next_id(self) -> int:
+        return self._ids.allocate()
+
+    def set_id_allocator(self, allocator: IdAllocator) -> None:
+        """
+        Cambia el reparto de IDs, por ejemplo a un LeasedIdAllocator compartido
+        entre workers. El nuevo reparto nunca devuelve IDs ya usados aquí.
+        """
+        with self._lock:
+            allocator.observe(self._ids.peek() - 1)
+            self._ids = allocator
+
+    # -----------------------------
+    # Lectura y escritura
+    # -----------------------------
+    def get(self, product_id: int) -> Optional[dict]:
+        self._check_available()
+        with self._lock:
+            return self.products_db.get(product_id)
+
+    def get_many(self, product_ids: Iterable[int]) -> List[dict]:
+        # Los IDs borrados entre el filtrado y la lectura se omiten
+        self._check_available()
+        with self._lock:
+            products = [self.products_db.get(product_id) for product_id in product_ids]
+        return [product for product in products if product is not None]
+
+    def all(self) -> Iterator[dict]:
+        self._check_available()
+        store = self.products_db
+        last_id = None
+        while True:
+            with self._lock:
+                chunk = self._next_chunk(last_id)
+                if chunk is None:
+                    return
+                rows = np.flatnonzero(store.alive[chunk]) + chunk.start
+                products = [store.materialize(row) for row in rows.tolist()]
+                last_id = int(store.ids[chunk.stop - 1])
+            yield from products
+
+    def generation(self) -> int:
+        self._check_available()
+        return self._generation
+
+    def version(self, product_id: int) -> Optional[int]:
+        self._check_available()
+        with self._lock:
+            return self.products_db.version_of(product_id)
+
+    def versions(self, product_ids: List[int]) -> List[Optional[int]]:
+        self._check_available()
+        with self._lock:
+            return [self.products_db.version_of(product_id) for product_id in product_ids]
+
+    def aggregates(self) -> CatalogAggregates:
+        self._check_available()
+        with self._lock:
+            return self._aggregates.copy()
+
+    def check_aggregates(self) -> Tuple[CatalogAggregates, CatalogAggregates]:
+        self._check_available()
+        with self._lock:
+            return self._aggregates.copy(), self._recompute_aggregates()
+
+    def find_id_by_name(self, name: str) -> Optional[int]:
+        self._check_available()
+        self._ensure_indexes()
+        return self._name_index.get(name)
+
+    def _apply(self, op: str, product_id: Optional[int], product_data: Optional[dict]) -> Tuple[object, dict]:
+        """
+        Aplica una operación con el candado tomado y devuelve (resultado,
+        registro del WAL). Lanza DuplicateProductNameError o ProductNotFoundError.
+        """
+        if op == "create":
+            self._check_name_available(product_data["name"])
+            new_product = {
+                "id": self.get_next_id(),
+                "tags": [],
+                **product_data,
+                "created_at": datetime.now(),
+                "updated_at": None
+            }
+            self._put(new_product)
+            return new_product, {"op": "create", "product": encode_product(new_product)}
+
+        current_product = self.products_db.get(product_id)
+        if current_product is None:
+            raise ProductNotFoundError(product_id)
+        if op == "delete":
+            self._remove(product_id)
+            return True, {"op": "delete", "id": product_id}
+
+        if "name" in product_data:
+            self._check_name_available(product_data["name"], product_id)
+        updated_product = {
+            **current_product,
+            **product_data,
+            "updated_at": datetime.now()
+        }
+        self._put(updated_product)
+        # Se registra el producto completo para que reaplicarlo sea idempotente
+        return updated_product, {"op": "update", "product": encode_product(updated_product)}
+
+    def _write_one(self, op: str, product_id: Optional[int], product_data: Optional[dict]):
+        with self._lock:
+            self._check_available()
+            result, record = self._apply(op, product_id, product_data)
+            lsn = self._log(record)
+        self._wait_durable(lsn)
+        return result
+
+    def create(self, product_data: dict) -> dict:
+        return self._write_one("create", None, product_data)
+
+    def update(self, product_id: int, product_data: dict) -> Optional[dict]:
+        try:
+            return self._write_one("update", product_id, product_data)
+        except ProductNotFoundError:
+            return None
+
+    def delete(self, product_id: int) -> bool:
+        try:
+            return self._write_one("delete", product_id, None)
+        except ProductNotFoundError:
+            return False
+
+    def _name_of(self, product_id: int) -> Optional[str]:
+        if product_id not in self.products_db:
+            return None
+        return self.products_db.text_of(self.products_db.row_of(product_id))[0]
+
+    def write_many(self, operations: List[WriteOperation], atomic: bool = False) -> Tuple[bool, List[object]]:
+        """
+        Todo el lote se aplica con el candado tomado una sola vez y se espera
+        un único fsync, el del último registro del WAL.
+        """
+        results: List[object] = []
+        lsn = None
+        with self._lock:
+            self._check_available()
+            if atomic:
+                self._ensure_indexes()
+                errors = check_writes(operations, self._name_of, self._name_index.get)
+                if any(error is not None for error in errors):
+                    return False, errors
+            for op, product_id, product_data in operations:
+                try:
+                    result, record = self._apply(op, product_id, product_data)
+                except (DuplicateProductNameError, ProductNotFoundError) as error:
+                    results.append(error)
+                    continue
+                results.append(result)
+                lsn = self._log(record)
+        self._wait_durable(lsn)
+        return True, results
+
+    # -----------------------------
+    # Filtros
+    # -----------------------------
+    def _smallest_candidate(
+        self,
+        category: Optional[str],
+        in_stock: Optional[bool],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        id_filter: Optional[Set[int]] = None
+    ) -> Optional[List[int]]:
+        """
+        Devuelve los IDs del índice más selectivo, ya restringidos a id_filter,
+        o None si conviene la máscara.
+        """
+        if not self._indexes_ready:
+            # Sin índices la máscara sigue siendo correcta; no se construyen para esto
+            return None
+        best_size = len(self.products_db) // _INDEX_SELECTIVITY
+        best = None
+
+        if id_filter is not None and len(id_filter) <= best_size:
+            best_size, best = len(id_filter), id_filter
+
+        if category:
+            ids = self._category_index.get(category)
+            if len(ids) <= best_size:
+                best_size, best = len(ids), ids
+
+        if in_stock is not None:
+            ids = self._in_stock_index.get(in_stock)
+            if len(ids) <= best_size:
+                best_size, best = len(ids), ids
+
+        if min_price is not None or max_price is not None:
+            # El índice de precios cuenta el rango en O(log N) sin recorrerlo
+            if self._price_index.count(min_price, max_price) <= best_size:
+                best = self._price_index.range(min_price, max_price)
+
+        if best is None:
+            return None
+        if id_filter is not None and best is not id_filter:
+            # Los demás filtros se comprueban con la máscara; la restricción por IDs, aquí
+            return [product_id for product_id in best if product_id in id_filter]
+        return list(best)
+
+    def _rows_for_ids(self, product_ids) -> np.ndarray:
+        # Las filas están en orden de ID, así que ordenarlas basta
+        rows = np.fromiter(
+            (self.products_db.row_of(product_id) for product_id in product_ids),
+            dtype=np.int64,
+            count=len(product_ids)
+        )
+        rows.sort()
+        return rows
+
+    def _next_chunk(self, last_id: Optional[int]) -> Optional[slice]:
+        """Siguiente bloque de filas con ID mayor que last_id. Con el candado tomado."""
+        store = self.products_db
+        size = store.row_count
+        # Búsqueda binaria sobre la columna de IDs: vale también tras una compactación
+        start = 0 if last_id is None else int(np.searchsorted(store.ids[:size], last_id, side="right"))
+        if start >= size:
+            return None
+        return slice(start, min(start + _SCAN_CHUNK_ROWS, size))
+
+    def _text_matches(self, row: int, needle: Needle) -> bool:
+        search, name = needle
+        store = self.products_db
+        return (not search or store.text_matches(row, search)) and (not name or name in store.text_of(row)[0].lower())
+
+    def _ids_matching(self, rows, needle: Optional[Needle]) -> List[int]:
+        # Verificación final de la subcadena, solo sobre los candidatos
+        if needle:
+            rows = [row for row in rows.tolist() if self._text_matches(row, needle)]
+        return self.products_db.ids_for_rows(rows)
+
+    def _iter_ids_by_id(
+        self,
+        filters: dict,
+        id_filter: Optional[Set[int]],
+        needle: Optional[Needle],
+        after_id: Optional[int]
+    ) -> Iterator[List[int]]:
+        """Genera, por bloques y en orden de ID, los IDs que cumplen los filtros."""
+        store = self.products_db
+        with self._lock:
+            candidate_ids = self._smallest_candidate(**filters, id_filter=id_filter)
+            if candidate_ids is not None:
+                rows = self._rows_for_ids(candidate_ids)
+                if after_id is not None:
+                    rows = rows[store.ids[rows] > after_id]
+                chunk = self._ids_matching(rows[store.mask(**filters, rows=rows)], needle)
+        if candidate_ids is not None:
+            yield chunk
+            return
+
+        id_filter_array = None
+        if id_filter is not None:
+            id_filter_array = np.fromiter(id_filter, dtype=np.int64, count=len(id_filter))
+        last_id = after_id
+        while True:
+            with self._lock:
+                rows = self._next_chunk(last_id)
+                if rows is None:
+                    return
+                last_id = int(store.ids[rows.stop - 1])
+                matches = np.flatnonzero(store.mask(**filters, rows=rows)) + rows.start
+                if id_filter_array is not None:
+                    matches = matches[np.isin(store.ids[matches], id_filter_array)]
+                chunk = self._ids_matching(matches, needle)
+            yield chunk
+
+    def _iter_ids_by_price(
+        self,
+        filters: dict,
+        id_filter: Optional[Set[int]],
+        needle: Optional[Needle],
+        after: Optional[Tuple[float, int]]
+    ) -> Iterator[List[int]]:
+        """Genera, por bloques y en orden (price, id), los IDs que cumplen los filtros."""
+        store = self.products_db
+        with self._lock:
+            candidate_ids = self._smallest_candidate(**filters, id_filter=id_filter)
+            if candidate_ids is not None:
+                rows = self._rows_for_ids(candidate_ids)
+                rows = rows[store.mask(**filters, rows=rows)]
+                prices, ids = store.prices[rows], store.ids[rows]
+                if after is not None:
+                    keep = (prices > after[0]) | ((prices == after[0]) & (ids > after[1]))
+                    rows, prices, ids = rows[keep], prices[keep], ids[keep]
+                chunk = self._ids_matching(rows[np.lexsort((ids, prices))], needle)
+        if candidate_ids is not None:
+            yield chunk
+            return
+
+        # Se recorre el índice de precios desde el cursor, verificando el resto de filtros
+        self._ensure_indexes()
+        # Los bloques empiezan pequeños y crecen, porque una página suele cerrarse pronto
+        last_entry = after
+        chunk_size = 64
+        while True:
+            with self._lock:
+                entries = self._price_index.entries_after(
+                    filters["min_price"], filters["max_price"], last_entry, chunk_size
+                )
+                if not entries:
+                    return
+                last_entry = entries[-1]
+                rows = np.array([
+                    store.row_of(product_id) for _, product_id in entries
+                    if id_filter is None or product_id in id_filter
+                ], dtype=np.int64)
+                chunk = self._ids_matching(rows[store.mask(**filters, rows=rows)], needle)
+            yield chunk
+            chunk_size = min(chunk_size * 2, _SCAN_CHUNK_ROWS)
+
+    def _tag_ids(self, tags: List[str], tags_mode: str) -> Set[int]:
+        """
+        IDs con alguna (any) o todas (all) las etiquetas, desde las posting
+        lists. La intersección empieza por la lista más corta, así cada paso
+        recorre como mucho lo que queda; nunca depende del tamaño del catálogo.
+        Con el candado tomado.
+        """
+        postings = sorted((self._tag_index.get(tag) for tag in tags), key=len)
+        if tags_mode != "all":
+            return set().union(*postings)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result &= posting
+        return result
+
+    def _prepare_filters(
+        self, category, in_stock, min_price, max_price, search, tags=None, tags_mode="any", name=None
+    ):
+        self._check_available()
+        category = category_key(category) if category else None
+        filters = dict(category=category, in_stock=in_stock, min_price=min_price, max_price=max_price)
+        if search or tags or name:
+            self._ensure_indexes()
+        # IDs a los que se restringe el resultado: candidatos por trigramas
+        # (None si la búsqueda es demasiado corta) y etiquetas, que son exactas.
+        # El índice de trigramas cubre nombre y descripción, así que también
+        # da candidatos para name
+        with self._lock:
+            id_filter = None
+            for text in (search, name):
+                candidates = self._text_index.candidates(text) if text else None
+                if candidates is not None:
+                    id_filter = candidates if id_filter is None else candidates & id_filter
+            if tags:
+                tag_ids = self._tag_ids(tags, tags_mode)
+                id_filter = tag_ids if id_filter is None else tag_ids & id_filter
+        needle = (search.lower() if search else None, name.lower() if name else None) if search or name else None
+        return filters, id_filter, needle
+
+    def iter_ids(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        sort_by: str = "id",
+        after: Optional[Tuple[float, int]] = None,
+        offset: int = 0,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Iterator[int]:
+        """
+        Los primeros offset resultados se descartan por bloques, y nada se
+        evalúa hasta que quien consume pide el siguiente valor.
+        """
+        filters, id_filter, needle = self._prepare_filters(
+            category, in_stock, min_price, max_price, search, tags, tags_mode, name
+        )
+
+        if sort_by == "price":
+            chunks = self._iter_ids_by_price(filters, id_filter, needle, after)
+        else:
+            chunks = self._iter_ids_by_id(filters, id_filter, needle, None if after is None else after[1])
+
+        for ids in chunks:
+            if offset:
+                if len(ids) <= offset:
+                    offset -= len(ids)
+                    continue
+                ids, offset = ids[offset:], 0
+            yield from ids
+
+    def count(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> int:
+        filters, id_filter, needle = self._prepare_filters(
+            category, in_stock, min_price, max_price, search, tags, tags_mode, name
+        )
+        with self._lock:
+            if id_filter is None and needle is None and self._smallest_candidate(**filters) is None:
+                return int(np.count_nonzero(self.products_db.mask(**filters)))
+        return sum(len(ids) for ids in self._iter_ids_by_id(filters, id_filter, needle, None))
+
+    def facet_counts(
+        self,
+        facets: List[str],
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        filters, id_filter, needle = self._prepare_filters(
+            category, in_stock, min_price, max_price, search, tags, tags_mode, name
+        )
+        store = self.products_db
+        with self._lock:
+            unfiltered = not any(value is not None for value in filters.values()) and id_filter is None
+            if unfiltered and needle is None and self._indexes_ready:
+                return self._facets_from_indexes(facets)
+            # Una sola pasada: las filas que cumplen los filtros, y sobre ellas
+            # todas las facetas a la vez
+            candidate_ids = self._smallest_candidate(**filters, id_filter=id_filter)
+            if candidate_ids is not None:
+                rows = self._rows_for_ids(candidate_ids)
+                rows = rows[store.mask(**filters, rows=rows)]
+            else:
+                rows = np.flatnonzero(store.mask(**filters))
+                if id_filter is not None:
+                    id_filter_array = np.fromiter(id_filter, dtype=np.int64, count=len(id_filter))
+                    rows = rows[np.isin(store.ids[rows], id_filter_array)]
+            if needle:
+                rows = np.array([row for row in rows.tolist() if self._text_matches(row, needle)], dtype=np.int64)
+            return facets_from_columns(facets, store.categories[rows], store.in_stock[rows], store.prices[rows])
+
+    def _facets_from_indexes(self, facets: List[str]) -> Dict[str, Dict[str, int]]:
+        """Sin filtros, cada cuenta es el tamaño de una entrada de índice. Con el candado tomado."""
+        counts = empty_facets(facets)
+        if "category" in counts:
+            counts["category"] = {
+                category.value: len(self._category_index.get(category.value)) for category in CATEGORIES
+            }
+        if "in_stock" in counts:
+            counts["in_stock"] = {
+                "true": len(self._in_stock_index.get(True)), "false": len(self._in_stock_index.get(False))
+            }
+        if "price_bucket" in counts:
+            # Productos con precio >= cada límite, en O(log N) por tramo
+            at_least = [len(self._price_index)] + [
+                self._price_index.count(min_price=edge) for edge in PRICE_BUCKET_EDGES
+            ] + [0]
+            counts["price_bucket"] = {
+                bucket: at_least[position] - at_least[position + 1] for position, bucket in enumerate(PRICE_BUCKETS)
+            }
+        return counts
+
+    def ranked_search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        # El índice se mantiene con cada escritura: la consulta solo recorre
+        # las posting lists de las palabras de query y de sus ampliaciones
+        self._check_available()
+        self._ensure_indexes()
+        with self._lock:
+            return self._ranked_index.search(query, limit)
+
+    def sort_key(self, product_id: int, sort_by: str = "id") -> Optional[Tuple[float, int]]:
+        self._check_available()
+        with self._lock:
+            if product_id not in self.products_db:
+                return None
+            row = self.products_db.row_of(product_id)
+            key = float(self.products_db.prices[row]) if sort_by == "price" else product_id
+        return key, product_id
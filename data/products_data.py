@@ -1,9 +1,19 @@
 from datetime import datetime
-from typing import Dict, List, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import os
+
+import orjson
 from models.product_models import ProductResponse, CategoryEnum
+from data.backend import ProductBackend, WriteOperation
+from data.id_allocator import LeasedIdAllocator
+from data.memory_backend import MemoryProductBackend
+from data.query_cache import QueryCache
+from data.shared_memory_backend import SharedMemoryProductBackend
+from data.sqlite_backend import SQLiteProductBackend
 
-# Simulamos una base de datos en memoria
-products_db: Dict[int, dict] = {
+# Productos iniciales de la base de datos simulada
+_SEED_PRODUCTS: Dict[int, dict] = {
     1: {
         "id": 1,
         "name": "Laptop Gaming",
@@ -39,67 +49,268 @@ products_db: Dict[int, dict] = {
     }
 }
 
-# Counter para IDs autoincrementales
-next_id = 4
+# Backend de almacenamiento: "memory" (por defecto), "sqlite" o "shm"
+PRODUCTS_BACKEND = os.environ.get("PRODUCTS_BACKEND", "memory")
+PRODUCTS_SQLITE_PATH = os.environ.get("PRODUCTS_SQLITE_PATH", "products.db")
+
+# Durabilidad del backend en memoria: si hay ruta de WAL, cada escritura se
+# registra y se confirma con group commit, con instantáneas periódicas
+PRODUCTS_WAL_PATH = os.environ.get("PRODUCTS_WAL_PATH")
+PRODUCTS_WAL_FLUSH_INTERVAL_MS = float(os.environ.get("PRODUCTS_WAL_FLUSH_INTERVAL_MS", "5"))
+PRODUCTS_WAL_BATCH_SIZE = int(os.environ.get("PRODUCTS_WAL_BATCH_SIZE", "128"))
+PRODUCTS_SNAPSHOT_EVERY = int(os.environ.get("PRODUCTS_SNAPSHOT_EVERY", "10000"))
+
+# Backend "shm": catálogo en memoria compartida entre los workers
+PRODUCTS_SHM_NAME = os.environ.get("PRODUCTS_SHM_NAME", "products_catalog")
+PRODUCTS_SHM_CAPACITY = int(os.environ.get("PRODUCTS_SHM_CAPACITY", "100000"))
+PRODUCTS_SHM_TEXT_BYTES = int(os.environ.get("PRODUCTS_SHM_TEXT_BYTES", str(64 * 1024 * 1024)))
+# Etiquetas distintas con lista de filas propia; cada una ocupa un bit por fila
+PRODUCTS_SHM_TAG_SLOTS = int(os.environ.get("PRODUCTS_SHM_TAG_SLOTS", "1024"))
+
+# Catálogo binario que cada worker mapea en memoria al arrancar, en lugar de
+# reconstruir el almacén (solo backend en memoria y sin WAL)
+PRODUCTS_CATALOG_PATH = os.environ.get("PRODUCTS_CATALOG_PATH")
+
+# Fichero con el contador de IDs compartido por los workers: cada proceso
+# arrienda bloques de PRODUCTS_ID_BLOCK_SIZE IDs (solo backend en memoria;
+# SQLite ya reparte IDs únicos con AUTOINCREMENT)
+PRODUCTS_ID_LEASE_PATH = os.environ.get("PRODUCTS_ID_LEASE_PATH")
+PRODUCTS_ID_BLOCK_SIZE = int(os.environ.get("PRODUCTS_ID_BLOCK_SIZE", "1000"))
+
+# Caché de fragmentos JSON por producto (ver get_products_json), en bytes
+PRODUCTS_FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("PRODUCTS_FRAGMENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
 
-def get_next_id() -> int:
-    global next_id
-    current_id = next_id
-    next_id += 1
-    return current_id
+def create_backend(name: str = PRODUCTS_BACKEND) -> ProductBackend:
+    backend = _open_backend(name)
+    if isinstance(backend, MemoryProductBackend) and PRODUCTS_ID_LEASE_PATH:
+        backend.set_id_allocator(LeasedIdAllocator(PRODUCTS_ID_LEASE_PATH, PRODUCTS_ID_BLOCK_SIZE))
+    return backend
+
+def _open_backend(name: str) -> ProductBackend:
+    if name == "memory" and PRODUCTS_WAL_PATH:
+        return MemoryProductBackend.open_durable(
+            PRODUCTS_WAL_PATH,
+            seed=_SEED_PRODUCTS.values(),
+            flush_interval=PRODUCTS_WAL_FLUSH_INTERVAL_MS / 1000,
+            batch_size=PRODUCTS_WAL_BATCH_SIZE,
+            snapshot_every=PRODUCTS_SNAPSHOT_EVERY
+        )
+    if name == "memory" and PRODUCTS_CATALOG_PATH and os.path.exists(PRODUCTS_CATALOG_PATH):
+        return MemoryProductBackend.open_catalog(PRODUCTS_CATALOG_PATH)
+    if name == "memory":
+        return MemoryProductBackend(seed=_SEED_PRODUCTS.values())
+    if name == "shm":
+        return SharedMemoryProductBackend(
+            PRODUCTS_SHM_NAME,
+            capacity=PRODUCTS_SHM_CAPACITY,
+            text_bytes=PRODUCTS_SHM_TEXT_BYTES,
+            tag_slots=PRODUCTS_SHM_TAG_SLOTS,
+            seed=_SEED_PRODUCTS.values()
+        )
+    if name == "sqlite":
+        return SQLiteProductBackend(PRODUCTS_SQLITE_PATH, seed=_SEED_PRODUCTS.values())
+    raise ValueError(f"Backend de productos desconocido: {name}")
+
+_backend = create_backend()
+
+# Cada fragmento va etiquetado con (instance_id, versión) del producto: una
+# versión distinta, también si la escribió otro proceso, cuenta como fallo
+_fragments = QueryCache(PRODUCTS_FRAGMENT_CACHE_MAX_BYTES)
+
+def get_backend() -> ProductBackend:
+    return _backend
+
+def set_backend(backend: ProductBackend) -> ProductBackend:
+    """Cambia el backend activo y devuelve el anterior."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
 
 def get_all_products() -> List[dict]:
-    return list(products_db.values())
+    return list(_backend.all())
 
 def get_product_by_id(product_id: int) -> Optional[dict]:
-    return products_db.get(product_id)
+    return _backend.get(product_id)
+
+def find_product_id_by_name(name: str) -> Optional[int]:
+    """Busca un producto por nombre sin distinguir mayúsculas."""
+    return _backend.find_id_by_name(name)
 
 def create_product(product_data: dict) -> dict:
-    product_id = get_next_id()
-    new_product = {
-        "id": product_id,
-        **product_data,
-        "created_at": datetime.now(),
-        "updated_at": None
-    }
-    products_db[product_id] = new_product
-    return new_product
+    return _backend.create(product_data)
+
+def get_products_by_ids(product_ids: Iterable[int]) -> List[dict]:
+    return _backend.get_many(product_ids)
 
 def update_product(product_id: int, product_data: dict) -> Optional[dict]:
-    if product_id in products_db:
-        updated_product = {
-            **products_db[product_id],
-            **product_data,
-            "updated_at": datetime.now()
-        }
-        products_db[product_id] = updated_product
-        return updated_product
-    return None
+    _fragments.discard(product_id)
+    return _backend.update(product_id, product_data)
 
 def delete_product(product_id: int) -> bool:
-    if product_id in products_db:
-        del products_db[product_id]
-        return True
-    return False
+    _fragments.discard(product_id)
+    return _backend.delete(product_id)
 
-def filter_products(
+def get_products_json(product_ids: Iterable[int]) -> List[Tuple[int, bytes]]:
+    """
+    Devuelve (id, JSON del producto) en el orden pedido, omitiendo los que ya
+    no existan. El JSON es el de ProductResponse y se guarda en caché por
+    versión, así que leer un producto que no ha cambiado no vuelve a
+    materializarlo ni a serializarlo.
+    """
+    instance_id = _backend.instance_id
+    fragments: Dict[int, bytes] = {}
+    missing: Dict[int, int] = {}
+    product_ids = list(product_ids)
+    # Las versiones se leen antes que los productos: si uno cambia entre
+    # medias, su fragmento queda con una etiqueta vieja y la siguiente lectura falla
+    for product_id, version in zip(product_ids, _backend.versions(product_ids)):
+        if version is None:
+            continue
+        fragment = _fragments.get(product_id, (instance_id, version))
+        if fragment is None:
+            missing[product_id] = version
+        else:
+            fragments[product_id] = fragment
+
+    for product in _backend.get_many(missing):
+        fragment = orjson.dumps(product)
+        _fragments.put(product["id"], (instance_id, missing[product["id"]]), fragment)
+        fragments[product["id"]] = fragment
+    return [(product_id, fragments[product_id]) for product_id in product_ids if product_id in fragments]
+
+def fragment_cache_stats() -> Dict[str, int]:
+    return _fragments.stats()
+
+def get_catalog_stats() -> dict:
+    """Totales del catálogo, en total y por categoría, sin recorrer los productos."""
+    return _backend.aggregates().as_dict()
+
+def check_catalog_stats() -> dict:
+    """
+    Recalcula los totales desde cero y los compara con los mantenidos en
+    cada escritura. drift lleva la diferencia (mantenido - recalculado) de
+    cada campo que no coincide.
+    """
+    kept, fresh = _backend.check_aggregates()
+    return {"consistent": kept == fresh, "drift": kept.drift(fresh), "stats": fresh.as_dict()}
+
+def catalog_generation() -> Tuple[str, int]:
+    """(instance_id, generación) del backend activo: cambia con cada escritura."""
+    return _backend.instance_id, _backend.generation()
+
+def product_version(product_id: int) -> Optional[Tuple[str, int]]:
+    """(instance_id, versión) del producto, o None si no existe."""
+    version = _backend.version(product_id)
+    return None if version is None else (_backend.instance_id, version)
+
+def iter_product_ids(
     category: Optional[str] = None,
     in_stock: Optional[bool] = None,
     min_price: Optional[float] = None,
-    max_price: Optional[float] = None
-) -> List[dict]:
-    products = get_all_products()
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    sort_by: str = "id",
+    after: Optional[Tuple[float, int]] = None,
+    offset: int = 0,
+    tags: Optional[List[str]] = None,
+    tags_mode: str = "any",
+    name: Optional[str] = None
+) -> Iterator[int]:
+    """
+    Genera perezosamente los IDs que cumplen todos los filtros, ordenados por
+    sort_by ("id" o "price") y empezando justo después de after, que es la
+    pareja (clave de orden, id) del último producto ya entregado. Con tags,
+    solo los productos con alguna (tags_mode="any") o todas ("all") las
+    etiquetas. search busca en el nombre y la descripción; name, solo en el nombre.
+    """
+    return _backend.iter_ids(
+        category, in_stock, min_price, max_price, search, sort_by, after, offset,
+        tags=tags, tags_mode=tags_mode, name=name
+    )
+
+def ranked_product_ids(query: str, limit: int = 10) -> List[Tuple[int, float]]:
+    """Los limit productos más relevantes para query, como (id, puntuación) de mayor a menor."""
+    return _backend.ranked_search(query, limit)
 
-    if category:
-        products = [p for p in products if p["category"] == category]
+def sort_key_of(product_id: int, sort_by: str = "id") -> Optional[Tuple[float, int]]:
+    """Devuelve la pareja (clave de orden, id) que usa iter_product_ids como cursor, o None si ya no existe."""
+    return _backend.sort_key(product_id, sort_by)
 
-    if in_stock is not None:
-        products = [p for p in products if p["in_stock"] == in_stock]
+def filter_product_ids(
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    sort_by: str = "id"
+) -> List[int]:
+    """Devuelve, en el orden pedido, los IDs que cumplen todos los filtros."""
+    return list(iter_product_ids(category, in_stock, min_price, max_price, search, sort_by))
 
-    if min_price is not None:
-        products = [p for p in products if p["price"] >= min_price]
+def count_product_ids(
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    tags_mode: str = "any",
+    name: Optional[str] = None
+) -> int:
+    """Cuenta los productos que cumplen los filtros sin materializar IDs ni productos."""
+    return _backend.count(
+        category, in_stock, min_price, max_price, search, tags=tags, tags_mode=tags_mode, name=name
+    )
 
-    if max_price is not None:
-        products = [p for p in products if p["price"] <= max_price]
+def facet_counts(
+    facets: List[str],
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    tags_mode: str = "any",
+    name: Optional[str] = None
+) -> Dict[str, Dict[str, int]]:
+    """Cuentas por faceta (ver data.backend.FACETS) de los productos que cumplen los filtros."""
+    return _backend.facet_counts(
+        facets, category, in_stock, min_price, max_price, search, tags=tags, tags_mode=tags_mode, name=name
+    )
+
+def iter_products(
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    search: Optional[str] = None,
+    chunk_size: int = 1000
+) -> Iterator[dict]:
+    """
+    Genera los productos que cumplen los filtros, en orden de ID, leyendo de
+    chunk_size en chunk_size: la memoria no depende del tamaño del catálogo.
+    """
+    product_ids = iter_product_ids(category, in_stock, min_price, max_price, search)
+    while True:
+        chunk = list(islice(product_ids, chunk_size))
+        if not chunk:
+            return
+        yield from get_products_by_ids(chunk)
+
+def filter_products(
+    category: Optional[str] = None,
+    in_stock: Optional[bool] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None
+) -> List[dict]:
+    return get_products_by_ids(iter_product_ids(category, in_stock, min_price, max_price))
 
-    return products
\ No newline at end of file
+def write_products(operations: List[WriteOperation], atomic: bool = False) -> Tuple[bool, List[object]]:
+    """
+    Aplica un lote de altas, cambios y bajas en una sola sección crítica del
+    backend (ver ProductBackend.write_many).
+    """
+    for _, product_id, _ in operations:
+        if product_id is not None:
+            _fragments.discard(product_id)
+    return _backend.write_many(operations, atomic)
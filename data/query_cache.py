@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+import os
+import threading
+
+# Tamaño máximo de la caché de listados, en bytes de respuesta; 0 la desactiva
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("PRODUCTS_QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Coste aproximado de cada entrada aparte del cuerpo (clave, tupla, nodo del dict)
+_ENTRY_OVERHEAD = 256
+
+
+class QueryCache:
+    """
+    Caché LRU de respuestas ya serializadas, limitada por bytes.
+
+    Cada entrada guarda la generación del catálogo con la que se calculó. No
+    hace falta invalidar nada al escribir: una entrada de otra generación se
+    descarta al encontrarla, y las que nadie vuelve a pedir salen por LRU.
+    """
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, generation: Hashable) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != generation:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, generation: Hashable, body: bytes) -> None:
+        size = len(body) + _ENTRY_OVERHEAD
+        # Una respuesta que ocuparía más de un cuarto de la caché la vaciaría casi entera
+        if size * 4 > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (generation, body)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def _drop(self, key: Hashable) -> None:
+        _, body = self._entries.pop(key)
+        self._bytes -= len(body) + _ENTRY_OVERHEAD
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
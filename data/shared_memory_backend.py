@@ -0,0 +1,983 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+from exceptions.custom_exceptions import (
+    DuplicateProductNameError, ProductNotFoundError, StorageUnavailableError
+)
+from data.aggregates import CatalogAggregates
+from data.backend import ProductBackend, WriteOperation, check_writes, facets_from_columns
+from data.columnar import CATEGORIES, CATEGORY_CODES, from_epoch_micros, to_epoch_micros
+from data.indexes import RankedTextIndex
+from data.memory_backend import category_key
+from models.product_models import MAX_TAGS
+
+# Cabecera: enteros de 64 bits al principio del segmento
+_MAGIC = 0x384D4853444F5250  # "PRODSHM8"
+(
+    _MAGIC_FIELD, _SEQ, _SIZE, _CAPACITY, _NEXT_ID, _ARENA_USED, _ARENA_CAPACITY, _NONCE,
+    _WRITER_PID, _COMPACTING, _NAME_SLOTS_USED, _TAG_SLOTS, _TAG_SLOTS_USED, _TAG_OVERFLOW
+) = range(14)
+_HEADER_BYTES = 128
+# Tras la cabecera, el vector de CatalogAggregates (múltiplo de 8 bytes)
+_AGGREGATES_BYTES = 8 * CatalogAggregates.SIZE
+# Después, la tabla hash de nombres con direccionamiento abierto (ver
+# _find_row_by_name): cada hueco guarda fila + 1, 0 si está libre o
+# _DELETED_SLOT si se borró. Tiene al menos el doble de huecos que filas y
+# se reconstruye cuando los ocupados y borrados pasan de 3/4
+_DELETED_SLOT = -1
+# Luego, una matriz (capacidad, MAX_TAGS) con el hash de cada etiqueta de
+# cada fila; 0 marca un hueco libre
+_TAG_HASHES_ITEMSIZE = 8 * MAX_TAGS
+# Y las listas de filas por etiqueta: una tabla hash de _TAG_SLOTS huecos
+# (hash de la etiqueta, 0 si está libre) y un mapa de bits por hueco con un
+# bit por fila. Si se llenan las tres
+# cuartas partes de la tabla, las etiquetas que no caben solo se encuentran
+# recorriendo tag_hashes (ver _tag_rows)
+
+# Columnas de tamaño fijo, de mayor a menor tamaño de elemento para que
+# todas queden alineadas. Los textos van en un área de bytes aparte
+_COLUMNS = (
+    ("ids", np.int64),
+    ("prices", np.float64),
+    ("created_at", np.int64),
+    ("updated_at", np.int64),
+    ("versions", np.int64),
+    ("name_hashes", np.int64),
+    ("name_offsets", np.int64),
+    ("description_offsets", np.int64),
+    ("tag_offsets", np.int64),
+    ("name_lengths", np.int32),
+    ("description_lengths", np.int32),
+    ("tag_lengths", np.int32),
+    ("stock_quantity", np.int32),
+    ("categories", np.int8),
+    ("in_stock", np.bool_),
+    ("alive", np.bool_),
+)
+
+_SCAN_CHUNK_ROWS = 4096
+# Vueltas que da un lector ante una secuencia impar antes de comprobar si
+# el escritor sigue vivo
+_SPINS_BEFORE_PROBE = 1024
+
+
+def _name_hash(name: str) -> int:
+    # hash() de Python cambia entre procesos; blake2b no
+    digest = hashlib.blake2b(name.casefold().encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _tag_hash(tag: str) -> int:
+    # El 0 queda libre para los huecos de tag_hashes
+    return _name_hash(tag) or 1
+
+
+def _text_bytes(product: dict) -> int:
+    """Bytes del área de textos que ocupa product al escribirlo (ver _write_row)."""
+    texts = (product.get("name"), product.get("description"), ",".join(product.get("tags") or ()))
+    return sum(len(text.encode("utf-8")) for text in texts if text)
+
+
+def _name_slot_count(capacity: int) -> int:
+    # Potencia de dos para elegir el hueco con una máscara
+    return 1 << max(2 * capacity - 1, 1).bit_length()
+
+
+def _tag_slot_count(tag_slots: int) -> int:
+    return 1 << max(tag_slots - 1, 1).bit_length()
+
+
+def _bitmap_bytes(capacity: int) -> int:
+    # Múltiplo de 8 para que las columnas que siguen queden alineadas
+    return 8 * -(-capacity // 64)
+
+
+def _segment_size(capacity: int, arena_capacity: int, tag_slots: int) -> int:
+    return (
+        _HEADER_BYTES + _AGGREGATES_BYTES + 8 * _name_slot_count(capacity) + _TAG_HASHES_ITEMSIZE * capacity
+        + tag_slots * (8 + _bitmap_bytes(capacity))
+        + sum(np.dtype(dtype).itemsize * capacity for _, dtype in _COLUMNS) + arena_capacity
+    )
+
+
+class SharedMemoryProductBackend(ProductBackend):
+    """
+    Catálogo en un segmento de multiprocessing.shared_memory compartido por
+    todos los workers.
+
+    Las columnas tienen capacidad fija y los textos se guardan en un área de
+    bytes en la que solo se añade. Un único escritor a la vez (flock sobre un
+    fichero de bloqueo) publica los cambios con un seqlock: pone el contador
+    de secuencia en impar, escribe y lo vuelve a poner en par. Los lectores
+    no toman ningún candado ni hacen IPC: leen directamente del segmento y
+    repiten la lectura si la secuencia cambió mientras tanto.
+
+    Las filas se añaden en orden de ID (el escritor reparte los IDs) y los
+    borrados solo marcan la fila. Cuando una escritura no cabe, el escritor
+    compacta antes: quita las filas borradas y el texto reemplazado sin
+    cambiar el orden de las filas, así que los recorridos se reanudan por ID
+    aunque se compacte entre dos bloques.
+
+    Los filtros por etiqueta leen una lista de filas por etiqueta (un mapa
+    de bits en el segmento, hasta tag_slots etiquetas distintas) en lugar
+    de los hashes de todas las etiquetas de cada fila.
+    """
+
+    name = "shm"
+
+    def __init__(
+        self,
+        segment_name: str,
+        capacity: int = 100_000,
+        text_bytes: int = 64 * 1024 * 1024,
+        seed: Iterable[dict] = (),
+        lock_path: Optional[str] = None,
+        tag_slots: int = 1024
+    ):
+        self.segment_name = segment_name
+        self._thread_lock = threading.Lock()
+        # Índice de relevancia propio de este proceso (ver _refresh_ranked_index):
+        # los textos e IDs que tiene y la generación del segmento que refleja
+        self._ranked_lock = threading.Lock()
+        self._ranked_index = RankedTextIndex()
+        self._ranked_texts: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._ranked_ids = np.zeros(0, dtype=np.int64)
+        self._ranked_generation = -1
+        lock_path = lock_path or os.path.join(tempfile.gettempdir(), f"{segment_name}.lock")
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # Otra apertura del mismo fichero: flock la trata como otro dueño, así
+        # que choca también con el candado de escritura de este proceso
+        self._probe_fd = os.open(lock_path, os.O_RDWR)
+
+        # La creación va bajo el candado de escritura: solo un proceso crea y siembra
+        with self._writer():
+            try:
+                self._shm = shared_memory.SharedMemory(name=segment_name)
+                created = False
+            except FileNotFoundError:
+                tag_slots = _tag_slot_count(tag_slots)
+                self._shm = shared_memory.SharedMemory(
+                    name=segment_name, create=True, size=_segment_size(capacity, text_bytes, tag_slots)
+                )
+                created = True
+            # El segmento vive más que el proceso que lo crea: que el
+            # resource_tracker no lo borre al salir un worker
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+            self._header = np.ndarray((_HEADER_BYTES // 8,), dtype=np.int64, buffer=self._shm.buf)
+            if created:
+                self._header[:] = 0
+                self._header[_CAPACITY] = capacity
+                self._header[_ARENA_CAPACITY] = text_bytes
+                self._header[_TAG_SLOTS] = tag_slots
+                self._header[_NEXT_ID] = 1
+                # Distingue este segmento de otro creado después con el mismo nombre
+                self._header[_NONCE] = int.from_bytes(os.urandom(7), "little")
+            elif self._header[_MAGIC_FIELD] != _MAGIC:
+                raise StorageUnavailableError(f"el segmento {segment_name} no es un catálogo de productos")
+            self._map_columns()
+            self.instance_id = f"{segment_name}-{int(self._header[_NONCE]):x}"
+            if created:
+                for product in seed:
+                    self._append(product)
+                self._header[_MAGIC_FIELD] = _MAGIC
+
+    def _map_columns(self) -> None:
+        capacity = int(self._header[_CAPACITY])
+        self._aggregates = CatalogAggregates(np.ndarray(
+            (CatalogAggregates.SIZE,), dtype=np.int64, buffer=self._shm.buf, offset=_HEADER_BYTES
+        ))
+        offset = _HEADER_BYTES + _AGGREGATES_BYTES
+        self._name_slots = np.ndarray((_name_slot_count(capacity),), dtype=np.int64, buffer=self._shm.buf, offset=offset)
+        offset += self._name_slots.nbytes
+        self.tag_hashes = np.ndarray((capacity, MAX_TAGS), dtype=np.int64, buffer=self._shm.buf, offset=offset)
+        offset += _TAG_HASHES_ITEMSIZE * capacity
+        tag_slots = int(self._header[_TAG_SLOTS])
+        self._tag_keys = np.ndarray((tag_slots,), dtype=np.int64, buffer=self._shm.buf, offset=offset)
+        offset += self._tag_keys.nbytes
+        self._tag_bitmaps = np.ndarray(
+            (tag_slots, _bitmap_bytes(capacity)), dtype=np.uint8, buffer=self._shm.buf, offset=offset
+        )
+        offset += self._tag_bitmaps.nbytes
+        for name, dtype in _COLUMNS:
+            setattr(self, name, np.ndarray((capacity,), dtype=dtype, buffer=self._shm.buf, offset=offset))
+            offset += np.dtype(dtype).itemsize * capacity
+        self._arena = np.ndarray((int(self._header[_ARENA_CAPACITY]),), dtype=np.uint8, buffer=self._shm.buf, offset=offset)
+
+    def close(self) -> None:
+        # Las vistas de NumPy tienen que soltarse antes de cerrar el segmento
+        for name, _ in _COLUMNS:
+            setattr(self, name, None)
+        self._header = self._arena = self._aggregates = self.tag_hashes = self._name_slots = None
+        self._tag_keys = self._tag_bitmaps = None
+        self._shm.close()
+        os.close(self._lock_fd)
+        os.close(self._probe_fd)
+
+    def unlink(self) -> None:
+        """Destruye el segmento; los procesos que lo tengan abierto siguen viéndolo hasta cerrarlo."""
+        # unlink() da de baja el segmento en el resource_tracker, donde se quitó al abrirlo
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+
+    # -----------------------------
+    # Seqlock
+    # -----------------------------
+    @contextmanager
+    def _writer(self):
+        # Candado entre hilos y entre procesos; flock solo distingue procesos
+        with self._thread_lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write(self):
+        with self._writer():
+            if int(self._header[_SEQ]) % 2:
+                # Con el candado tomado, una secuencia impar solo puede dejarla
+                # un escritor que murió a medias: se repara y esta escritura
+                # cierra su ventana también
+                self._recover()
+            self._header[_SEQ] = int(self._header[_SEQ]) | 1
+            self._header[_WRITER_PID] = os.getpid()
+            try:
+                yield
+            finally:
+                self._header[_SEQ] += 1
+
+    def _abandoned_write(self) -> bool:
+        """Indica si la secuencia está impar sin nadie con el candado de escritura."""
+        try:
+            fcntl.flock(self._probe_fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            # Con el candado compartido nadie puede estar escribiendo
+            return bool(int(self._header[_SEQ]) % 2)
+        finally:
+            fcntl.flock(self._probe_fd, fcntl.LOCK_UN)
+
+    def _recover(self) -> None:
+        """
+        Repara, con el candado de escritura, lo que dejó un escritor muerto.
+        Los agregados, la tabla de nombres y las listas de etiquetas se
+        recalculan desde las columnas; la fila que estaba escribiendo puede
+        quedar con parte de los valores nuevos, pero cada campo es válido. Una compactación a medias no se puede deshacer:
+        lanza StorageUnavailableError y la secuencia se queda impar.
+        """
+        pid = int(self._header[_WRITER_PID])
+        if self._header[_COMPACTING]:
+            raise StorageUnavailableError(
+                f"el proceso {pid} murió compactando el segmento {self.segment_name}; hay que recrearlo"
+            )
+        rows = np.flatnonzero(self.alive[:self._size])
+        self._aggregates.values[:] = CatalogAggregates.from_columns(
+            self.categories[rows], self.prices[rows], self.stock_quantity[rows]
+        ).values
+        self._rebuild_name_slots()
+        self._rebuild_tag_rows()
+
+    def _read(self, read: Callable):
+        """
+        Ejecuta read() hasta obtener un resultado sin escrituras a la vez. Si
+        la escritura en curso es de un proceso muerto, la repara antes.
+        """
+        spins = 0
+        while True:
+            start = int(self._header[_SEQ])
+            if start % 2:
+                spins += 1
+                if spins % _SPINS_BEFORE_PROBE == 0 and self._abandoned_write():
+                    # Una escritura vacía: _write() repara al ver la secuencia impar
+                    with self._write():
+                        pass
+                    continue
+                # Hay una escritura en curso; se cede el GIL por si es de este proceso
+                time.sleep(0)
+                continue
+            try:
+                result = read()
+            except Exception:
+                # Una lectura a medias puede ver datos rotos; solo es un error
+                # de verdad si no hubo escrituras mientras tanto
+                if int(self._header[_SEQ]) == start:
+                    raise
+                continue
+            if int(self._header[_SEQ]) == start:
+                return result
+
+    # -----------------------------
+    # Filas
+    # -----------------------------
+    @property
+    def _size(self) -> int:
+        return int(self._header[_SIZE])
+
+    def _row_of(self, product_id: int) -> Optional[int]:
+        size = self._size
+        row = int(np.searchsorted(self.ids[:size], product_id))
+        if row < size and self.ids[row] == product_id and self.alive[row]:
+            return row
+        return None
+
+    def _text(self, offset: int, length: int) -> Optional[str]:
+        if length < 0:
+            return None
+        return self._arena[offset:offset + length].tobytes().decode("utf-8")
+
+    def _texts(self, row: int) -> Tuple[str, Optional[str]]:
+        return (
+            self._text(self.name_offsets[row], self.name_lengths[row]),
+            self._text(self.description_offsets[row], self.description_lengths[row])
+        )
+
+    def _tags(self, row: int) -> List[str]:
+        # Las etiquetas van juntas, separadas por comas (ver normalize_tags)
+        joined = self._text(self.tag_offsets[row], self.tag_lengths[row])
+        return joined.split(",") if joined else []
+
+    def _materialize(self, row: int) -> dict:
+        name, description = self._texts(row)
+        return {
+            "id": int(self.ids[row]),
+            "name": name,
+            "price": float(self.prices[row]),
+            "description": description,
+            "category": CATEGORIES[self.categories[row]],
+            "in_stock": bool(self.in_stock[row]),
+            "stock_quantity": int(self.stock_quantity[row]),
+            "created_at": from_epoch_micros(self.created_at[row]),
+            "updated_at": from_epoch_micros(self.updated_at[row]),
+            "tags": self._tags(row)
+        }
+
+    def _store_text(self, text: Optional[str]) -> Tuple[int, int]:
+        if text is None:
+            return 0, -1
+        data = np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+        offset = int(self._header[_ARENA_USED])
+        if offset + len(data) > len(self._arena):
+            raise StorageUnavailableError("no queda espacio para textos en el segmento compartido")
+        self._arena[offset:offset + len(data)] = data
+        self._header[_ARENA_USED] = offset + len(data)
+        return offset, len(data)
+
+    def _write_row(self, row: int, product: dict) -> None:
+        # Los textos primero: si no caben, la fila no llega a cambiar
+        name_offset, name_length = self._store_text(product["name"])
+        description_offset, description_length = self._store_text(product.get("description"))
+        tags = list(product.get("tags") or ())
+        tag_offset, tag_length = self._store_text(",".join(tags))
+        if self.alive[row]:
+            self._unaggregate_row(row)
+            self._unindex_name(row)
+            self._index_tags(row, False)
+        self.name_offsets[row], self.name_lengths[row] = name_offset, name_length
+        self.description_offsets[row], self.description_lengths[row] = description_offset, description_length
+        self.tag_offsets[row], self.tag_lengths[row] = tag_offset, tag_length
+        self.tag_hashes[row] = 0
+        self.tag_hashes[row, :len(tags)] = [_tag_hash(tag) for tag in tags]
+        self.name_hashes[row] = _name_hash(product["name"])
+        self.ids[row] = product["id"]
+        self.prices[row] = product["price"]
+        self.categories[row] = CATEGORY_CODES[category_key(product["category"])]
+        self.in_stock[row] = product["in_stock"]
+        self.stock_quantity[row] = product["stock_quantity"]
+        self.created_at[row] = to_epoch_micros(product["created_at"])
+        self.updated_at[row] = to_epoch_micros(product.get("updated_at"))
+        # La secuencia del seqlock hace de generación: la versión de la fila
+        # es la de la escritura que la cambió
+        self.versions[row] = self._header[_SEQ]
+        self.alive[row] = True
+        self._aggregates.add_product(product)
+        self._index_name(row)
+        self._index_tags(row, True)
+
+    def _unaggregate_row(self, row: int) -> None:
+        self._aggregates.add(
+            CATEGORIES[self.categories[row]], float(self.prices[row]), int(self.stock_quantity[row]), -1
+        )
+
+    def _append(self, product: dict) -> None:
+        row = self._size
+        if row >= len(self.ids):
+            raise StorageUnavailableError("el segmento compartido de productos está lleno")
+        self._write_row(row, product)
+        self._header[_SIZE] = row + 1
+        self._header[_NEXT_ID] = max(int(self._header[_NEXT_ID]), product["id"] + 1)
+
+    def _reserve(self, rows: int, text_bytes: int) -> None:
+        """
+        Se asegura, dentro de _write(), de que caben rows filas nuevas y
+        text_bytes de texto; si no, compacta. Lanza StorageUnavailableError
+        si ni compactando hay sitio.
+        """
+        if self._fits(rows, text_bytes):
+            return
+        self._compact()
+        if self._size + rows > len(self.ids):
+            raise StorageUnavailableError("el segmento compartido de productos está lleno")
+        if not self._fits(rows, text_bytes):
+            raise StorageUnavailableError("no queda espacio para textos en el segmento compartido")
+
+    def _fits(self, rows: int, text_bytes: int) -> bool:
+        return (
+            self._size + rows <= len(self.ids)
+            and int(self._header[_ARENA_USED]) + text_bytes <= len(self._arena)
+        )
+
+    def _compact(self) -> None:
+        """
+        Quita las filas borradas y junta al principio del área los textos de
+        las filas vivas. Va dentro de _write(): los lectores ven la secuencia
+        impar y repiten. Las filas conservan su orden y los textos también,
+        así que cada texto solo se mueve hacia atrás y se copia en el sitio
+        por bloques, sin otra área de apoyo.
+        """
+        self._header[_COMPACTING] = 1
+        size = self._size
+        rows = np.flatnonzero(self.alive[:size])
+        live = len(rows)
+        for name, _ in _COLUMNS:
+            column = getattr(self, name)
+            column[:live] = column[rows]
+            column[live:size] = 0
+        self.tag_hashes[:live] = self.tag_hashes[rows]
+        self.tag_hashes[live:size] = 0
+        self._header[_SIZE] = live
+
+        text_columns = (
+            (self.name_offsets, self.name_lengths),
+            (self.description_offsets, self.description_lengths),
+            (self.tag_offsets, self.tag_lengths)
+        )
+        offsets = np.concatenate([offsets[:live] for offsets, _ in text_columns])
+        sizes = np.maximum(np.concatenate([lengths[:live] for _, lengths in text_columns]), 0).astype(np.int64)
+        order = np.argsort(offsets, kind="stable")
+        targets = np.cumsum(sizes[order]) - sizes[order]
+        for start in range(0, len(order), _SCAN_CHUNK_ROWS):
+            chunk = order[start:start + _SCAN_CHUNK_ROWS]
+            chunk_sizes = sizes[chunk]
+            total = int(chunk_sizes.sum())
+            if not total:
+                continue
+            target = int(targets[start])
+            # Cada byte de destino sale de su texto desplazado hacia atrás
+            shifts = np.repeat(offsets[chunk] - targets[start:start + len(chunk)], chunk_sizes)
+            self._arena[target:target + total] = self._arena[np.arange(target, target + total) + shifts]
+        moved = np.empty_like(offsets)
+        moved[order] = targets
+        for part, (column, _) in enumerate(text_columns):
+            column[:live] = moved[part * live:(part + 1) * live]
+        self._header[_ARENA_USED] = int(sizes.sum())
+        self._rebuild_name_slots()
+        self._rebuild_tag_rows()
+        self._header[_COMPACTING] = 0
+
+    def _probe_name_slots(self, name_hash: int) -> Iterator[int]:
+        # Sondeo lineal desde el hueco del hash, como mucho una vuelta
+        mask = len(self._name_slots) - 1
+        for step in range(len(self._name_slots)):
+            yield (name_hash + step) & mask
+
+    def _find_row_by_name(self, name: str) -> Optional[int]:
+        name_hash = _name_hash(name)
+        key = name.casefold()
+        for slot in self._probe_name_slots(name_hash):
+            value = int(self._name_slots[slot])
+            if value == 0:
+                return None
+            row = value - 1
+            # Los hashes pueden colisionar: se confirma con el nombre
+            if value != _DELETED_SLOT and self.name_hashes[row] == name_hash and self.alive[row] \
+                    and self._texts(row)[0].casefold() == key:
+                return row
+        return None
+
+    def _index_name(self, row: int) -> None:
+        """Añade la fila a la tabla de nombres (el nombre ya se comprobó libre)."""
+        if 4 * (int(self._header[_NAME_SLOTS_USED]) + 1) > 3 * len(self._name_slots):
+            # Demasiados huecos borrados; la reconstrucción puede incluir ya
+            # esta fila si no es nueva
+            self._rebuild_name_slots()
+        for slot in self._probe_name_slots(int(self.name_hashes[row])):
+            value = int(self._name_slots[slot])
+            if value == row + 1:
+                return
+            if value in (0, _DELETED_SLOT):
+                if value == 0:
+                    self._header[_NAME_SLOTS_USED] += 1
+                self._name_slots[slot] = row + 1
+                return
+
+    def _unindex_name(self, row: int) -> None:
+        for slot in self._probe_name_slots(int(self.name_hashes[row])):
+            value = int(self._name_slots[slot])
+            if value == 0:
+                return
+            if value == row + 1:
+                self._name_slots[slot] = _DELETED_SLOT
+                return
+
+    def _rebuild_name_slots(self) -> None:
+        """Rehace la tabla de nombres con las filas vivas, sin huecos borrados."""
+        self._name_slots[:] = 0
+        self._header[_NAME_SLOTS_USED] = 0
+        for row in np.flatnonzero(self.alive[:self._size]).tolist():
+            for slot in self._probe_name_slots(int(self.name_hashes[row])):
+                if self._name_slots[slot] == 0:
+                    self._name_slots[slot] = row + 1
+                    break
+            self._header[_NAME_SLOTS_USED] += 1
+
+    def _tag_slot(self, tag_hash: int, add: bool = False) -> Optional[int]:
+        """
+        Hueco de la etiqueta en la tabla, o None si no está. Con add la da de
+        alta si falta, salvo que la tabla pase de 3/4: entonces marca
+        _TAG_OVERFLOW y devuelve None.
+        """
+        mask = len(self._tag_keys) - 1
+        for step in range(len(self._tag_keys)):
+            slot = (tag_hash + step) & mask
+            key = int(self._tag_keys[slot])
+            if key == tag_hash:
+                return slot
+            if key == 0:
+                break
+        if not add:
+            return None
+        if 4 * (int(self._header[_TAG_SLOTS_USED]) + 1) > 3 * len(self._tag_keys):
+            self._header[_TAG_OVERFLOW] = 1
+            return None
+        self._tag_keys[slot] = tag_hash
+        self._header[_TAG_SLOTS_USED] += 1
+        return slot
+
+    def _index_tags(self, row: int, present: bool) -> None:
+        """Pone o quita la fila de las listas de sus etiquetas."""
+        byte, bit = divmod(row, 8)
+        hashes = self.tag_hashes[row]
+        for tag_hash in np.unique(hashes[hashes != 0]).tolist():
+            slot = self._tag_slot(tag_hash, add=present)
+            if slot is None:
+                continue
+            if present:
+                self._tag_bitmaps[slot, byte] |= np.uint8(1 << bit)
+            else:
+                self._tag_bitmaps[slot, byte] &= np.uint8(~(1 << bit) & 0xFF)
+
+    def _rebuild_tag_rows(self) -> None:
+        """
+        Rehace las listas de etiquetas con las filas vivas. Las etiquetas que
+        ya no tiene ninguna fila dejan su hueco libre.
+        """
+        self._tag_keys[:] = 0
+        self._tag_bitmaps[:] = 0
+        self._header[_TAG_SLOTS_USED] = 0
+        self._header[_TAG_OVERFLOW] = 0
+        size = self._size
+        hashes = self.tag_hashes[:size]
+        rows, columns = np.nonzero((hashes != 0) & self.alive[:size, None])
+        hashes = hashes[rows, columns]
+        order = np.argsort(hashes, kind="stable")
+        rows, hashes = rows[order], hashes[order]
+        unique, starts = np.unique(hashes, return_index=True)
+        bits = np.zeros(8 * self._tag_bitmaps.shape[1], dtype=np.bool_)
+        for tag_hash, tag_rows in zip(unique.tolist(), np.split(rows, starts[1:])):
+            slot = self._tag_slot(tag_hash, add=True)
+            if slot is None:
+                continue
+            bits[:] = False
+            bits[tag_rows] = True
+            self._tag_bitmaps[slot] = np.packbits(bits, bitorder="little")
+
+    def _tag_rows(self, select: slice, tags: List[str], mode: str) -> Optional[np.ndarray]:
+        """
+        Máscara de las filas de select con alguna (mode "any") o todas las
+        etiquetas, sacada de las listas por etiqueta: cuesta un bit por fila
+        y etiqueta pedida, sin leer tag_hashes. None si alguna etiqueta pedida
+        puede haberse quedado fuera de la tabla (_TAG_OVERFLOW).
+        """
+        slots = [self._tag_slot(_tag_hash(tag)) for tag in tags]
+        found = [slot for slot in slots if slot is not None]
+        if len(found) < len(slots) and self._header[_TAG_OVERFLOW]:
+            return None
+        if not found or (mode == "all" and len(found) < len(slots)):
+            return np.zeros(select.stop - select.start, dtype=np.bool_)
+        first, last = select.start // 8, -(-select.stop // 8)
+        bitmaps = self._tag_bitmaps[found, first:last]
+        combined = (np.bitwise_and if mode == "all" else np.bitwise_or).reduce(bitmaps, axis=0)
+        bits = np.unpackbits(combined, bitorder="little")
+        return bits[select.start - 8 * first:select.stop - 8 * first].astype(np.bool_)
+
+    # -----------------------------
+    # Lectura y escritura
+    # -----------------------------
+    def get(self, product_id: int) -> Optional[dict]:
+        def read():
+            row = self._row_of(product_id)
+            return None if row is None else self._materialize(row)
+        return self._read(read)
+
+    def get_many(self, product_ids: Iterable[int]) -> List[dict]:
+        product_ids = list(product_ids)
+
+        def read():
+            rows = (self._row_of(product_id) for product_id in product_ids)
+            return [self._materialize(row) for row in rows if row is not None]
+        return self._read(read)
+
+    def all(self) -> Iterator[dict]:
+        last_id = None
+        while True:
+            def read():
+                chunk = self._next_chunk(last_id)
+                if chunk is None:
+                    return None, None
+                rows = np.flatnonzero(self.alive[chunk]) + chunk.start
+                return [self._materialize(row) for row in rows.tolist()], int(self.ids[chunk.stop - 1])
+            products, last_id = self._read(read)
+            if products is None:
+                return
+            yield from products
+
+    def generation(self) -> int:
+        return int(self._header[_SEQ])
+
+    def version(self, product_id: int) -> Optional[int]:
+        def read():
+            row = self._row_of(product_id)
+            return None if row is None else int(self.versions[row])
+        return self._read(read)
+
+    def versions(self, product_ids: List[int]) -> List[Optional[int]]:
+        def read():
+            rows = [self._row_of(product_id) for product_id in product_ids]
+            return [None if row is None else int(self.versions[row]) for row in rows]
+        return self._read(read)
+
+    def aggregates(self) -> CatalogAggregates:
+        return self._read(self._aggregates.copy)
+
+    def check_aggregates(self) -> Tuple[CatalogAggregates, CatalogAggregates]:
+        def read():
+            rows = np.flatnonzero(self.alive[:self._size])
+            fresh = CatalogAggregates.from_columns(
+                self.categories[rows], self.prices[rows], self.stock_quantity[rows]
+            )
+            return self._aggregates.copy(), fresh
+        return self._read(read)
+
+    def find_id_by_name(self, name: str) -> Optional[int]:
+        def read():
+            row = self._find_row_by_name(name)
+            return None if row is None else int(self.ids[row])
+        return self._read(read)
+
+    def _check_name_available(self, name: str, product_id: Optional[int] = None) -> None:
+        row = self._find_row_by_name(name)
+        if row is not None and int(self.ids[row]) != product_id:
+            raise DuplicateProductNameError(name, int(self.ids[row]))
+
+    def _apply(self, op: str, product_id: Optional[int], product_data: Optional[dict]):
+        """Aplica una operación dentro de _write(). Lanza DuplicateProductNameError o ProductNotFoundError."""
+        if op == "create":
+            self._check_name_available(product_data["name"])
+            # Los IDs se reparten bajo el candado de escritura, así las filas
+            # quedan en orden de ID aunque escriban varios procesos
+            new_product = {
+                "id": int(self._header[_NEXT_ID]),
+                "tags": [],
+                **product_data,
+                "created_at": datetime.now(),
+                "updated_at": None
+            }
+            self._reserve(1, _text_bytes(new_product))
+            self._append(new_product)
+            return new_product
+
+        row = self._row_of(product_id)
+        if row is None:
+            raise ProductNotFoundError(product_id)
+        if op == "delete":
+            self._unaggregate_row(row)
+            self._unindex_name(row)
+            self._index_tags(row, False)
+            self.alive[row] = False
+            return True
+
+        if "name" in product_data:
+            self._check_name_available(product_data["name"], product_id)
+        updated_product = {
+            **self._materialize(row),
+            **product_data,
+            "updated_at": datetime.now()
+        }
+        self._reserve(0, _text_bytes(updated_product))
+        # Compactar mueve las filas: se vuelve a buscar
+        self._write_row(self._row_of(product_id), updated_product)
+        return updated_product
+
+    def create(self, product_data: dict) -> dict:
+        with self._write():
+            return self._apply("create", None, product_data)
+
+    def update(self, product_id: int, product_data: dict) -> Optional[dict]:
+        try:
+            with self._write():
+                return self._apply("update", product_id, product_data)
+        except ProductNotFoundError:
+            return None
+
+    def delete(self, product_id: int) -> bool:
+        try:
+            with self._write():
+                return self._apply("delete", product_id, None)
+        except ProductNotFoundError:
+            return False
+
+    def _pending_text_bytes(self, op: str, product_id: Optional[int], product_data: Optional[dict]) -> int:
+        if op == "delete":
+            return 0
+        if op == "create":
+            return _text_bytes(product_data)
+        row = self._row_of(product_id)
+        return _text_bytes({**({} if row is None else self._materialize(row)), **product_data})
+
+    def _name_of(self, product_id: int) -> Optional[str]:
+        row = self._row_of(product_id)
+        return None if row is None else self._texts(row)[0]
+
+    def _id_by_name(self, name: str) -> Optional[int]:
+        row = self._find_row_by_name(name)
+        return None if row is None else int(self.ids[row])
+
+    def write_many(self, operations: List[WriteOperation], atomic: bool = False) -> Tuple[bool, List[object]]:
+        # Un único ciclo del seqlock para todo el lote: los lectores reintentan
+        # una vez en lugar de una por producto
+        results: List[object] = []
+        with self._write():
+            if atomic:
+                errors = check_writes(operations, self._name_of, self._id_by_name)
+                if any(error is not None for error in errors):
+                    return False, errors
+                # Se reserva sitio para todo el lote de una vez: si no cabe,
+                # falla antes de aplicar nada
+                self._reserve(
+                    sum(1 for op, _, _ in operations if op == "create"),
+                    sum(self._pending_text_bytes(*operation) for operation in operations)
+                )
+            for op, product_id, product_data in operations:
+                try:
+                    results.append(self._apply(op, product_id, product_data))
+                except (DuplicateProductNameError, ProductNotFoundError) as error:
+                    results.append(error)
+        return True, results
+
+    # -----------------------------
+    # Filtros
+    # -----------------------------
+    def _next_chunk(self, last_id: Optional[int]) -> Optional[slice]:
+        size = self._size
+        start = 0 if last_id is None else int(np.searchsorted(self.ids[:size], last_id, side="right"))
+        if start >= size:
+            return None
+        return slice(start, min(start + _SCAN_CHUNK_ROWS, size))
+
+    def _matching_rows(self, select: slice, filters: dict, needle: Optional[str]) -> np.ndarray:
+        tags = filters["tags"]
+        mask = None
+        if tags:
+            # Las etiquetas primero: suelen dejar pocas filas, y un bloque sin
+            # ninguna ya no mira el resto de columnas
+            mask = self._tag_rows(select, tags, filters["tags_mode"])
+            if mask is not None and not mask.any():
+                return np.zeros(0, dtype=np.int64)
+        scan_tags = tags and mask is None
+        mask = self.alive[select].copy() if mask is None else mask & self.alive[select]
+        if filters["category"]:
+            mask &= self.categories[select] == CATEGORY_CODES[filters["category"]]
+        if filters["in_stock"] is not None:
+            mask &= self.in_stock[select] == filters["in_stock"]
+        if filters["min_price"] is not None:
+            mask &= self.prices[select] >= filters["min_price"]
+        if filters["max_price"] is not None:
+            mask &= self.prices[select] <= filters["max_price"]
+        if scan_tags:
+            # Con la tabla de etiquetas llena se recorren los hashes de cada fila
+            hashes = self.tag_hashes[select]
+            if filters["tags_mode"] == "all":
+                for tag in tags:
+                    mask &= (hashes == _tag_hash(tag)).any(axis=1)
+            else:
+                mask &= np.isin(hashes, [_tag_hash(tag) for tag in tags]).any(axis=1)
+        rows = np.flatnonzero(mask) + select.start
+        if tags:
+            # Los hashes pueden colisionar: se confirma con las etiquetas
+            wanted = set(tags)
+            matches = wanted.issubset if filters["tags_mode"] == "all" else wanted.intersection
+            rows = np.array([row for row in rows.tolist() if matches(self._tags(row))], dtype=np.int64)
+        if needle:
+            rows = np.array([
+                row for row in rows.tolist()
+                if any(text and needle in text.lower() for text in self._texts(row))
+            ], dtype=np.int64)
+        if filters["name"]:
+            rows = np.array([
+                row for row in rows.tolist() if filters["name"] in self._texts(row)[0].lower()
+            ], dtype=np.int64)
+        return rows
+
+    @staticmethod
+    def _filters(category, in_stock, min_price, max_price, search, tags=None, tags_mode="any", name=None):
+        filters = dict(
+            category=category_key(category) if category else None,
+            in_stock=in_stock, min_price=min_price, max_price=max_price,
+            tags=tags, tags_mode=tags_mode, name=name.lower() if name else None
+        )
+        return filters, search.lower() if search else None
+
+    def iter_ids(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        sort_by: str = "id",
+        after: Optional[Tuple[float, int]] = None,
+        offset: int = 0,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Iterator[int]:
+        filters, needle = self._filters(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+
+        if sort_by == "price":
+            # Sin índices compartidos, el orden por precio ordena todas las coincidencias
+            def read_sorted():
+                rows = self._matching_rows(slice(0, self._size), filters, needle)
+                prices, ids = self.prices[rows], self.ids[rows]
+                if after is not None:
+                    keep = (prices > after[0]) | ((prices == after[0]) & (ids > after[1]))
+                    prices, ids = prices[keep], ids[keep]
+                return ids[np.lexsort((ids, prices))].tolist()
+            yield from self._read(read_sorted)[offset:]
+            return
+
+        last_id = None if after is None else after[1]
+        while True:
+            def read_chunk():
+                chunk = self._next_chunk(last_id)
+                if chunk is None:
+                    return None, None
+                rows = self._matching_rows(chunk, filters, needle)
+                return self.ids[rows].tolist(), int(self.ids[chunk.stop - 1])
+            ids, last_id = self._read(read_chunk)
+            if ids is None:
+                return
+            if offset:
+                if len(ids) <= offset:
+                    offset -= len(ids)
+                    continue
+                ids, offset = ids[offset:], 0
+            yield from ids
+
+    def count(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> int:
+        filters, needle = self._filters(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+        return self._read(lambda: len(self._matching_rows(slice(0, self._size), filters, needle)))
+
+    def facet_counts(
+        self,
+        facets: List[str],
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        filters, needle = self._filters(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+
+        def read():
+            rows = self._matching_rows(slice(0, self._size), filters, needle)
+            return facets_from_columns(facets, self.categories[rows], self.in_stock[rows], self.prices[rows])
+        return self._read(read)
+
+    def ranked_search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        with self._ranked_lock:
+            self._refresh_ranked_index()
+            return self._ranked_index.search(query, limit)
+
+    def _refresh_ranked_index(self) -> None:
+        """
+        Pone al día el índice de relevancia de este proceso. Cada fila guarda
+        en versions la secuencia de la escritura que la cambió, así que solo
+        se vuelven a leer las filas posteriores a la generación del índice, y
+        las bajas son los IDs indexados que ya no están vivos. Sin escrituras
+        no lee nada. Las columnas se recorren por bloques como en all(); lo
+        que cambie durante el recorrido se recoge en la siguiente consulta.
+        """
+        generation = self._read(self.generation)
+        if generation == self._ranked_generation:
+            return
+        since = self._ranked_generation
+        live: List[np.ndarray] = []
+        last_id = None
+        while True:
+            def read():
+                chunk = self._next_chunk(last_id)
+                if chunk is None:
+                    return None, None, None
+                alive = self.alive[chunk]
+                rows = np.flatnonzero(alive & (self.versions[chunk] > since)) + chunk.start
+                texts = [(int(self.ids[row]), *self._texts(row)) for row in rows.tolist()]
+                return self.ids[chunk][alive], texts, int(self.ids[chunk.stop - 1])
+            ids, texts, last_id = self._read(read)
+            if ids is None:
+                break
+            live.append(ids)
+            for product_id, name, description in texts:
+                previous = self._ranked_texts.get(product_id)
+                if previous is not None:
+                    self._ranked_index.remove(product_id, *previous)
+                self._ranked_index.add(product_id, name, description)
+                self._ranked_texts[product_id] = (name, description)
+        live_ids = np.concatenate(live) if live else np.zeros(0, dtype=np.int64)
+        for product_id in np.setdiff1d(self._ranked_ids, live_ids, assume_unique=True).tolist():
+            self._ranked_index.remove(product_id, *self._ranked_texts.pop(product_id))
+        self._ranked_ids = live_ids
+        self._ranked_generation = generation
+
+    def sort_key(self, product_id: int, sort_by: str = "id") -> Optional[Tuple[float, int]]:
+        def read():
+            row = self._row_of(product_id)
+            if row is None:
+                return None
+            return (float(self.prices[row]) if sort_by == "price" else product_id), product_id
+        return self._read(read)
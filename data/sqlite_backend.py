@@ -0,0 +1,831 @@
+from datetime import datetime
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import sqlite3
+import threading
+import uuid
+
+from models.product_models import CategoryEnum
+from exceptions.custom_exceptions import DuplicateProductNameError, ProductNotFoundError
+from data.aggregates import CatalogAggregates, sketch_buckets
+from data.backend import (
+    PRICE_BUCKET_EDGES, PRICE_BUCKETS, ProductBackend, WriteOperation, check_writes, empty_facets
+)
+from data.indexes import MAX_EXPANSIONS, NAME_WEIGHT, SIMILARITY_THRESHOLD, term_trigrams, tokenize
+
+# Máximo de IDs por consulta IN (...)
+_MAX_PARAMS = 500
+
+_COLUMNS = "id, name, price, description, category, in_stock, stock_quantity, created_at, updated_at, tags"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    price REAL NOT NULL,
+    description TEXT,
+    category TEXT NOT NULL,
+    in_stock INTEGER NOT NULL,
+    stock_quantity INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    tags TEXT NOT NULL DEFAULT '[]'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS products_name_key ON products (name_key);
+CREATE INDEX IF NOT EXISTS products_price ON products (price, id);
+CREATE INDEX IF NOT EXISTS products_category ON products (category, price);
+CREATE INDEX IF NOT EXISTS products_in_stock ON products (in_stock, price);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL,
+    instance_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS product_tags (
+    tag TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag TEXT PRIMARY KEY,
+    products INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS products_tags_insert AFTER INSERT ON products BEGIN
+    INSERT INTO product_tags SELECT value, NEW.id FROM json_each(NEW.tags);
+    INSERT INTO tag_counts SELECT value, 1 FROM json_each(NEW.tags) WHERE true
+        ON CONFLICT (tag) DO UPDATE SET products = products + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS products_tags_delete AFTER DELETE ON products BEGIN
+    DELETE FROM product_tags WHERE product_id = OLD.id AND tag IN (SELECT value FROM json_each(OLD.tags));
+    UPDATE tag_counts SET products = products - 1 WHERE tag IN (SELECT value FROM json_each(OLD.tags));
+END;
+CREATE TRIGGER IF NOT EXISTS products_tags_update AFTER UPDATE OF tags ON products BEGIN
+    DELETE FROM product_tags WHERE product_id = OLD.id AND tag IN (SELECT value FROM json_each(OLD.tags));
+    UPDATE tag_counts SET products = products - 1 WHERE tag IN (SELECT value FROM json_each(OLD.tags));
+    INSERT INTO product_tags SELECT value, NEW.id FROM json_each(NEW.tags);
+    INSERT INTO tag_counts SELECT value, 1 FROM json_each(NEW.tags) WHERE true
+        ON CONFLICT (tag) DO UPDATE SET products = products + 1;
+END;
+CREATE TABLE IF NOT EXISTS category_stats (
+    category TEXT PRIMARY KEY,
+    products INTEGER NOT NULL,
+    stock INTEGER NOT NULL,
+    price_cents INTEGER NOT NULL,
+    value_cents INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS products_stats_insert AFTER INSERT ON products BEGIN
+    INSERT INTO category_stats VALUES (
+        NEW.category, 1, NEW.stock_quantity,
+        CAST(round(NEW.price * 100) AS INTEGER),
+        CAST(round(NEW.price * 100) AS INTEGER) * NEW.stock_quantity
+    ) ON CONFLICT (category) DO UPDATE SET
+        products = products + excluded.products,
+        stock = stock + excluded.stock,
+        price_cents = price_cents + excluded.price_cents,
+        value_cents = value_cents + excluded.value_cents;
+END;
+CREATE TRIGGER IF NOT EXISTS products_stats_delete AFTER DELETE ON products BEGIN
+    UPDATE category_stats SET
+        products = products - 1,
+        stock = stock - OLD.stock_quantity,
+        price_cents = price_cents - CAST(round(OLD.price * 100) AS INTEGER),
+        value_cents = value_cents - CAST(round(OLD.price * 100) AS INTEGER) * OLD.stock_quantity
+    WHERE category = OLD.category;
+END;
+CREATE TRIGGER IF NOT EXISTS products_stats_update
+AFTER UPDATE OF price, category, stock_quantity ON products BEGIN
+    UPDATE category_stats SET
+        products = products - 1,
+        stock = stock - OLD.stock_quantity,
+        price_cents = price_cents - CAST(round(OLD.price * 100) AS INTEGER),
+        value_cents = value_cents - CAST(round(OLD.price * 100) AS INTEGER) * OLD.stock_quantity
+    WHERE category = OLD.category;
+    INSERT INTO category_stats VALUES (
+        NEW.category, 1, NEW.stock_quantity,
+        CAST(round(NEW.price * 100) AS INTEGER),
+        CAST(round(NEW.price * 100) AS INTEGER) * NEW.stock_quantity
+    ) ON CONFLICT (category) DO UPDATE SET
+        products = products + excluded.products,
+        stock = stock + excluded.stock,
+        price_cents = price_cents + excluded.price_cents,
+        value_cents = value_cents + excluded.value_cents;
+END;
+"""
+
+
+def _bucket_of(kind: int, value: str) -> str:
+    # Misma regla que CatalogAggregates.add: primera cubeta con límite >= valor
+    return f"(SELECT bucket FROM sketch_bounds WHERE kind = {kind} AND upper >= {value} ORDER BY upper LIMIT 1)"
+
+
+def _add_to_sketches(row: str) -> str:
+    return "\n".join(
+        f"    INSERT INTO category_buckets VALUES ({row}.category, {_bucket_of(kind, f'{row}.{column}')}, 1)"
+        " ON CONFLICT (category, bucket) DO UPDATE SET products = products + 1;"
+        for kind, column in ((0, "price"), (1, "stock_quantity"))
+    )
+
+
+def _remove_from_sketches(row: str) -> str:
+    return "\n".join(
+        f"    UPDATE category_buckets SET products = products - 1"
+        f" WHERE category = {row}.category AND bucket = {_bucket_of(kind, f'{row}.{column}')};"
+        for kind, column in ((0, "price"), (1, "stock_quantity"))
+    )
+
+
+# Bocetos de cuantiles (ver data.aggregates): una fila por categoría y cubeta
+# no vacía. Los límites de las cubetas se copian en sketch_bounds al abrir
+_SKETCH_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sketch_bounds (
+    bucket INTEGER PRIMARY KEY,
+    kind INTEGER NOT NULL,
+    upper REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sketch_bounds_upper ON sketch_bounds (kind, upper);
+CREATE TABLE IF NOT EXISTS category_buckets (
+    category TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    products INTEGER NOT NULL,
+    PRIMARY KEY (category, bucket)
+);
+CREATE TRIGGER IF NOT EXISTS products_sketch_insert AFTER INSERT ON products BEGIN
+{_add_to_sketches("NEW")}
+END;
+CREATE TRIGGER IF NOT EXISTS products_sketch_delete AFTER DELETE ON products BEGIN
+{_remove_from_sketches("OLD")}
+END;
+CREATE TRIGGER IF NOT EXISTS products_sketch_update
+AFTER UPDATE OF price, category, stock_quantity ON products BEGIN
+{_remove_from_sketches("OLD")}
+{_add_to_sketches("NEW")}
+END;
+"""
+
+
+def _search_tokens(row: str) -> str:
+    return f"json_each(search_tokens({row}.name, {row}.description))"
+
+
+def _add_search_terms(row: str) -> str:
+    # Los trigramas solo se guardan la primera vez que aparece la palabra
+    return f"""
+    INSERT INTO search_trigrams (trigram, term)
+        SELECT trigram.value, token.value FROM {_search_tokens(row)} AS token, json_each(term_trigrams(token.value)) AS trigram
+        WHERE token.value NOT IN (SELECT term FROM search_terms);
+    INSERT INTO search_terms (term, trigrams, products)
+        SELECT value, json_array_length(term_trigrams(value)), 1 FROM {_search_tokens(row)} WHERE true
+        ON CONFLICT (term) DO UPDATE SET products = products + 1;
+"""
+
+
+def _remove_search_terms(row: str) -> str:
+    # Y se borran cuando ya no la tiene ningún producto
+    return f"""
+    UPDATE search_terms SET products = products - 1 WHERE term IN (SELECT value FROM {_search_tokens(row)});
+    DELETE FROM search_trigrams WHERE (trigram, term) IN (
+        SELECT trigram.value, token.value FROM {_search_tokens(row)} AS token, json_each(term_trigrams(token.value)) AS trigram
+        WHERE token.value IN (SELECT term FROM search_terms WHERE products = 0)
+    );
+    DELETE FROM search_terms WHERE products = 0 AND term IN (SELECT value FROM {_search_tokens(row)});
+"""
+
+
+# Búsqueda por relevancia: índice FTS5 sobre nombre y descripción, que los
+# triggers mantienen al día (external content). Para tolerar erratas, los
+# mismos triggers llevan el vocabulario en search_terms (con el número de
+# trigramas y de productos de cada palabra) y el índice trigrama -> palabra
+# en search_trigrams. Las palabras salen de tokenize() a través de la
+# función search_tokens, así que solo se puede escribir en la base de datos
+# desde conexiones abiertas con _connection()
+_SEARCH_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, description, content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts_vocab USING fts5vocab(products_fts, row);
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, description)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name, description)
+        VALUES ('delete', OLD.id, OLD.name, OLD.description);
+    INSERT INTO products_fts (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+END;
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT PRIMARY KEY,
+    trigrams INTEGER NOT NULL,
+    products INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_trigrams (
+    trigram TEXT NOT NULL,
+    term TEXT NOT NULL,
+    PRIMARY KEY (trigram, term)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS products_terms_insert AFTER INSERT ON products BEGIN
+{_add_search_terms("NEW")}
+END;
+CREATE TRIGGER IF NOT EXISTS products_terms_delete AFTER DELETE ON products BEGIN
+{_remove_search_terms("OLD")}
+END;
+CREATE TRIGGER IF NOT EXISTS products_terms_update AFTER UPDATE OF name, description ON products BEGIN
+{_remove_search_terms("OLD")}
+{_add_search_terms("NEW")}
+END;
+"""
+
+# Palabras del vocabulario parecidas a una de la consulta (ver
+# RankedTextIndex.expand): se cuentan los trigramas compartidos con el
+# índice de search_trigrams, sin recorrer el vocabulario
+_SIMILAR_TERMS = (
+    "SELECT term, similarity FROM ("
+    "SELECT term, common * 1.0 / (? + trigrams - common) AS similarity FROM ("
+    "SELECT term, COUNT(*) AS common FROM search_trigrams"
+    " WHERE trigram IN (SELECT value FROM json_each(?)) GROUP BY term"
+    ") JOIN search_terms USING (term)"
+    ") WHERE term != ? AND similarity >= ? ORDER BY similarity DESC, term DESC LIMIT ?"
+)
+
+# bm25() de FTS5 de una sola palabra (negativa: cuanto menor, más relevante)
+# multiplicada por su similitud con la palabra de la consulta
+_RANKED_TERM = (
+    f"SELECT ? AS token, rowid, ? * -bm25(products_fts, {NAME_WEIGHT}.0, 1.0) AS score"
+    f" FROM products_fts WHERE products_fts MATCH ?"
+)
+
+
+def _ranked_query(terms: int) -> str:
+    # Cada palabra de la consulta puntúa con la mejor de sus ampliaciones.
+    # MATERIALIZED evita que SQLite aplane las consultas de FTS5 dentro de
+    # las agregaciones, donde bm25() no se puede usar. El texto solo depende
+    # del número de términos, así que se reutiliza desde la caché de sentencias
+    return (
+        "WITH matches AS MATERIALIZED (" + " UNION ALL ".join([_RANKED_TERM] * terms) + ")"
+        " SELECT rowid, SUM(score) AS total FROM ("
+        "SELECT token, rowid, MAX(score) AS score FROM matches GROUP BY token, rowid"
+        ") GROUP BY rowid ORDER BY total DESC, rowid LIMIT ?"
+    )
+
+# Agregados por categoría calculados desde cero, con el mismo redondeo que los triggers
+_RECOMPUTE_STATS = (
+    "SELECT category, COUNT(*), SUM(stock_quantity), SUM(CAST(round(price * 100) AS INTEGER)),"
+    " SUM(CAST(round(price * 100) AS INTEGER) * stock_quantity) FROM products GROUP BY category"
+)
+
+_RECOMPUTE_BUCKETS = (
+    f"SELECT category, bucket, COUNT(*) FROM ("
+    f"SELECT category, {_bucket_of(0, 'products.price')} AS bucket FROM products"
+    f" UNION ALL SELECT category, {_bucket_of(1, 'products.stock_quantity')} FROM products"
+    f") GROUP BY category, bucket"
+)
+
+# Posición del tramo de price_bucket, con la misma regla que PRICE_BUCKET_EDGES
+_PRICE_BUCKET = "CASE {} ELSE {} END".format(
+    " ".join(f"WHEN price < {edge} THEN {position}" for position, edge in enumerate(PRICE_BUCKET_EDGES)),
+    len(PRICE_BUCKET_EDGES)
+)
+
+_INSERT = (
+    "INSERT INTO products (id, name, name_key, price, description, category, in_stock,"
+    " stock_quantity, created_at, updated_at, tags, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_UPDATE = (
+    "UPDATE products SET name = ?, name_key = ?, price = ?, description = ?, category = ?,"
+    " in_stock = ?, stock_quantity = ?, updated_at = ?, tags = ?, version = ? WHERE id = ?"
+)
+
+
+def _name_key(name: str) -> str:
+    return name.casefold()
+
+
+def _category_value(category) -> str:
+    return category.value if isinstance(category, CategoryEnum) else category
+
+
+def _text_contains(text: Optional[str], needle: str) -> bool:
+    # Misma semántica que el backend en memoria: str.lower() entiende Unicode,
+    # a diferencia de lower() de SQLite
+    return bool(text) and needle in text.lower()
+
+
+def _search_tokens_json(name: Optional[str], description: Optional[str]) -> str:
+    # Palabras distintas del producto, como array JSON para json_each()
+    return json.dumps(list(dict.fromkeys(tokenize(name) + tokenize(description))))
+
+
+def _term_trigrams_json(term: str) -> str:
+    return json.dumps(sorted(term_trigrams(term)))
+
+
+class SQLiteProductBackend(ProductBackend):
+    """
+    Catálogo persistente en SQLite (modo WAL).
+
+    Cada hilo usa su propia conexión, y cada conexión guarda en caché las
+    sentencias preparadas; por eso el SQL se construye siempre con el mismo
+    texto para la misma combinación de filtros y los valores van como
+    parámetros. Los filtros se resuelven en SQL sobre los índices de price,
+    category, in_stock y del nombre normalizado.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, seed: Iterable[dict] = ()):
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+        connection = self._connection()
+        is_new = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'products'"
+        ).fetchone() is None
+        if not is_new:
+            self._migrate(connection)
+        has_stats = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'category_buckets'"
+        ).fetchone() is not None
+        has_search = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        ).fetchone() is not None
+        has_terms = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'search_terms'"
+        ).fetchone() is not None
+        connection.executescript(_SCHEMA + _SKETCH_SCHEMA + _SEARCH_SCHEMA)
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO sketch_bounds VALUES (?, ?, ?)", sketch_buckets())
+        if not has_stats and not is_new:
+            # Base de datos anterior a los triggers: se calculan una vez
+            self._rebuild_aggregates()
+        if not has_search and not is_new:
+            with connection:
+                connection.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        if not has_terms and not is_new:
+            self._rebuild_search_terms()
+        with connection:
+            # La generación y las versiones se guardan en la base de datos, así
+            # que valen igual para todos los procesos que la abren
+            connection.execute(
+                "INSERT OR IGNORE INTO catalog_meta (id, generation, instance_id) VALUES (1, 0, ?)",
+                (uuid.uuid4().hex[:12],)
+            )
+            # Los productos iniciales solo se insertan al crear la base de datos
+            if is_new:
+                connection.executemany(_INSERT, [self._to_row(product) + (0,) for product in seed])
+        self.instance_id = connection.execute("SELECT instance_id FROM catalog_meta").fetchone()[0]
+
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection) -> None:
+        # Bases de datos creadas antes de que existieran las columnas version y tags
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(products)")]
+        if "version" not in columns:
+            with connection:
+                connection.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        if "tags" not in columns:
+            with connection:
+                connection.execute("ALTER TABLE products ADD COLUMN tags TEXT NOT NULL DEFAULT '[]'")
+
+    # -----------------------------
+    # Conexiones
+    # -----------------------------
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, cached_statements=256, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.create_function("contains_text", 2, _text_contains, deterministic=True)
+            connection.create_function("search_tokens", 2, _search_tokens_json, deterministic=True)
+            connection.create_function("term_trigrams", 1, _term_trigrams_json, deterministic=True)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # -----------------------------
+    # Conversión de filas
+    # -----------------------------
+    @staticmethod
+    def _to_row(product: dict) -> tuple:
+        updated_at = product.get("updated_at")
+        return (
+            product["id"],
+            product["name"],
+            _name_key(product["name"]),
+            product["price"],
+            product.get("description"),
+            _category_value(product["category"]),
+            int(product["in_stock"]),
+            product["stock_quantity"],
+            product["created_at"].isoformat(),
+            updated_at.isoformat() if updated_at else None,
+            json.dumps(list(product.get("tags") or ()), ensure_ascii=False)
+        )
+
+    @staticmethod
+    def _from_row(row: tuple) -> dict:
+        return {
+            "id": row[0],
+            "name": row[1],
+            "price": row[2],
+            "description": row[3],
+            "category": CategoryEnum(row[4]),
+            "in_stock": bool(row[5]),
+            "stock_quantity": row[6],
+            "created_at": datetime.fromisoformat(row[7]),
+            "updated_at": datetime.fromisoformat(row[8]) if row[8] else None,
+            "tags": json.loads(row[9])
+        }
+
+    # -----------------------------
+    # Lectura y escritura
+    # -----------------------------
+    def get(self, product_id: int) -> Optional[dict]:
+        row = self._connection().execute(
+            f"SELECT {_COLUMNS} FROM products WHERE id = ?", (product_id,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def get_many(self, product_ids: Iterable[int]) -> List[dict]:
+        product_ids = list(product_ids)
+        by_id = {}
+        # Por bloques, para no pasar del límite de parámetros de SQLite
+        for start in range(0, len(product_ids), _MAX_PARAMS):
+            block = product_ids[start:start + _MAX_PARAMS]
+            placeholders = ", ".join("?" * len(block))
+            for row in self._connection().execute(
+                f"SELECT {_COLUMNS} FROM products WHERE id IN ({placeholders})", block
+            ):
+                by_id[row[0]] = row
+        return [self._from_row(by_id[product_id]) for product_id in product_ids if product_id in by_id]
+
+    def all(self) -> Iterator[dict]:
+        for row in self._connection().execute(f"SELECT {_COLUMNS} FROM products ORDER BY id"):
+            yield self._from_row(row)
+
+    def generation(self) -> int:
+        return self._connection().execute("SELECT generation FROM catalog_meta").fetchone()[0]
+
+    def version(self, product_id: int) -> Optional[int]:
+        row = self._connection().execute("SELECT version FROM products WHERE id = ?", (product_id,)).fetchone()
+        return row[0] if row else None
+
+    def versions(self, product_ids: List[int]) -> List[Optional[int]]:
+        by_id = {}
+        for start in range(0, len(product_ids), _MAX_PARAMS):
+            block = product_ids[start:start + _MAX_PARAMS]
+            placeholders = ", ".join("?" * len(block))
+            by_id.update(self._connection().execute(
+                f"SELECT id, version FROM products WHERE id IN ({placeholders})", block
+            ))
+        return [by_id.get(product_id) for product_id in product_ids]
+
+    def aggregates(self) -> CatalogAggregates:
+        # Los triggers mantienen una fila por categoría y por cubeta de los
+        # bocetos: leerlas no depende del tamaño del catálogo
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            return CatalogAggregates.from_categories(
+                connection.execute("SELECT category, products, stock, price_cents, value_cents FROM category_stats"),
+                connection.execute("SELECT category, bucket, products FROM category_buckets WHERE products != 0")
+            )
+
+    def check_aggregates(self) -> Tuple[CatalogAggregates, CatalogAggregates]:
+        connection = self._connection()
+        with connection:
+            # Las dos lecturas en la misma transacción ven la misma instantánea
+            connection.execute("BEGIN")
+            kept = CatalogAggregates.from_categories(
+                connection.execute("SELECT category, products, stock, price_cents, value_cents FROM category_stats"),
+                connection.execute("SELECT category, bucket, products FROM category_buckets")
+            )
+            fresh = CatalogAggregates.from_categories(
+                connection.execute(_RECOMPUTE_STATS), connection.execute(_RECOMPUTE_BUCKETS)
+            )
+        return kept, fresh
+
+    def _rebuild_aggregates(self) -> None:
+        """Recalcula category_stats y category_buckets desde la tabla de productos."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM category_stats")
+            connection.execute(f"INSERT INTO category_stats {_RECOMPUTE_STATS}")
+            connection.execute("DELETE FROM category_buckets")
+            connection.execute(f"INSERT INTO category_buckets {_RECOMPUTE_BUCKETS}")
+
+    def _rebuild_search_terms(self) -> None:
+        """Recalcula search_terms y search_trigrams desde la tabla de productos."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM search_terms")
+            connection.execute("DELETE FROM search_trigrams")
+            connection.execute(
+                "INSERT INTO search_terms (term, trigrams, products)"
+                " SELECT token.value, json_array_length(term_trigrams(token.value)), COUNT(*)"
+                " FROM products, json_each(search_tokens(products.name, products.description)) AS token"
+                " GROUP BY token.value"
+            )
+            connection.execute(
+                "INSERT INTO search_trigrams (trigram, term)"
+                " SELECT trigram.value, term FROM search_terms, json_each(term_trigrams(term)) AS trigram"
+            )
+
+    def find_id_by_name(self, name: str) -> Optional[int]:
+        row = self._connection().execute(
+            "SELECT id FROM products WHERE name_key = ?", (_name_key(name),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _raise_duplicate(self, connection: sqlite3.Connection, name: str) -> None:
+        row = connection.execute("SELECT id FROM products WHERE name_key = ?", (_name_key(name),)).fetchone()
+        raise DuplicateProductNameError(name, row[0] if row else None)
+
+    @staticmethod
+    def _next_generation(connection: sqlite3.Connection) -> int:
+        return connection.execute(
+            "UPDATE catalog_meta SET generation = generation + 1 RETURNING generation"
+        ).fetchone()[0]
+
+    def _apply(self, connection: sqlite3.Connection, op: str, product_id: Optional[int], product_data: Optional[dict]):
+        """
+        Aplica una operación dentro de la transacción en curso. Lanza
+        DuplicateProductNameError o ProductNotFoundError. Cada operación sube
+        la generación del catálogo, y la versión del producto pasa a ser esa
+        generación.
+        """
+        if op == "create":
+            new_product = {
+                "id": None,
+                "tags": [],
+                **product_data,
+                "created_at": datetime.now(),
+                "updated_at": None
+            }
+            try:
+                # El índice único sobre name_key hace atómica la comprobación de nombre,
+                # también entre procesos
+                cursor = connection.execute(_INSERT, self._to_row(new_product) + (self._next_generation(connection),))
+            except sqlite3.IntegrityError:
+                self._raise_duplicate(connection, product_data["name"])
+            new_product["id"] = cursor.lastrowid
+            return new_product
+
+        if op == "delete":
+            cursor = connection.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            if cursor.rowcount == 0:
+                raise ProductNotFoundError(product_id)
+            self._next_generation(connection)
+            return True
+
+        row = connection.execute(
+            f"SELECT {_COLUMNS} FROM products WHERE id = ?", (product_id,)
+        ).fetchone()
+        if row is None:
+            raise ProductNotFoundError(product_id)
+        updated_product = {
+            **self._from_row(row),
+            **product_data,
+            "updated_at": datetime.now()
+        }
+        values = self._to_row(updated_product)
+        try:
+            connection.execute(
+                _UPDATE, values[1:8] + values[9:] + (self._next_generation(connection), product_id)
+            )
+        except sqlite3.IntegrityError:
+            self._raise_duplicate(connection, product_data["name"])
+        return updated_product
+
+    def _write_one(self, op: str, product_id: Optional[int], product_data: Optional[dict]):
+        connection = self._connection()
+        with connection:
+            # BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer
+            connection.execute("BEGIN IMMEDIATE")
+            return self._apply(connection, op, product_id, product_data)
+
+    def create(self, product_data: dict) -> dict:
+        return self._write_one("create", None, product_data)
+
+    def update(self, product_id: int, product_data: dict) -> Optional[dict]:
+        try:
+            return self._write_one("update", product_id, product_data)
+        except ProductNotFoundError:
+            return None
+
+    def delete(self, product_id: int) -> bool:
+        try:
+            return self._write_one("delete", product_id, None)
+        except ProductNotFoundError:
+            return False
+
+    def write_many(self, operations: List[WriteOperation], atomic: bool = False) -> Tuple[bool, List[object]]:
+        """
+        El lote va en una única transacción (un solo commit). Cada operación
+        tiene su SAVEPOINT, así una fallida se deshace sin perder las demás.
+        En modo atómico el lote se comprueba antes de escribir, ya con el
+        bloqueo de escritura tomado.
+        """
+        connection = self._connection()
+        results: List[object] = []
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if atomic:
+                errors = check_writes(operations, self._name_of, self.find_id_by_name)
+                if any(error is not None for error in errors):
+                    return False, errors
+            for op, product_id, product_data in operations:
+                connection.execute("SAVEPOINT bulk_item")
+                try:
+                    results.append(self._apply(connection, op, product_id, product_data))
+                except (DuplicateProductNameError, ProductNotFoundError) as error:
+                    connection.execute("ROLLBACK TO bulk_item")
+                    results.append(error)
+                finally:
+                    connection.execute("RELEASE bulk_item")
+        return True, results
+
+    def _name_of(self, product_id: int) -> Optional[str]:
+        row = self._connection().execute("SELECT name FROM products WHERE id = ?", (product_id,)).fetchone()
+        return row[0] if row else None
+
+    # -----------------------------
+    # Filtros
+    # -----------------------------
+    def _tags_clause(self, tags: List[str], tags_mode: str) -> Tuple[str, list]:
+        """
+        Restricción por etiquetas sobre la tabla product_tags, que guarda las
+        posting lists ordenadas por (tag, product_id). Con "all" se recorre la
+        lista más corta (según tag_counts) y el resto solo se consulta por
+        clave primaria para cada candidato.
+        """
+        placeholders = ", ".join("?" * len(tags))
+        if tags_mode != "all":
+            return f"id IN (SELECT product_id FROM product_tags WHERE tag IN ({placeholders}))", list(tags)
+        sizes = dict(self._connection().execute(
+            f"SELECT tag, products FROM tag_counts WHERE tag IN ({placeholders})", tags
+        ))
+        if len(tags) > len(sizes) or 0 in sizes.values():
+            # Alguna etiqueta no la tiene nadie
+            return "0", []
+        ordered = sorted(tags, key=sizes.get)
+        probes = "".join(
+            " AND EXISTS (SELECT 1 FROM product_tags WHERE tag = ? AND product_id = first.product_id)"
+            for _ in ordered[1:]
+        )
+        return f"id IN (SELECT product_id FROM product_tags AS first WHERE first.tag = ?{probes})", ordered
+
+    def _where(
+        self, category, in_stock, min_price, max_price, search, tags=None, tags_mode="any", name=None
+    ) -> Tuple[List[str], list]:
+        clauses, params = [], []
+        if category:
+            clauses.append("category = ?")
+            params.append(_category_value(category))
+        if in_stock is not None:
+            clauses.append("in_stock = ?")
+            params.append(int(in_stock))
+        if min_price is not None:
+            clauses.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append("price <= ?")
+            params.append(max_price)
+        if search:
+            clauses.append("(contains_text(name, ?) OR contains_text(description, ?))")
+            params += [search.lower(), search.lower()]
+        if name:
+            clauses.append("contains_text(name, ?)")
+            params.append(name.lower())
+        if tags:
+            clause, tag_params = self._tags_clause(tags, tags_mode)
+            clauses.append(clause)
+            params += tag_params
+        return clauses, params
+
+    def iter_ids(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        sort_by: str = "id",
+        after: Optional[Tuple[float, int]] = None,
+        offset: int = 0,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Iterator[int]:
+        clauses, params = self._where(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+        if sort_by == "price":
+            order = "price, id"
+            if after is not None:
+                clauses.append("(price, id) > (?, ?)")
+                params += [after[0], after[1]]
+        else:
+            order = "id"
+            if after is not None:
+                clauses.append("id > ?")
+                params.append(after[1])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # El cursor de sqlite3 avanza fila a fila, así que se detiene cuando
+        # quien consume deja de pedir IDs
+        cursor = self._connection().execute(
+            f"SELECT id FROM products {where} ORDER BY {order} LIMIT -1 OFFSET ?",
+            params + [offset]
+        )
+        for (product_id,) in cursor:
+            yield product_id
+
+    def count(
+        self,
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> int:
+        clauses, params = self._where(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._connection().execute(f"SELECT COUNT(*) FROM products {where}", params).fetchone()[0]
+
+    def facet_counts(
+        self,
+        facets: List[str],
+        category: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        search: Optional[str] = None,
+        tags: Optional[List[str]] = None,
+        tags_mode: str = "any",
+        name: Optional[str] = None
+    ) -> Dict[str, Dict[str, int]]:
+        clauses, params = self._where(category, in_stock, min_price, max_price, search, tags, tags_mode, name)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # Una sola consulta agrupa por las tres facetas; cada una se obtiene
+        # sumando los grupos (como mucho categorías × 2 × tramos)
+        counts = empty_facets(facets)
+        for category_value, available, bucket, count in self._connection().execute(
+            f"SELECT category, in_stock, {_PRICE_BUCKET}, COUNT(*) FROM products {where} GROUP BY 1, 2, 3",
+            params
+        ):
+            if "category" in counts:
+                counts["category"][category_value] += count
+            if "in_stock" in counts:
+                counts["in_stock"]["true" if available else "false"] += count
+            if "price_bucket" in counts:
+                counts["price_bucket"][PRICE_BUCKETS[bucket]] += count
+        return counts
+
+    def ranked_search(self, query: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """
+        Cada palabra de query se busca tal cual y con sus parecidas del
+        vocabulario (search_terms), como RankedTextIndex: puntúa con la mejor
+        de ellas, con el bm25() de FTS5 multiplicado por su similitud.
+        """
+        connection = self._connection()
+        params: list = []
+        for position, token in enumerate(dict.fromkeys(tokenize(query))):
+            trigrams = sorted(term_trigrams(token))
+            terms = [(term, similarity) for term, similarity in connection.execute(
+                _SIMILAR_TERMS,
+                (len(trigrams), json.dumps(trigrams), token, SIMILARITY_THRESHOLD, MAX_EXPANSIONS)
+            )]
+            if connection.execute("SELECT 1 FROM search_terms WHERE term = ?", (token,)).fetchone():
+                terms.insert(0, (token, 1.0))
+            for term, similarity in terms:
+                # Los términos salen del tokenizador: entre comillas no tienen sintaxis de FTS5
+                params += [position, similarity, f'"{term}"']
+        if not params:
+            return []
+        return [
+            (product_id, score)
+            for product_id, score in connection.execute(_ranked_query(len(params) // 3), params + [limit])
+        ]
+
+    def sort_key(self, product_id: int, sort_by: str = "id") -> Optional[Tuple[float, int]]:
+        if sort_by != "price":
+            return product_id, product_id
+        row = self._connection().execute("SELECT price FROM products WHERE id = ?", (product_id,)).fetchone()
+        return (row[0], product_id) if row else None
@@ -0,0 +1,177 @@
+from datetime import datetime
+from typing import Iterator, List, Optional
+import fcntl
+import json
+import os
+import threading
+
+from models.product_models import CategoryEnum
+from exceptions.custom_exceptions import StorageUnavailableError
+
+
+def encode_product(product: dict) -> dict:
+    """Convierte un producto a tipos JSON (fechas ISO, categoría como texto)."""
+    updated_at = product.get("updated_at")
+    category = product["category"]
+    return {
+        **product,
+        "category": category.value if isinstance(category, CategoryEnum) else category,
+        "created_at": product["created_at"].isoformat(),
+        "updated_at": updated_at.isoformat() if updated_at else None
+    }
+
+
+def decode_product(data: dict) -> dict:
+    return {
+        **data,
+        "category": CategoryEnum(data["category"]),
+        "created_at": datetime.fromisoformat(data["created_at"]),
+        "updated_at": datetime.fromisoformat(data["updated_at"]) if data["updated_at"] else None
+    }
+
+
+def _fsync_directory(path: str) -> None:
+    # El rename solo es durable cuando se sincroniza el directorio que lo contiene
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def lock_wal(path: str) -> int:
+    """
+    Toma un flock exclusivo sobre {path}.lock y devuelve su descriptor.
+
+    Dos procesos con el mismo WAL llevarían contadores de LSN distintos y
+    rotarían el fichero cada uno por su lado, y la recuperación descartaría
+    registros. Se bloquea un fichero aparte porque rotate() sustituye el WAL.
+    """
+    lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        raise StorageUnavailableError(f"el WAL {path} ya está abierto por otro proceso")
+    return lock_fd
+
+
+def unlock_wal(lock_fd: int) -> None:
+    # Cerrar el descriptor libera el flock
+    os.close(lock_fd)
+
+
+class WriteAheadLog:
+    """
+    Registro append-only de escrituras con group commit.
+
+    append() solo encola el registro y devuelve su LSN. Un hilo de fondo
+    escribe todo lo pendiente con un único fsync cuando se junta batch_size
+    registros o pasa flush_interval segundos, y wait_durable(lsn) bloquea
+    hasta que ese LSN está en disco. Así varias peticiones concurrentes
+    comparten el mismo fsync.
+    """
+
+    def __init__(self, path: str, start_lsn: int = 0, flush_interval: float = 0.005, batch_size: int = 128):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.last_lsn = start_lsn
+        self.durable_lsn = start_lsn
+        self._pending: List[str] = []
+        self._file = open(path, "a", encoding="utf-8")
+        self._condition = threading.Condition()
+        # Serializa las escrituras al fichero (flush y rotate)
+        self._io_lock = threading.RLock()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._flusher = threading.Thread(target=self._flush_loop, name="products-wal", daemon=True)
+        self._flusher.start()
+
+    def check(self) -> None:
+        """Lanza StorageUnavailableError si alguna escritura al WAL ha fallado."""
+        if self._error is not None:
+            raise StorageUnavailableError(f"fallo al escribir el WAL ({self._error})") from self._error
+
+    def append(self, record: dict) -> int:
+        with self._condition:
+            self.check()
+            self.last_lsn += 1
+            self._pending.append(json.dumps({"lsn": self.last_lsn, **record}, ensure_ascii=False))
+            # Se despierta al hilo de fondo con el primer registro del grupo
+            # y cuando el grupo se llena
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+            return self.last_lsn
+
+    def wait_durable(self, lsn: int) -> None:
+        with self._condition:
+            while self.durable_lsn < lsn:
+                self.check()
+                self._condition.wait()
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                # Se espera un poco para agrupar más escrituras en el mismo fsync
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Escribe y sincroniza con un único fsync todo lo pendiente."""
+        with self._io_lock:
+            with self._condition:
+                lines, self._pending = self._pending, []
+                lsn = self.last_lsn
+            if not lines:
+                return
+            # El fsync se hace sin el candado de append, para que las
+            # peticiones sigan encolando el siguiente grupo mientras tanto
+            try:
+                self._file.write("\n".join(lines) + "\n")
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as error:
+                with self._condition:
+                    self._error = error
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self.durable_lsn = lsn
+                self._condition.notify_all()
+
+    def rotate(self, old_path: str) -> None:
+        """Cierra el segmento actual renombrándolo a old_path y empieza uno vacío."""
+        with self._io_lock:
+            self.flush()
+            self._file.close()
+            os.replace(self.path, old_path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            _fsync_directory(self.path)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        self.flush()
+        self._file.close()
+
+
+def read_records(*paths: str) -> Iterator[dict]:
+    """Lee los registros de los segmentos indicados, ignorando una última línea incompleta."""
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as wal_file:
+            for line in wal_file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Escritura cortada por una caída: nunca se confirmó al cliente
+                    break
@@ -0,0 +1,20 @@
+class DuplicateProductNameError(Exception):
+    def __init__(self, name: str, existing_id: int):
+        self.name = name
+        self.existing_id = existing_id
+        self.message = f"Ya existe un producto con el nombre '{name}'"
+        super().__init__(self.message)
+
+
+class StorageUnavailableError(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+        self.message = f"El almacenamiento de productos no está disponible: {reason}"
+        super().__init__(self.message)
+
+
+class ProductNotFoundError(Exception):
+    def __init__(self, product_id: int):
+        self.product_id = product_id
+        self.message = f"Producto con ID {product_id} no encontrado"
+        super().__init__(self.message)
@@ -1,19 +1,40 @@
-from fastapi import FastAPI, HTTPException, Query, Path, status, Response, Depends
-from fastapi.responses import JSONResponse
-from typing import Optional, List
-from pydantic import BaseModel, validator, Field, EmailStr, model_validator
+from fastapi import FastAPI, HTTPException, Query, Path, status, Response, Depends, Request, UploadFile, File, Header
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from typing import AsyncIterator, Callable, Iterator, Optional, List, Tuple
+from pydantic import BaseModel, validator, Field, EmailStr, model_validator, TypeAdapter, ValidationError
+from itertools import islice
+import base64
+import csv
+import io
+import json
+import math
 import re
 from datetime import datetime
 import logging
 
+import orjson
+
 # Aquí asumo que importas estos modelos y funciones de tus módulos
 from models.product_models import (
     ProductCreate, ProductUpdate, ProductResponse,
-    ProductList, CategoryEnum, ErrorResponse
+    ProductList, CategoryEnum, ErrorResponse, SortByEnum, ProductPatch,
+    ExportFormatEnum, TagsModeEnum, normalize_tags, RankedProductList
 )
+from data import products_data
 from data.products_data import (
-    get_all_products, get_product_by_id, create_product,
-    update_product, delete_product, filter_products
+    get_product_by_id, update_product, filter_products,
+    iter_product_ids, iter_products,
+    count_product_ids, sort_key_of, catalog_generation, product_version,
+    get_products_json, facet_counts, ranked_product_ids
+)
+from data.backend import FACETS
+from data.csv_import import import_csv
+from data.query_cache import QueryCache
+from data.wal import encode_product
+from exceptions.custom_exceptions import (
+    DuplicateProductNameError, ProductNotFoundError, StorageUnavailableError
 )
 
 app = FastAPI(
@@ -21,9 +42,15 @@ app = FastAPI(
     description="API REST completa para manejo de productos",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
+@app.exception_handler(StorageUnavailableError)
+async def storage_unavailable_handler(request, exc: StorageUnavailableError):
+    # El backend deja de responder si no puede garantizar la durabilidad
+    return JSONResponse(status_code=503, content={"detail": exc.message})
+
 # -----------------------------
 # ENDPOINT BÁSICO
 # -----------------------------
@@ -38,6 +65,70 @@ async def root():
 # -----------------------------
 # CRUD DE PRODUCTOS
 # -----------------------------
+# Mayor entero que admite una columna INTEGER de SQLite
+_MAX_CURSOR_ID = 2 ** 63 - 1
+
+def encode_cursor(sort_by: str, sort_key, product_id: int) -> str:
+    raw = json.dumps([sort_by, sort_key, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_by: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort_by, sort_key, product_id = json.loads(raw)
+        sort_key, product_id = float(sort_key), int(product_id)
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    # NaN o infinito no se pueden comparar como clave, y un ID fuera de rango
+    # no cabe en un INTEGER de SQLite
+    if not math.isfinite(sort_key) or not 0 <= product_id <= _MAX_CURSOR_ID:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    if cursor_sort_by != sort_by:
+        raise HTTPException(status_code=400, detail="El cursor no corresponde al orden solicitado")
+    return sort_key, product_id
+
+
+def parse_facets(facets: Optional[str]) -> List[str]:
+    """Facetas pedidas, sin repetir y en orden canónico; 400 si alguna no existe."""
+    requested = {name.strip() for name in (facets or "").split(",") if name.strip()}
+    unknown = requested - set(FACETS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Faceta desconocida: {', '.join(sorted(unknown))}. Válidas: {', '.join(FACETS)}"
+        )
+    return [name for name in FACETS if name in requested]
+
+
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): basta con que coincida la etiqueta."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+# Respuestas ya serializadas de GET /products, por parámetros normalizados
+_query_cache = QueryCache()
+
+
+@app.get("/cache/stats", summary="Estadísticas de la caché de listados")
+async def get_query_cache_stats():
+    return _query_cache.stats()
+
+
 @app.get("/products", response_model=ProductList)
 async def get_products(
     category: Optional[CategoryEnum] = Query(None),
@@ -46,71 +137,339 @@ async def get_products(
     max_price: Optional[float] = Query(None, ge=0),
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
-    search: Optional[str] = Query(None, min_length=1)
+    search: Optional[str] = Query(None, min_length=1),
+    sort_by: SortByEnum = Query(SortByEnum.id),
+    cursor: Optional[str] = Query(None, description="Cursor devuelto en next_cursor; ignora page"),
+    include_total: bool = Query(True),
+    facets: Optional[str] = Query(None, description="Facetas separadas por comas: category, in_stock, price_bucket"),
+    if_none_match: Optional[str] = Header(None),
+    x_products_cache: Optional[str] = Header(None, description="'bypass' para no usar la caché de listados")
 ):
     try:
-        products = filter_products(
+        # Los parámetros se validan antes del 304: una petición mal formada
+        # es un 400 aunque el catálogo no haya cambiado
+        facet_names = parse_facets(facets)
+        if cursor:
+            # Paginación por cursor: se reanuda desde el índice
+            after = decode_cursor(cursor, sort_by.value)
+            offset = 0
+        else:
+            after = None
+            offset = (page - 1) * page_size
+
+        # La generación se lee antes que los datos: si hay una escritura entre
+        # medias, la respuesta lleva datos más nuevos que su ETag (y que su
+        # entrada en caché) y la próxima petición simplemente no coincide
+        generation = catalog_generation()
+        etag = make_etag(*generation)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+        # Los parámetros ya validados forman la clave: el orden y la forma de
+        # escribirlos en la URL no cuentan
+        bypass = (x_products_cache or "").strip().lower() == "bypass"
+        cache_key = (
+            category.value if category else None, in_stock, min_price, max_price,
+            page, page_size, search.lower() if search else None, sort_by.value, cursor, include_total,
+            tuple(facet_names)
+        )
+        if not bypass:
+            body = _query_cache.get(cache_key, generation)
+            if body is not None:
+                return _list_response(body, etag, "HIT")
+
+        filters = dict(
             category=category.value if category else None,
             in_stock=in_stock,
             min_price=min_price,
-            max_price=max_price
-        )
-
-        if search:
-            search_lower = search.lower()
-            products = [
-                p for p in products
-                if search_lower in p["name"].lower() or
-                (p.get("description") and search_lower in p["description"].lower())
-            ]
-
-        total = len(products)
-        start_index = (page - 1) * page_size
-        end_index = start_index + page_size
-        paginated_products = products[start_index:end_index]
-
-        return ProductList(
-            products=paginated_products,
-            total=total,
-            page=page,
-            page_size=page_size
+            max_price=max_price,
+            search=search
         )
 
+        # El pipeline es perezoso: se pide un elemento de más para saber si
+        # hay otra página y se deja de filtrar en cuanto se obtiene
+        page_ids = list(islice(
+            iter_product_ids(**filters, sort_by=sort_by.value, after=after, offset=offset),
+            page_size + 1
+        ))
+        has_more = len(page_ids) > page_size
+        page_ids = page_ids[:page_size]
+
+        # Las facetas salen de una sola pasada sobre los filtros, y cualquiera
+        # de ellas suma el total; si no se piden, el total se calcula aparte
+        # en una pasada que solo cuenta
+        facet_result = facet_counts(facet_names, **filters) if facet_names else None
+        if not include_total:
+            total = None
+        elif facet_result is not None:
+            total = sum(facet_result[facet_names[0]].values())
+        else:
+            total = count_product_ids(**filters)
+
+        # JSON de cada producto, desde la caché de fragmentos. Los productos
+        # borrados después de filtrar no se devuelven
+        fragments = get_products_json(page_ids)
+
+        next_cursor = None
+        if has_more and page_ids:
+            key = sort_key_of(page_ids[-1], sort_by.value)
+            if key is None and fragments:
+                # El último de la página se borró entretanto: se sigue desde
+                # el último producto que sí se devolvió
+                last = orjson.loads(fragments[-1][1])
+                key = (last["price"] if sort_by == SortByEnum.price else last["id"], last["id"])
+            if key is not None:
+                next_cursor = encode_cursor(sort_by.value, *key)
+
+        # La página se ensambla concatenando los fragmentos, sin construir
+        # ProductList ni volver a serializar los productos
+        rest = orjson.dumps({
+            "total": total, "page": page, "page_size": page_size, "next_cursor": next_cursor, "facets": facet_result
+        })
+        body = b'{"products":[' + b",".join(fragment for _, fragment in fragments) + b"]," + rest[1:]
+        if bypass:
+            return _list_response(body, etag, "BYPASS")
+        _query_cache.put(cache_key, generation, body)
+        return _list_response(body, etag, "MISS")
+
+    except (HTTPException, StorageUnavailableError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 
+def _list_response(body: bytes, etag: str, cache_status: str) -> Response:
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "X-Products-Cache": cache_status}
+    )
+
+
+# -----------------------------
+# EXPORTACIÓN
+# -----------------------------
+_EXPORT_COLUMNS = [
+    "id", "name", "price", "description", "category",
+    "in_stock", "stock_quantity", "created_at", "updated_at"
+]
+
+# Productos serializados por cada trozo de la respuesta
+_EXPORT_CHUNK_SIZE = 1000
+
+
+def _export_ndjson(products) -> Iterator[str]:
+    lines = []
+    for product in products:
+        lines.append(json.dumps(encode_product(product), ensure_ascii=False))
+        if len(lines) >= _EXPORT_CHUNK_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _export_csv(products) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=_EXPORT_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for count, product in enumerate(products, start=1):
+        writer.writerow(encode_product(product))
+        if count % _EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Va antes de /products/{product_id} para que "export" no se tome como ID
+@app.get("/products/export", summary="Exporta el catálogo en NDJSON o CSV")
+def export_products(
+    export_format: ExportFormatEnum = Query(ExportFormatEnum.ndjson, alias="format"),
+    category: Optional[CategoryEnum] = Query(None),
+    in_stock: Optional[bool] = Query(None),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    search: Optional[str] = Query(None, min_length=1)
+):
+    """
+    La respuesta va por trozos (chunked) a medida que se leen los productos,
+    por bloques y en orden de ID, así que la memoria no crece con el catálogo.
+    El generador es síncrono: Starlette lo recorre en el pool de hilos.
+    """
+    products = iter_products(
+        category=category.value if category else None,
+        in_stock=in_stock,
+        min_price=min_price,
+        max_price=max_price,
+        search=search,
+        chunk_size=_EXPORT_CHUNK_SIZE
+    )
+    if export_format == ExportFormatEnum.csv:
+        body, media_type = _export_csv(products), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _export_ndjson(products), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="products.{export_format.value}"'}
+    )
+
+
+# -----------------------------
+# BÚSQUEDA (ProductFilters)
+# -----------------------------
+class ProductFilters:
+    def __init__(
+        self,
+        name: Optional[str] = Query(None, min_length=2, max_length=50, description="Subcadena del nombre"),
+        q: Optional[str] = Query(None, min_length=2, max_length=50, description="Subcadena del nombre o la descripción"),
+        min_price: Optional[float] = Query(None, ge=0, le=1000000),
+        max_price: Optional[float] = Query(None, ge=0, le=1000000),
+        category: Optional[CategoryEnum] = Query(None),
+        in_stock: Optional[bool] = Query(None),
+        tags: Optional[List[str]] = Query(None),
+        tags_mode: TagsModeEnum = Query(TagsModeEnum.any, description="any: alguna etiqueta; all: todas"),
+        page: int = Query(1, ge=1, le=100),
+        limit: int = Query(10, ge=1, le=50)
+    ):
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise HTTPException(status_code=400, detail="min_price no puede ser mayor que max_price")
+        try:
+            tags = normalize_tags(tags) if tags else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        self.name = name
+        self.q = q
+        self.min_price = min_price
+        self.max_price = max_price
+        self.category = category
+        self.in_stock = in_stock
+        self.tags = tags
+        self.tags_mode = tags_mode
+        self.page = page
+        self.limit = limit
+
+
+# Va antes de /products/{product_id} para que "search" no se tome como ID
+@app.get("/products/search", summary="Busca productos por texto, precio, categoría y etiquetas")
+def search_products(filters: ProductFilters = Depends()):
+    """
+    Las etiquetas se resuelven con el índice de etiquetas del backend (listas
+    de IDs por etiqueta): con tags_mode=any se unen las listas y con all se
+    intersecan empezando por la más corta. name busca solo en el nombre; q,
+    en el nombre y en la descripción, igual que search en GET /products.
+    """
+    query = dict(
+        category=filters.category.value if filters.category else None,
+        in_stock=filters.in_stock,
+        min_price=filters.min_price,
+        max_price=filters.max_price,
+        search=filters.q,
+        name=filters.name,
+        tags=filters.tags,
+        tags_mode=filters.tags_mode.value
+    )
+    page_ids = list(islice(
+        iter_product_ids(**query, offset=(filters.page - 1) * filters.limit), filters.limit
+    ))
+    total = count_product_ids(**query)
+    fragments = get_products_json(page_ids)
+
+    rest = orjson.dumps({
+        "total": total,
+        "page": filters.page,
+        "limit": filters.limit,
+        "total_pages": (total + filters.limit - 1) // filters.limit,
+        "filters_applied": {
+            "name": filters.name,
+            "q": filters.q,
+            "price_range": f"{filters.min_price}-{filters.max_price}",
+            "category": query["category"],
+            "in_stock": filters.in_stock,
+            "tags": filters.tags,
+            "tags_mode": query["tags_mode"]
+        }
+    })
+    body = b'{"products":[' + b",".join(fragment for _, fragment in fragments) + b"]," + rest[1:]
+    return Response(content=body, media_type="application/json")
+
+
+# También antes de /products/{product_id}
+@app.get("/products/search/ranked", response_model=RankedProductList, summary="Busca productos por relevancia")
+def search_products_ranked(
+    q: str = Query(..., min_length=1, max_length=100, description="Palabras a buscar; tolera erratas"),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    A diferencia de search en GET /products, no exige la subcadena exacta:
+    puntúa con BM25 las palabras del nombre y la descripción, y cada palabra
+    de q también busca las del catálogo con trigramas parecidos
+    ("lapto gamng" encuentra "Laptop Gaming"). Devuelve los limit mejores.
+    """
+    ranked = ranked_product_ids(q, limit)
+    scores = dict(ranked)
+    # Los productos borrados después de puntuar no se devuelven
+    fragments = get_products_json([product_id for product_id, _ in ranked])
+    results = b",".join(
+        orjson.dumps({"score": round(scores[product_id], 6)})[:-1] + b',"product":' + fragment + b"}"
+        for product_id, fragment in fragments
+    )
+    body = orjson.dumps({"query": q})[:-1] + b',"results":[' + results + b"]}"
+    return Response(content=body, media_type="application/json")
+
+
 @app.get("/products/{product_id}", response_model=ProductResponse)
-async def get_product(product_id: int = Path(..., gt=0)):
-    product = get_product_by_id(product_id)
-    if not product:
+async def get_product(
+    product_id: int = Path(..., gt=0),
+    if_none_match: Optional[str] = Header(None)
+):
+    # Si el cliente ya tiene esta versión no se lee ni se serializa el producto
+    version = product_version(product_id)
+    if version is not None:
+        instance_id, product_version_number = version
+        etag = make_etag(instance_id, product_id, product_version_number)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    else:
+        etag = None
+    # El JSON sale de la caché de fragmentos: ni ProductResponse ni response_model
+    fragments = get_products_json([product_id])
+    if not fragments:
         raise HTTPException(status_code=404, detail=f"Producto con ID {product_id} no encontrado")
-    return ProductResponse(**product)
+    return Response(
+        content=fragments[0][1],
+        media_type="application/json",
+        headers={"ETag": etag} if etag else None
+    )
 
 
+# Los endpoints de escritura son síncronos: FastAPI los ejecuta en el pool de
+# hilos, y así la espera del fsync del WAL no bloquea el event loop y varias
+# escrituras concurrentes comparten el mismo group commit
 @app.post("/products", response_model=ProductResponse, status_code=201)
-async def create_new_product(product: ProductCreate):
+def create_new_product(product: ProductCreate):
     try:
-        existing_products = get_all_products()
-        for existing in existing_products:
-            if existing["name"].lower() == product.name.lower():
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"Ya existe un producto con el nombre '{product.name}'"
-                )
-
+        # create_product y delete_product se llaman a través del módulo porque
+        # más abajo este archivo define endpoints con los mismos nombres
         product_data = product.dict()
-        new_product = create_product(product_data)
+        new_product = products_data.create_product(product_data)
         return ProductResponse(**new_product)
 
-    except HTTPException:
+    except DuplicateProductNameError:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Ya existe un producto con el nombre '{product.name}'"
+        )
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear producto: {str(e)}")
 
 
 @app.put("/products/{product_id}", response_model=ProductResponse)
-async def update_existing_product(
+def update_existing_product(
     product: ProductUpdate,
     product_id: int = Path(..., gt=0)
 ):
@@ -119,34 +478,267 @@ async def update_existing_product(
         if not existing_product:
             raise HTTPException(status_code=404, detail=f"Producto con ID {product_id} no encontrado")
 
-        all_products = get_all_products()
-        for existing in all_products:
-            if existing["id"] != product_id and existing["name"].lower() == product.name.lower():
-                raise HTTPException(status_code=409, detail=f"Ya existe otro producto con el nombre '{product.name}'")
-
         product_data = product.dict()
+        # Los clientes anteriores a las etiquetas no las envían: un PUT sin
+        # tags conserva las que hubiera en lugar de borrarlas
+        if "tags" not in product.model_fields_set:
+            del product_data["tags"]
         updated_product = update_product(product_id, product_data)
+        if not updated_product:
+            raise HTTPException(status_code=404, detail=f"Producto con ID {product_id} no encontrado")
         return ProductResponse(**updated_product)
 
-    except HTTPException:
+    except DuplicateProductNameError:
+        raise HTTPException(status_code=409, detail=f"Ya existe otro producto con el nombre '{product.name}'")
+    except (HTTPException, StorageUnavailableError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al actualizar producto: {str(e)}")
 
 
 @app.delete("/products/{product_id}", status_code=204)
-async def delete_existing_product(product_id: int = Path(..., gt=0)):
+def delete_existing_product(product_id: int = Path(..., gt=0)):
     existing_product = get_product_by_id(product_id)
     if not existing_product:
         raise HTTPException(status_code=404, detail=f"Producto con ID {product_id} no encontrado")
 
-    deleted = delete_product(product_id)
+    deleted = products_data.delete_product(product_id)
     if not deleted:
         raise HTTPException(status_code=500, detail="Error al eliminar el producto")
 
     return Response(status_code=204)
 
 
+# -----------------------------
+# OPERACIONES EN LOTE (NDJSON)
+# -----------------------------
+# Cada línea del cuerpo es un objeto JSON. Las líneas se validan por bloques
+# con un único TypeAdapter y cada bloque se escribe en una sola sección
+# crítica del backend. La respuesta es otro NDJSON con una línea por línea
+# de entrada: {"line": n, "status": ..., "id": ...} o {"line": n, "status": ..., "detail": ...}
+_PRODUCT_CREATE_LIST = TypeAdapter(List[ProductCreate])
+_PRODUCT_PATCH_LIST = TypeAdapter(List[ProductPatch])
+
+_SUCCESS_STATUS = {"create": 201, "update": 200, "delete": 204}
+
+
+async def _ndjson_batches(request: Request, batch_size: int) -> AsyncIterator[List[tuple]]:
+    """
+    Lee el cuerpo según llega y genera bloques de (número de línea, valor);
+    el valor es el JSON de la línea o la excepción si no se pudo decodificar.
+    Las líneas vacías se ignoran pero cuentan para la numeración.
+    """
+    pending = b""
+    line_number = 0
+    batch = []
+    async for chunk in request.stream():
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                batch.append((line_number, _decode_line(line)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if pending.strip():
+        batch.append((line_number + 1, _decode_line(pending)))
+    if batch:
+        yield batch
+
+
+def _decode_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return error
+
+
+def _validate_batch(adapter: TypeAdapter, values: List[object]) -> List[object]:
+    """
+    Valida un bloque de una vez y devuelve, por valor, el modelo o la lista
+    de errores. Si alguna línea falla, se revalida solo el resto: un error
+    no obliga a validar fila a fila.
+    """
+    try:
+        return adapter.validate_python(values)
+    except ValidationError as error:
+        errors = {}
+        for detail in error.errors(include_url=False, include_context=False):
+            errors.setdefault(detail["loc"][0], []).append(
+                {"loc": list(detail["loc"][1:]), "msg": detail["msg"]}
+            )
+    valid = [index for index in range(len(values)) if index not in errors]
+    models = dict(zip(valid, adapter.validate_python([values[index] for index in valid])))
+    return [models[index] if index in models else errors[index] for index in range(len(values))]
+
+
+def _result_line(line_number: int, operation: tuple, result: object) -> dict:
+    if isinstance(result, DuplicateProductNameError):
+        return {"line": line_number, "status": 409, "detail": result.message}
+    if isinstance(result, ProductNotFoundError):
+        return {"line": line_number, "status": 404, "detail": result.message}
+    op, product_id, _ = operation
+    return {
+        "line": line_number,
+        "status": _SUCCESS_STATUS[op],
+        "id": result["id"] if isinstance(result, dict) else product_id
+    }
+
+
+def _check_batch(batch: List[tuple], adapter: TypeAdapter, to_operation: Callable) -> Tuple[List[tuple], List[tuple]]:
+    """
+    Valida un bloque y lo separa en líneas ya respondidas (JSON inválido o
+    errores de validación) y operaciones pendientes de escribir.
+    """
+    outcomes = []   # (número de línea, línea de respuesta)
+    planned = []    # (número de línea, operación) validadas y aún sin escribir
+    values = [value for _, value in batch if not isinstance(value, ValueError)]
+    checked = iter(_validate_batch(adapter, values) if values else [])
+    for line_number, value in batch:
+        if isinstance(value, ValueError):
+            outcomes.append((line_number, {"line": line_number, "status": 400, "detail": f"JSON inválido: {value}"}))
+            continue
+        model = next(checked)
+        if isinstance(model, list):
+            outcomes.append((line_number, {"line": line_number, "status": 422, "detail": model}))
+        else:
+            planned.append((line_number, to_operation(model)))
+    return outcomes, planned
+
+
+def _outcome_lines(outcomes: List[tuple]) -> Iterator[str]:
+    outcomes.sort(key=lambda outcome: outcome[0])
+    return (json.dumps(line, ensure_ascii=False) + "\n" for _, line in outcomes)
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que no lee de receive para detectar la desconexión:
+    su generador sigue leyendo el cuerpo de la petición mientras responde, y
+    esos mensajes no se pueden perder. Si el cliente se va, el generador se
+    entera al leer el cuerpo o al escribir.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+async def _write_bulk(
+    request: Request,
+    adapter: TypeAdapter,
+    to_operation: Callable,
+    atomic: bool,
+    batch_size: int
+) -> StreamingResponse:
+    if not atomic:
+        return _DuplexStreamingResponse(
+            _stream_bulk(request, adapter, to_operation, batch_size), media_type="application/x-ndjson"
+        )
+
+    # Atómico: nada se escribe ni se responde hasta validar el cuerpo entero
+    outcomes, planned = [], []
+    async for batch in _ndjson_batches(request, batch_size):
+        batch_outcomes, batch_planned = _check_batch(batch, adapter, to_operation)
+        outcomes += batch_outcomes
+        planned += batch_planned
+    if outcomes:
+        # Alguna línea no es válida: no se escribe nada
+        outcomes += [(line_number, _not_applied(line_number)) for line_number, _ in planned]
+    elif planned:
+        outcomes += await _apply_planned(planned, atomic=True)
+
+    # El cuerpo ya está leído entero: StreamingResponse escucha la desconexión
+    # del cliente leyendo de receive mientras responde
+    return StreamingResponse(_outcome_lines(outcomes), media_type="application/x-ndjson")
+
+
+async def _stream_bulk(
+    request: Request,
+    adapter: TypeAdapter,
+    to_operation: Callable,
+    batch_size: int
+) -> AsyncIterator[str]:
+    """
+    Sin atomic, cada bloque se escribe en cuanto se valida y sus líneas de
+    respuesta salen enseguida, mientras el resto del cuerpo llega; solo se
+    guarda un bloque a la vez. Los bloques llegan en orden, así que la
+    respuesta sigue el orden de las líneas.
+    """
+    async for batch in _ndjson_batches(request, batch_size):
+        outcomes, planned = _check_batch(batch, adapter, to_operation)
+        if planned:
+            # En el pool de hilos, igual que los endpoints de escritura síncronos
+            outcomes += await _apply_planned(planned, atomic=False)
+        for line in _outcome_lines(outcomes):
+            yield line
+
+
+def _not_applied(line_number: int) -> dict:
+    return {"line": line_number, "status": 424, "detail": "No se aplicó: otra línea del lote atómico falló"}
+
+
+async def _apply_planned(planned: List[tuple], atomic: bool) -> List[tuple]:
+    operations = [operation for _, operation in planned]
+    applied, results = await run_in_threadpool(products_data.write_products, operations, atomic)
+    outcomes = []
+    for (line_number, operation), result in zip(planned, results):
+        if not applied and result is None:
+            outcomes.append((line_number, _not_applied(line_number)))
+        else:
+            outcomes.append((line_number, _result_line(line_number, operation, result)))
+    return outcomes
+
+
+@app.post("/products/bulk", summary="Alta masiva de productos en NDJSON")
+async def bulk_create_products(
+    request: Request,
+    atomic: bool = Query(False, description="Si una línea falla no se aplica ninguna"),
+    batch_size: int = Query(1000, ge=1, le=10000, description="Líneas por bloque de validación y escritura")
+):
+    """Cada línea es un ProductCreate. Sin atomic, cada bloque se escribe en cuanto se valida."""
+    return await _write_bulk(
+        request, _PRODUCT_CREATE_LIST,
+        lambda product: ("create", None, product.dict()),
+        atomic, batch_size
+    )
+
+
+@app.patch("/products/bulk", summary="Cambios y bajas masivas de productos en NDJSON")
+async def bulk_patch_products(
+    request: Request,
+    atomic: bool = Query(False, description="Si una línea falla no se aplica ninguna"),
+    batch_size: int = Query(1000, ge=1, le=10000, description="Líneas por bloque de validación y escritura")
+):
+    """Cada línea es {"id": ..., campos a cambiar} o {"id": ..., "op": "delete"}."""
+    return await _write_bulk(
+        request, _PRODUCT_PATCH_LIST,
+        lambda patch: ("delete", patch.id, None) if patch.op == "delete" else ("update", patch.id, patch.changes()),
+        atomic, batch_size
+    )
+
+
+@app.post("/products/import", summary="Importa productos desde un CSV de proveedor")
+def import_products_csv(
+    file: UploadFile = File(..., description="CSV con cabecera: name, price, category y opcionales"),
+    chunk_size: int = Query(50_000, ge=100, le=500_000, description="Filas por bloque")
+):
+    """
+    El fichero subido se procesa por bloques (ver data.csv_import): validación
+    por columnas, Pydantic solo para las filas que fallan e inserción de cada
+    bloque de una vez. Devuelve el resumen con los primeros errores.
+    """
+    try:
+        return import_csv(file.file, chunk_size=chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"CSV inválido: {str(e)}")
+
+
 # -----------------------------
 # MODELOS EXTRA (USER, PRODUCT, ORDER, REGISTRATION)
 # -----------------------------
@@ -260,84 +852,6 @@ def register_user(user: UserRegistration):
     }
 
 
-# -----------------------------
-# NUEVOS FILTROS (ProductFilters)
-# -----------------------------
-class ProductFilters:
-    def __init__(
-        self,
-        name: Optional[str] = Query(None, min_length=2, max_length=50),
-        min_price: Optional[float] = Query(None, ge=0, le=1000000),
-        max_price: Optional[float] = Query(None, ge=0, le=1000000),
-        category: Optional[str] = Query(None, regex=r'^[a-zA-Z\s]+$'),
-        in_stock: Optional[bool] = Query(None),
-        tags: Optional[List[str]] = Query(None),
-        page: int = Query(1, ge=1, le=100),
-        limit: int = Query(10, ge=1, le=50)
-    ):
-        if min_price is not None and max_price is not None and min_price > max_price:
-            raise ValueError("min_price no puede ser mayor que max_price")
-
-        self.name = name
-        self.min_price = min_price
-        self.max_price = max_price
-        self.category = category
-        self.in_stock = in_stock
-        self.tags = tags
-        self.page = page
-        self.limit = limit
-
-
-@app.get("/products/search")
-def search_products(filters: ProductFilters = Depends()):
-    all_products = [
-        {"id": 1, "name": "Laptop Gaming", "price": 1500.0, "category": "electronics", "in_stock": True, "tags": ["gaming", "powerful"]},
-        {"id": 2, "name": "Mouse Wireless", "price": 50.0, "category": "electronics", "in_stock": True, "tags": ["wireless", "ergonomic"]},
-        {"id": 3, "name": "Teclado Mecánico", "price": 120.0, "category": "electronics", "in_stock": False, "tags": ["mechanical", "rgb"]},
-        {"id": 4, "name": "Monitor 4K", "price": 800.0, "category": "electronics", "in_stock": True, "tags": ["4k", "gaming"]},
-        {"id": 5, "name": "Camiseta Deportiva", "price": 25.0, "category": "clothing", "in_stock": True, "tags": ["sport", "comfortable"]}
-    ]
-
-    filtered_products = all_products.copy()
-
-    if filters.name:
-        filtered_products = [p for p in filtered_products if filters.name.lower() in p["name"].lower()]
-
-    if filters.min_price is not None:
-        filtered_products = [p for p in filtered_products if p["price"] >= filters.min_price]
-
-    if filters.max_price is not None:
-        filtered_products = [p for p in filtered_products if p["price"] <= filters.max_price]
-
-    if filters.category:
-        filtered_products = [p for p in filtered_products if p["category"] == filters.category]
-
-    if filters.in_stock is not None:
-        filtered_products = [p for p in filtered_products if p["in_stock"] == filters.in_stock]
-
-    if filters.tags:
-        filtered_products = [p for p in filtered_products if any(tag in p["tags"] for tag in filters.tags)]
-
-    start = (filters.page - 1) * filters.limit
-    end = start + filters.limit
-    paginated_products = filtered_products[start:end]
-
-    return {
-        "products": paginated_products,
-        "total": len(filtered_products),
-        "page": filters.page,
-        "limit": filters.limit,
-        "total_pages": (len(filtered_products) + filters.limit - 1) // filters.limit,
-        "filters_applied": {
-            "name": filters.name,
-            "price_range": f"{filters.min_price}-{filters.max_price}",
-            "category": filters.category,
-            "in_stock": filters.in_stock,
-            "tags": filters.tags
-        }
-    }
-
-
 @app.get("/products/price-range")
 def get_products_by_price(
     min_price: float = Query(..., ge=0, le=1000000),
@@ -704,19 +1218,24 @@ def delete_product(product_id: int):
 def get_stats():
     logger.info("Consultando estadísticas de la API")
 
-    total_products = len(products)
-    total_stock = sum(p.get("stock", 0) for p in products)
-    avg_price = sum(p["price"] for p in products) / total_products if total_products > 0 else 0
-
-    stats = {
-        "total_products": total_products,
-        "total_stock": total_stock,
-        "average_price": round(avg_price, 2)
-    }
+    # Agregados mantenidos en cada escritura: no se recorre el catálogo
+    stats = products_data.get_catalog_stats()
 
     logger.info(f"Estadísticas calculadas: {stats}")
 
     return create_success_response(
         message="Estadísticas calculadas exitosamente",
         data={"stats": stats}
+    )
+
+
+@app.get("/stats/check")
+def check_stats():
+    """Recalcula las estadísticas desde cero e informa si los agregados se han desviado."""
+    result = products_data.check_catalog_stats()
+    if not result["consistent"]:
+        logger.warning(f"Los agregados del catálogo se han desviado: {result['drift']}")
+    return create_success_response(
+        message="Estadísticas comprobadas",
+        data=result
     )
\ No newline at end of file
@@ -0,0 +1,55 @@
+"""
+Benchmark de serialización del listado de libros: JSONResponse con
+jsonable_encoder frente a ORJSONResponse, por petición.
+
+Uso (desde mi-api-organizada): python -m bench.json_responses [--books 200] [--repeat 2000]
+"""
+import argparse
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from models.book import Book
+from utils.responses import ORJSONResponse, success_response
+
+
+def _books(count: int):
+    return [
+        Book(
+            title=f"libro de prueba {book_id}",
+            author="Autor de Prueba",
+            rating=4.5,
+            bestseller=book_id % 2 == 0,
+            tags=["novela", f"serie-{book_id % 7}"],
+            year=1950 + book_id % 70,
+            price=19.99
+        )
+        for book_id in range(count)
+    ]
+
+
+def _per_call(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    books = _books(args.books)
+    # El timestamp de success_response se genera una vez por petición en ambos casos
+    old = _per_call(lambda: JSONResponse(jsonable_encoder(success_response(books))).body, args.repeat)
+    new = _per_call(lambda: ORJSONResponse(success_response(books)).body, args.repeat)
+    print(f"GET /api/v1/books ({args.books} libros):")
+    print(f"  jsonable_encoder + json stdlib: {old:9.1f} µs/petición")
+    print(f"  ORJSONResponse:                 {new:9.1f} µs/petición  ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
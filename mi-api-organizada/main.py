@@ -15,6 +15,7 @@ from exceptions.custom_exceptions import (
 
 # Utils
 from utils.exception_handlers import register_exception_handlers
+from utils.responses import ORJSONResponse
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -24,7 +25,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Mi API Organizada y Biblioteca API",
     description="API de productos y libros con estructura profesional",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Configurar CORS
@@ -7,15 +7,16 @@ from services.book_service import (
     return_book,
     search_books
 )
-from utils.responses import success_response
+from utils.responses import success_response, ORJSONResponse
 
 router = APIRouter(prefix="/api/v1/books", tags=["Books"])
 
 # 📚 Listar libros
 @router.get("/")
 def list_books():
-    
-    return success_response(get_books())
+    # Se devuelve la respuesta ya construida: orjson serializa los modelos
+    # sin pasar por jsonable_encoder
+    return ORJSONResponse(success_response(get_books()))
 
 # ➕ Crear libro
 @router.post("/")
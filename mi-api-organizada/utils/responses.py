@@ -1,4 +1,33 @@
 from datetime import datetime
+from decimal import Decimal
+
+import orjson
+import fastapi.responses
+from pydantic import BaseModel
+
+
+def _orjson_default(value):
+    # orjson ya sabe serializar datetime, date, Enum y UUID; faltan los
+    # modelos de Pydantic (el listado de libros los devuelve tal cual) y Decimal
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+class ORJSONResponse(fastapi.responses.ORJSONResponse):
+    """
+    La ORJSONResponse de FastAPI con el hook anterior para los modelos de
+    Pydantic. Devolverla directamente desde un endpoint evita además el
+    recorrido de jsonable_encoder.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(
+            content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
 
 def success_response(data, message="Operation completed successfully"):
     return {
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List
+from pydantic import BaseModel, Field, validator, model_validator
+from typing import Dict, Optional, List, Literal
 from datetime import datetime
 from enum import Enum
 
@@ -10,11 +10,41 @@ class CategoryEnum(str, Enum):
     home = "home"
     sports = "sports"
 
+class SortByEnum(str, Enum):
+    id = "id"
+    price = "price"
+
+class ExportFormatEnum(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+class TagsModeEnum(str, Enum):
+    any = "any"
+    all = "all"
+
+# Límites de las etiquetas de un producto
+MAX_TAGS = 10
+MAX_TAG_LENGTH = 30
+
+def normalize_tags(tags: List[str]) -> List[str]:
+    """Etiquetas en minúsculas y sin espacios alrededor, sin repetir y en el orden recibido."""
+    normalized = []
+    for tag in tags:
+        tag = tag.strip().lower()
+        if not tag:
+            raise ValueError('Las etiquetas no pueden estar vacías')
+        if len(tag) > MAX_TAG_LENGTH or "," in tag or not tag.isprintable():
+            raise ValueError(f"Etiqueta inválida: '{tag}'")
+        if tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
 class ProductBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100, description="Nombre del producto")
     price: float = Field(..., gt=0, le=999999.99, description="Precio del producto")
     description: Optional[str] = Field(None, max_length=500, description="Descripción del producto")
     category: CategoryEnum = Field(..., description="Categoría del producto")
+    tags: List[str] = Field(default_factory=list, max_length=MAX_TAGS, description="Etiquetas del producto")
 
     @validator('name')
     def name_must_not_be_empty(cls, v):
@@ -22,6 +52,10 @@ class ProductBase(BaseModel):
             raise ValueError('El nombre no puede estar vacío')
         return v.strip().title()
 
+    @validator('tags')
+    def tags_must_be_valid(cls, v):
+        return normalize_tags(v)
+
 class ProductCreate(ProductBase):
     in_stock: bool = Field(True, description="Producto en stock")
     stock_quantity: int = Field(0, ge=0, le=9999, description="Cantidad en stock")
@@ -30,6 +64,41 @@ class ProductUpdate(ProductBase):
     in_stock: bool = Field(..., description="Producto en stock")
     stock_quantity: int = Field(..., ge=0, le=9999, description="Cantidad en stock")
 
+class ProductPatch(BaseModel):
+    """Línea de PATCH /products/bulk: cambios parciales de un producto, o op="delete"."""
+    id: int = Field(..., gt=0, description="ID del producto")
+    op: Literal["update", "delete"] = Field("update", description="Operación sobre el producto")
+    name: Optional[str] = Field(None, min_length=1, max_length=100)
+    price: Optional[float] = Field(None, gt=0, le=999999.99)
+    description: Optional[str] = Field(None, max_length=500)
+    category: Optional[CategoryEnum] = None
+    in_stock: Optional[bool] = None
+    stock_quantity: Optional[int] = Field(None, ge=0, le=9999)
+    tags: Optional[List[str]] = Field(None, max_length=MAX_TAGS)
+
+    @validator('name')
+    def name_must_not_be_empty(cls, v):
+        if v is None:
+            return v
+        if not v.strip():
+            raise ValueError('El nombre no puede estar vacío')
+        return v.strip().title()
+
+    @validator('tags')
+    def tags_must_be_valid(cls, v):
+        return v if v is None else normalize_tags(v)
+
+    @model_validator(mode="after")
+    def fields_must_not_be_null(self):
+        # Solo la descripción admite null; en el resto, null no es un cambio válido
+        for field in ("name", "price", "category", "in_stock", "stock_quantity", "tags"):
+            if field in self.model_fields_set and getattr(self, field) is None:
+                raise ValueError(f"El campo '{field}' no puede ser null")
+        return self
+
+    def changes(self) -> dict:
+        return self.dict(exclude_unset=True, exclude={"id", "op"})
+
 class ProductResponse(ProductBase):
     id: int = Field(..., description="ID único del producto")
     in_stock: bool
@@ -45,6 +114,7 @@ class ProductResponse(ProductBase):
                 "price": 1299.99,
                 "description": "Laptop para gaming de alta performance",
                 "category": "electronics",
+                "tags": ["gaming", "portatil"],
                 "in_stock": True,
                 "stock_quantity": 15,
                 "created_at": "2025-07-24T10:00:00",
@@ -54,9 +124,21 @@ class ProductResponse(ProductBase):
 
 class ProductList(BaseModel):
     products: List[ProductResponse]
-    total: int
+    total: Optional[int] = Field(None, description="Total de resultados; None si include_total=false")
     page: int
     page_size: int
+    next_cursor: Optional[str] = Field(None, description="Cursor opaco para pedir la siguiente página")
+    facets: Optional[Dict[str, Dict[str, int]]] = Field(
+        None, description="Cuentas por valor de cada faceta pedida en facets, con los mismos filtros"
+    )
+
+class RankedProduct(BaseModel):
+    score: float = Field(..., description="Relevancia BM25; solo comparable dentro de la misma respuesta")
+    product: ProductResponse
+
+class RankedProductList(BaseModel):
+    query: str
+    results: List[RankedProduct]
 
 class ErrorResponse(BaseModel):
     success: bool = False
@@ -0,0 +1,1131 @@
+import asyncio
+import base64
+import io
+import json
+import threading
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from main import app
+from data.columnar import ColumnarProductStore
+from data.products_data import set_backend, get_product_by_id, get_all_products
+from data import shared_memory_backend as shm_layout
+from data.shared_memory_backend import SharedMemoryProductBackend
+from data.sqlite_backend import SQLiteProductBackend
+from data import wal
+from data.id_allocator import LeasedIdAllocator
+from data.memory_backend import MemoryProductBackend
+from data.products_data import (
+    create_product, update_product, delete_product, filter_products,
+    filter_product_ids, find_product_id_by_name, iter_product_ids,
+    count_product_ids
+)
+from exceptions.custom_exceptions import (
+    DuplicateProductNameError, ProductNotFoundError, StorageUnavailableError
+)
+from models.product_models import CategoryEnum
+
+
+def _new_product(name, price, category=CategoryEnum.home, in_stock=True, stock_quantity=5):
+    return create_product({
+        "name": name,
+        "price": price,
+        "description": None,
+        "category": category,
+        "in_stock": in_stock,
+        "stock_quantity": stock_quantity
+    })
+
+
+def test_filter_by_price_range_follows_writes():
+    product = _new_product("Lampara Indice", 321.5)
+
+    ids = [p["id"] for p in filter_products(min_price=321, max_price=322)]
+    assert ids == [product["id"]]
+
+    update_product(product["id"], {"price": 10.0})
+    assert filter_products(min_price=321, max_price=322) == []
+    assert product["id"] in [p["id"] for p in filter_products(max_price=10.0)]
+
+    delete_product(product["id"])
+    assert product["id"] not in [p["id"] for p in filter_products(max_price=10.0)]
+
+
+def test_filter_by_price_range_keeps_id_order():
+    products = filter_products(min_price=0)
+    ids = [p["id"] for p in products]
+    assert ids == sorted(ids)
+    assert filter_products(min_price=50, max_price=10) == []
+
+
+def test_filter_by_category_and_stock_uses_indexes():
+    available = _new_product("Balon Indice", 40.0, CategoryEnum.sports, in_stock=True)
+    sold_out = _new_product("Raqueta Indice", 40.0, CategoryEnum.sports, in_stock=False, stock_quantity=0)
+
+    ids = [p["id"] for p in filter_products(category="sports", in_stock=True)]
+    assert available["id"] in ids
+    assert sold_out["id"] not in ids
+
+    update_product(sold_out["id"], {"in_stock": True, "stock_quantity": 3})
+    ids = [p["id"] for p in filter_products(category=CategoryEnum.sports, in_stock=True, max_price=40.0)]
+    assert ids == sorted([available["id"], sold_out["id"]])
+
+    delete_product(available["id"])
+    delete_product(sold_out["id"])
+    assert filter_products(category="sports", in_stock=True, min_price=40.0, max_price=40.0) == []
+
+
+def test_columnar_store_compaction_keeps_order():
+    store = ColumnarProductStore(capacity=4)
+    for product_id in range(1, 3001):
+        store[product_id] = {
+            "id": product_id,
+            "name": f"Producto {product_id}",
+            "price": float(product_id),
+            "description": None,
+            "category": CategoryEnum.books,
+            "in_stock": product_id % 2 == 0,
+            "stock_quantity": 1,
+            "created_at": datetime(2025, 1, 1),
+            "updated_at": None
+        }
+    for product_id in range(1, 1501):
+        store.pop(product_id)
+
+    assert len(store) == 1500
+    assert list(store)[:2] == [1501, 1502]
+    assert store[2000]["price"] == 2000.0
+    assert 1000 not in store
+
+    rows = store.alive_rows()
+    in_stock_ids = store.ids_for_rows(rows[store.mask(in_stock=True, max_price=1510, rows=rows)])
+    assert in_stock_ids == [1502, 1504, 1506, 1508, 1510]
+
+
+def test_columnar_store_keeps_timestamps_as_epoch_micros():
+    store = ColumnarProductStore()
+    created_at = datetime(2025, 7, 20, 10, 0, 0, 123456)
+    for product_id in (1, 2):
+        store[product_id] = {
+            "id": product_id, "name": f"Fecha {product_id}", "price": 1.0,
+            "description": "".join(["Descripción ", "compartida"]),
+            "category": CategoryEnum.books, "in_stock": True, "stock_quantity": 1,
+            "created_at": created_at, "updated_at": None
+        }
+
+    assert store.created_at.dtype == np.int64
+    assert store[1]["created_at"] == created_at
+    assert store[1]["updated_at"] is None
+    # Los textos repetidos se internan
+    assert store.text_of(0)[1] is store.text_of(1)[1]
+
+
+def test_search_uses_trigram_index_and_verifies_substring():
+    product = _new_product("Cafetera Espresso", 89.0)
+    update_product(product["id"], {"description": "Molinillo integrado"})
+
+    assert product["id"] in filter_product_ids(search="ESPRES")
+    assert product["id"] in filter_product_ids(search="molinillo", max_price=100)
+    assert product["id"] in filter_product_ids(search="ca")
+    # Comparte trigramas con "espresso" pero no es subcadena
+    assert product["id"] not in filter_product_ids(search="spresspres")
+
+    update_product(product["id"], {"name": "Tetera", "description": None})
+    assert product["id"] not in filter_product_ids(search="espresso")
+    delete_product(product["id"])
+
+
+def test_duplicate_names_are_rejected_case_insensitively():
+    product = _new_product("Silla Ergonómica", 150.0)
+    assert find_product_id_by_name("SILLA ERGONÓMICA") == product["id"]
+
+    with pytest.raises(DuplicateProductNameError):
+        _new_product("silla ergonómica", 99.0)
+
+    update_product(product["id"], {"name": "Silla Gamer"})
+    assert find_product_id_by_name("silla ergonómica") is None
+    delete_product(product["id"])
+    assert find_product_id_by_name("silla gamer") is None
+
+
+@pytest.mark.asyncio
+async def test_create_update_and_delete_products():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        payload = {"name": "monitor curvo", "price": 300, "category": "electronics", "stock_quantity": 4}
+        response = await client.post("/products", json=payload)
+        assert response.status_code == 201
+        product_id = response.json()["id"]
+
+        response = await client.post("/products", json={**payload, "name": "MONITOR CURVO"})
+        assert response.status_code == 409
+
+        response = await client.put(f"/products/{product_id}", json={**payload, "name": "Laptop Gaming", "in_stock": True})
+        assert response.status_code == 409
+
+        response = await client.put(f"/products/{product_id}", json={**payload, "price": 280, "in_stock": True})
+        assert response.status_code == 200
+        assert response.json()["price"] == 280
+
+        # Un PUT sin tags conserva las etiquetas; con tags, las sustituye
+        await client.put(f"/products/{product_id}", json={**payload, "in_stock": True, "tags": ["Curvo", "4k"]})
+        response = await client.put(f"/products/{product_id}", json={**payload, "price": 250, "in_stock": True})
+        assert (response.json()["price"], response.json()["tags"]) == (250, ["curvo", "4k"])
+        response = await client.put(f"/products/{product_id}", json={**payload, "in_stock": True, "tags": []})
+        assert response.json()["tags"] == []
+
+        response = await client.delete(f"/products/{product_id}")
+        assert response.status_code == 204
+        response = await client.get(f"/products/{product_id}")
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_cursor_pagination_walks_all_results():
+    created = [_new_product(f"Cuaderno Cursor {i}", 5.0 + (i % 3), CategoryEnum.books) for i in range(7)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        for sort_by in ("id", "price"):
+            params = {"category": "books", "page_size": 3, "sort_by": sort_by, "max_price": 7}
+            expected = [p["id"] for p in (await client.get("/products", params={**params, "page_size": 100})).json()["products"]]
+
+            seen = []
+            response = (await client.get("/products", params=params)).json()
+            seen += [p["id"] for p in response["products"]]
+            while response["next_cursor"]:
+                response = (await client.get("/products", params={**params, "cursor": response["next_cursor"], "include_total": False})).json()
+                assert response["total"] is None
+                seen += [p["id"] for p in response["products"]]
+
+            assert seen == expected
+            assert len(seen) == 7
+
+        response = await client.get("/products", params={"cursor": "no-es-un-cursor"})
+        assert response.status_code == 400
+        for raw in ('["id", 1, Infinity]', '["id", NaN, 1]', '["price", 1.0, 1e30]', '["id", 1, 9223372036854775808]'):
+            bad_cursor = base64.urlsafe_b64encode(raw.encode()).decode()
+            response = await client.get("/products", params={"cursor": bad_cursor, "sort_by": json.loads(raw)[0]})
+            assert response.status_code == 400
+
+    for product in created:
+        delete_product(product["id"])
+
+
+def test_lazy_pipeline_skips_offset_and_counts_without_rows():
+    created = [_new_product(f"Pesa Lazy {i}", 12.0, CategoryEnum.sports, in_stock=i % 2 == 0) for i in range(6)]
+    expected = filter_product_ids(category="sports", in_stock=True)
+
+    assert list(iter_product_ids(category="sports", in_stock=True, offset=1)) == expected[1:]
+    assert list(iter_product_ids(search="pesa lazy", offset=2)) == [p["id"] for p in created][2:]
+    assert count_product_ids(category="sports", in_stock=True) == len(expected)
+    assert count_product_ids(search="pesa lazy", in_stock=False) == 3
+
+    for product in created:
+        delete_product(product["id"])
+
+
+def test_sqlite_backend_keeps_the_same_api(tmp_path):
+    path = str(tmp_path / "products.db")
+    previous = set_backend(SQLiteProductBackend(path, seed=get_all_products()))
+    try:
+        product = _new_product("Termo Persistente", 25.0, CategoryEnum.home)
+        with pytest.raises(DuplicateProductNameError):
+            _new_product("TERMO persistente", 30.0)
+
+        assert get_product_by_id(product["id"])["category"] == CategoryEnum.home
+        assert filter_product_ids(category="home", search="persist", max_price=25) == [product["id"]]
+        assert list(iter_product_ids(sort_by="price", after=(25.0, product["id"]), max_price=29)) == []
+        assert count_product_ids(in_stock=True, min_price=20, max_price=26) == 1
+
+        update_product(product["id"], {"price": 27.5})
+        assert filter_products(min_price=27, max_price=28)[0]["price"] == 27.5
+    finally:
+        set_backend(previous).close()
+
+    # Los datos sobreviven a un reinicio
+    reopened = SQLiteProductBackend(path)
+    assert reopened.get(product["id"])["name"] == "Termo Persistente"
+    assert reopened.delete(product["id"])
+    reopened.close()
+
+
+def test_wal_recovers_snapshot_and_tail(tmp_path):
+    wal_path = str(tmp_path / "products.wal")
+    seed = get_all_products()
+    backend = MemoryProductBackend.open_durable(wal_path, seed=seed, flush_interval=0.001, snapshot_every=3)
+    # Otro proceso (u otra apertura) no puede usar el mismo WAL a la vez
+    with pytest.raises(StorageUnavailableError):
+        MemoryProductBackend.open_durable(wal_path, seed=seed)
+
+    first = backend.create({"name": "Reloj Durable", "price": 80.0, "description": None,
+                            "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 2})
+    second = backend.create({"name": "Radio Durable", "price": 60.0, "description": None,
+                             "category": CategoryEnum.electronics, "in_stock": True, "stock_quantity": 1})
+    backend.update(first["id"], {"price": 85.0})
+    backend.delete(second["id"])
+    backend.update(first["id"], {"stock_quantity": 7})
+    backend.close()
+
+    recovered = MemoryProductBackend.open_durable(wal_path, seed=[])
+    assert recovered.get(first["id"])["price"] == 85.0
+    assert recovered.get(first["id"])["stock_quantity"] == 7
+    assert recovered.get(second["id"]) is None
+    assert recovered.find_id_by_name("reloj durable") == first["id"]
+    assert len(list(recovered.all())) == len(seed) + 1
+    # Un ID borrado no se reutiliza tras el reinicio
+    assert recovered.get_next_id() > second["id"]
+    recovered.close()
+
+
+def test_bulk_load_sorts_price_index_once():
+    seed = [
+        {"id": product_id, "name": f"Carga {product_id}", "price": float(price), "description": None,
+         "category": CategoryEnum.books, "in_stock": True, "stock_quantity": 1,
+         "created_at": datetime(2025, 1, 1), "updated_at": None}
+        for product_id, price in [(3, 30), (1, 50), (2, 10), (1, 20)]
+    ]
+    backend = MemoryProductBackend(seed=seed)
+
+    # El último producto con un ID repetido sustituye al anterior
+    assert backend.get(1)["price"] == 20.0
+    assert list(backend.iter_ids(sort_by="price")) == [2, 1, 3]
+    assert list(backend.iter_ids(min_price=15, max_price=25)) == [1]
+    assert backend.get_next_id() == 4
+
+
+def test_lazy_scan_survives_compaction_between_chunks():
+    seed = [
+        {"id": product_id, "name": f"Compacta {product_id}", "price": 1.0, "description": None,
+         "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 1,
+         "created_at": datetime(2025, 1, 1), "updated_at": None}
+        for product_id in range(1, 20001)
+    ]
+    backend = MemoryProductBackend(seed=seed)
+    ids = backend.iter_ids(in_stock=True)
+    seen = [next(ids) for _ in range(4096)]
+
+    # Los borrados compactan el almacén mientras el recorrido está a medias
+    deleted = set(range(8001, 14001))
+    for product_id in deleted:
+        backend.delete(product_id)
+    seen += list(ids)
+
+    assert seen == [product_id for product_id in range(1, 20001) if product_id not in deleted]
+    assert [p["id"] for p in backend.get_many([1, 9000, 2])] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_wal_failure_makes_the_backend_unavailable(tmp_path, monkeypatch):
+    backend = MemoryProductBackend.open_durable(str(tmp_path / "products.wal"), seed=get_all_products(), flush_interval=0.001)
+    previous = set_backend(backend)
+    try:
+        def failing_fsync(fd):
+            raise OSError("disco lleno")
+        monkeypatch.setattr(wal.os, "fsync", failing_fsync)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            payload = {"name": "Disco Perdido", "price": 10, "category": "electronics", "stock_quantity": 1}
+            response = await client.post("/products", json=payload)
+            assert response.status_code == 503
+            # El producto está en memoria pero no en disco: no se debe servir
+            assert (await client.get("/products", params={"search": "disco perdido"})).status_code == 503
+            assert (await client.get("/products/1")).status_code == 503
+    finally:
+        monkeypatch.undo()
+        set_backend(previous)
+        backend.close()
+
+
+def test_catalog_file_is_mapped_and_decoded_lazily(tmp_path):
+    path = str(tmp_path / "products.catalog")
+    source = MemoryProductBackend(seed=get_all_products())
+    source.update(2, {"description": None})
+    source.save_catalog(path)
+
+    backend = MemoryProductBackend.open_catalog(path)
+    assert backend.get(1) == source.get(1)
+    assert backend.get(2)["description"] is None
+    assert list(backend.iter_ids(in_stock=True, max_price=100)) == [2]
+    # Filtrar por columnas y leer por ID no necesita índices ni diccionario de filas
+    assert not backend._indexes_ready
+    assert backend.products_db._row_by_id == {}
+    # Versiones y generación vienen del fichero, con una identidad común a
+    # todos los procesos que lo abren hasta que escriben
+    other = MemoryProductBackend.open_catalog(path)
+    assert backend.versions([1, 2]) == source.versions([1, 2])
+    assert (backend.instance_id, backend.generation()) == (other.instance_id, other.generation())
+    assert backend.generation() == source.generation()
+
+    created = backend.create({"name": "Mapa Mapeado", "price": 15.0, "description": "Papel",
+                              "category": CategoryEnum.books, "in_stock": True, "stock_quantity": 2})
+    assert created["id"] == source.get_next_id()
+    assert backend.instance_id != other.instance_id
+    with pytest.raises(DuplicateProductNameError):
+        backend.create({**created, "name": "laptop gaming"})
+    assert list(backend.iter_ids(search="mapead")) == [created["id"]]
+    assert list(backend.iter_ids(sort_by="price", max_price=30)) == [created["id"], 2]
+    # El fichero no cambia con las escrituras del proceso
+    assert MemoryProductBackend.open_catalog(path).get(created["id"]) is None
+
+
+def test_leased_ids_are_unique_across_allocators(tmp_path):
+    path = str(tmp_path / "products.ids")
+    # Dos allocators sobre el mismo fichero se comportan como dos workers
+    workers = [LeasedIdAllocator(path, block_size=10) for _ in range(2)]
+    workers[1].observe(500)
+
+    allocated, observed = [], []
+    def allocate(allocator):
+        for _ in range(200):
+            product_id = allocator.allocate()
+            allocated.append(product_id)
+            if allocator is workers[1]:
+                observed.append(product_id)
+    threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in workers * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(allocated)) == len(allocated) == 800
+    # Un ID ya visto no se vuelve a repartir
+    assert min(observed) > 500
+
+    backend = MemoryProductBackend(seed=get_all_products())
+    backend.set_id_allocator(LeasedIdAllocator(path, block_size=10))
+    assert backend.get_next_id() > max(allocated)
+
+
+def test_shared_memory_store_is_visible_to_every_worker(tmp_path):
+    segment_name = f"products_test_{uuid.uuid4().hex[:12]}"
+    options = dict(capacity=64, text_bytes=4096, lock_path=str(tmp_path / "shm.lock"))
+    writer = SharedMemoryProductBackend(segment_name, seed=get_all_products(), **options)
+    # Un segundo worker se engancha al segmento existente en lugar de sembrarlo
+    reader = SharedMemoryProductBackend(segment_name, seed=[{"id": 99}], **options)
+    try:
+        created = writer.create({"name": "Mochila Compartida", "price": 35.0, "description": None,
+                                 "category": CategoryEnum.sports, "in_stock": True, "stock_quantity": 3})
+        assert reader.get(created["id"]) == created
+        with pytest.raises(DuplicateProductNameError):
+            reader.create({**created, "name": "MOCHILA compartida"})
+
+        reader.update(created["id"], {"price": 20.0, "description": "Impermeable"})
+        assert writer.get(created["id"])["description"] == "Impermeable"
+        assert list(writer.iter_ids(search="imperm", max_price=25)) == [created["id"]]
+        assert list(writer.iter_ids(sort_by="price", max_price=30)) == [created["id"], 2]
+        assert writer.count(in_stock=True) == 3
+        # Cada worker tiene su índice de relevancia y lo pone al día con las escrituras de los demás
+        assert reader.ranked_search("impermeable", 5)[0][0] == created["id"]
+        writer.update(created["id"], {"description": "Acolchada"})
+        assert reader.ranked_search("acolchada", 5)[0][0] == created["id"]
+        assert reader.ranked_search("impermeable", 5) == []
+
+        assert writer.delete(created["id"])
+        assert reader.get(created["id"]) is None
+        assert reader.ranked_search("mochila", 5) == []
+        assert [p["id"] for p in reader.all()] == [1, 2, 3]
+    finally:
+        reader.close()
+        writer.unlink()
+        writer.close()
+
+
+def test_shared_memory_store_reclaims_deleted_rows_and_replaced_text(tmp_path):
+    segment_name = f"products_test_{uuid.uuid4().hex[:12]}"
+    backend = SharedMemoryProductBackend(segment_name, capacity=4, text_bytes=320,
+                                         seed=get_all_products(), lock_path=str(tmp_path / "shm.lock"))
+    try:
+        # Cada actualización reescribe los textos; sin compactar, el área se llenaría
+        for price in range(1, 40):
+            backend.update(2, {"price": float(price), "description": f"Revisión {price}"})
+        # Y cada alta ocupa una fila nueva, aunque se borre la anterior
+        for number in range(10):
+            created = backend.create({"name": f"Temporal {number}", "price": 1.0, "description": "x" * 20,
+                                      "category": CategoryEnum.books, "in_stock": True, "stock_quantity": 1})
+            assert backend.delete(created["id"])
+        assert backend.get(2)["description"] == "Revisión 39"
+        assert [p["id"] for p in backend.all()] == [1, 2, 3]
+        assert backend.find_id_by_name("CAMISETA algodón") == 2
+        assert backend.find_id_by_name("Temporal 9") is None
+        # La tabla de nombres sigue a los renombrados tras reconstruirse
+        backend.update(2, {"name": "Camiseta Lino"})
+        assert backend.find_id_by_name("camiseta lino") == 2
+        assert backend.find_id_by_name("Camiseta Algodón") is None
+        assert list(backend.iter_ids(search="revisión")) == [2]
+        current, fresh = backend.check_aggregates()
+        assert current == fresh
+
+        with pytest.raises(StorageUnavailableError):
+            backend.create({"name": "Enorme", "price": 1.0, "description": "x" * 400,
+                            "category": CategoryEnum.books, "in_stock": True, "stock_quantity": 1})
+        assert [p["id"] for p in backend.all()] == [1, 2, 3]
+    finally:
+        backend.unlink()
+        backend.close()
+
+
+def test_shared_memory_readers_repair_a_dead_writer(tmp_path):
+    segment_name = f"products_test_{uuid.uuid4().hex[:12]}"
+    options = dict(capacity=8, text_bytes=1024, lock_path=str(tmp_path / "shm.lock"))
+    backend = SharedMemoryProductBackend(segment_name, seed=get_all_products(), **options)
+    reader = SharedMemoryProductBackend(segment_name, **options)
+    try:
+        expected = backend.aggregates()
+        # Un escritor muere con la secuencia impar y los agregados a medias
+        backend._header[shm_layout._SEQ] += 1
+        backend._aggregates.add("books", 45.0, 0, -1)
+        assert reader.get(3)["name"] == "Python para Principiantes"
+        assert reader.aggregates() == expected
+        assert reader.generation() % 2 == 0
+
+        # Una compactación a medias no tiene arreglo
+        backend._header[shm_layout._SEQ] += 1
+        backend._header[shm_layout._COMPACTING] = 1
+        with pytest.raises(StorageUnavailableError):
+            reader.get(3)
+    finally:
+        reader.close()
+        backend.unlink()
+        backend.close()
+
+
+@pytest.mark.parametrize("tag_slots", [2, 64])
+def test_shared_memory_tag_lists_follow_writes(tmp_path, tag_slots):
+    # Con 2 huecos la tabla se llena y las etiquetas que faltan se buscan recorriendo las filas
+    segment_name = f"products_test_{uuid.uuid4().hex[:12]}"
+    backend = SharedMemoryProductBackend(segment_name, capacity=8, text_bytes=640, tag_slots=tag_slots,
+                                         seed=get_all_products(), lock_path=str(tmp_path / "shm.lock"))
+    try:
+        ids = [backend.create({"name": f"Cojin {number}", "price": 10.0 + number, "description": None,
+                               "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 1,
+                               "tags": tags})["id"]
+               for number, tags in enumerate([["rojo", "oferta"], ["azul"], ["rojo"], ["verde", "oferta"]])]
+        assert list(backend.iter_ids(tags=["rojo"])) == [ids[0], ids[2]]
+        assert list(backend.iter_ids(tags=["rojo", "oferta"], tags_mode="all")) == [ids[0]]
+        assert backend.count(tags=["verde", "azul"]) == 2
+
+        backend.update(ids[0], {"tags": ["azul"]})
+        assert backend.delete(ids[2])
+        assert list(backend.iter_ids(tags=["rojo"])) == []
+        assert list(backend.iter_ids(tags=["azul"], max_price=12)) == [ids[0], ids[1]]
+        # Las reescrituras llenan el área de textos: compactar mueve las filas y rehace las listas
+        for price in range(30):
+            backend.update(ids[3], {"price": float(price)})
+        assert list(backend.iter_ids(tags=["oferta"])) == [ids[3]]
+        assert list(backend.iter_ids(tags=["azul", "verde"], sort_by="price")) == [ids[0], ids[1], ids[3]]
+    finally:
+        backend.unlink()
+        backend.close()
+
+
+@pytest.mark.asyncio
+async def test_bulk_ndjson_reports_each_line():
+    lines = [
+        {"name": "Taza Lote Uno", "price": 8, "category": "home"},
+        {"name": "taza lote uno", "price": 9, "category": "home"},
+        {"name": "Taza Lote Dos", "price": -1, "category": "home"},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\n{no es json\n\n" + json.dumps({"name": "Taza Lote Tres", "price": 7, "category": "home"})
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/products/bulk", params={"batch_size": 2}, content=body)
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [(r["line"], r["status"]) for r in results] == [(1, 201), (2, 409), (3, 422), (4, 400), (6, 201)]
+        first_id, third_id = results[0]["id"], results[4]["id"]
+
+        patch = "\n".join(json.dumps(line) for line in [
+            {"id": first_id, "price": 11.5},
+            {"id": third_id, "name": "Taza Lote Uno"},
+            {"id": third_id, "op": "delete"},
+            {"id": third_id, "price": 1},
+            {"id": first_id, "price": None},
+        ])
+        response = await client.patch("/products/bulk", content=patch)
+        statuses = [json.loads(line)["status"] for line in response.text.splitlines()]
+        assert statuses == [200, 409, 204, 404, 422]
+        assert get_product_by_id(first_id)["price"] == 11.5
+
+        # Atómico: una línea fallida impide escribir las demás
+        response = await client.post("/products/bulk", params={"atomic": True}, content="\n".join([
+            json.dumps({"name": "Taza Atomica", "price": 3, "category": "home"}),
+            json.dumps({"name": "Taza Lote Uno", "price": 3, "category": "home"}),
+        ]))
+        assert [json.loads(line)["status"] for line in response.text.splitlines()] == [424, 409]
+        assert find_product_id_by_name("Taza Atomica") is None
+
+    delete_product(first_id)
+
+
+@pytest.mark.asyncio
+async def test_bulk_ndjson_answers_each_block_before_the_body_ends():
+    lines = [json.dumps({"name": f"Vaso Lote {i}", "price": 2, "category": "home"}) for i in range(4)]
+    messages = [
+        {"type": "http.request", "body": ("\n".join(lines[:2]) + "\n").encode(), "more_body": True},
+        {"type": "http.request", "body": "\n".join(lines[2:]).encode(), "more_body": False},
+    ]
+    first_block_answered = asyncio.Event()
+    chunks = []
+
+    async def receive():
+        if len(messages) == 1:
+            # El resto del cuerpo no llega hasta responder al primer bloque
+            await asyncio.wait_for(first_block_answered.wait(), timeout=5)
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            first_block_answered.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/products/bulk", "raw_path": b"/products/bulk", "root_path": "",
+        "query_string": b"batch_size=2", "headers": [], "server": ("test", 80), "client": ("test", 1234)
+    }
+    await app(scope, receive, send)
+    results = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert [(r["line"], r["status"]) for r in results] == [(1, 201), (2, 201), (3, 201), (4, 201)]
+    for result in results:
+        delete_product(result["id"])
+
+
+def test_write_many_is_atomic_in_every_backend(tmp_path):
+    backends = [
+        MemoryProductBackend(),
+        SQLiteProductBackend(str(tmp_path / "bulk.db")),
+        SharedMemoryProductBackend(f"bulk_{uuid.uuid4().hex[:8]}", capacity=16, text_bytes=4096,
+                                   lock_path=str(tmp_path / "bulk.lock")),
+    ]
+    data = {"description": None, "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 1}
+    for backend in backends:
+        applied, results = backend.write_many([
+            ("create", None, {**data, "name": "Vaso", "price": 1.0}),
+            ("create", None, {**data, "name": "Plato", "price": 2.0}),
+        ])
+        assert applied
+        vaso, plato = results
+
+        # Renombrar tras borrar al dueño del nombre es válido dentro del lote
+        applied, errors = backend.write_many([
+            ("delete", vaso["id"], None),
+            ("update", plato["id"], {"name": "Vaso"}),
+            ("update", vaso["id"], {"price": 3.0}),
+        ], atomic=True)
+        assert not applied
+        assert errors[:2] == [None, None] and isinstance(errors[2], ProductNotFoundError)
+        assert backend.get(vaso["id"]) is not None
+
+        applied, results = backend.write_many([
+            ("delete", vaso["id"], None),
+            ("update", plato["id"], {"name": "Vaso"}),
+        ], atomic=True)
+        assert applied and results[0] is True
+        assert backend.find_id_by_name("vaso") == plato["id"]
+
+        backend.close()
+        if isinstance(backend, SharedMemoryProductBackend):
+            backend.unlink()
+
+
+@pytest.mark.asyncio
+async def test_export_streams_filtered_catalog(monkeypatch):
+    import main
+    monkeypatch.setattr(main, "_EXPORT_CHUNK_SIZE", 2)
+    created = [_new_product(f"Lapiz Export {i}", 1.5 + i, CategoryEnum.books) for i in range(5)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/export", params={"search": "lapiz export", "min_price": 2})
+        assert response.headers["content-type"] == "application/x-ndjson"
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["id"] for row in rows] == [p["id"] for p in created[1:]]
+        assert rows[0]["category"] == "books"
+
+        response = await client.get("/products/export", params={"format": "csv", "search": "lapiz export"})
+        lines = response.text.splitlines()
+        assert lines[0] == "id,name,price,description,category,in_stock,stock_quantity,created_at,updated_at"
+        assert len(lines) == 6 and lines[1].startswith(f"{created[0]['id']},Lapiz Export 0,1.5,,books,True,5,")
+
+    for product in created:
+        delete_product(product["id"])
+
+
+@pytest.mark.asyncio
+async def test_csv_import_validates_by_columns_and_reports_errors(tmp_path, capsys):
+    csv_text = "\n".join([
+        "name,price,category,description,in_stock,stock_quantity",
+        "  silla importada ,19.5,home,Silla de pino,yes,3",
+        "Mesa Importada,-4,home,,,",
+        "SILLA IMPORTADA,10,home,,,",
+        "Lampara Importada,12,garden,,,",
+        "Laptop Gaming,900,electronics,,,",
+        "Estante Importado,1e2,home,,False,",
+    ])
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post(
+            "/products/import", params={"chunk_size": 100},
+            files={"file": ("proveedor.csv", csv_text.encode(), "text/csv")}
+        )
+        assert response.status_code == 200
+        summary = response.json()
+        assert (summary["rows"], summary["created"], summary["rejected"]) == (6, 2, 4)
+        assert [error["row"] for error in summary["errors"]] == [2, 4, 3, 5]
+        assert "price" in summary["errors"][0]["error"]
+
+        response = await client.post("/products/import", files={"file": ("x.csv", b"name,price\nA,1\n", "text/csv")})
+        assert response.status_code == 400
+
+    silla = get_product_by_id(find_product_id_by_name("Silla Importada"))
+    assert (silla["name"], silla["in_stock"], silla["stock_quantity"]) == ("Silla Importada", True, 3)
+    estante = get_product_by_id(find_product_id_by_name("Estante Importado"))
+    assert (estante["price"], estante["in_stock"], estante["stock_quantity"]) == (100.0, False, 0)
+
+    # tags: separadas por comas en una celda; lo que no pasa la comprobación
+    # por columnas lo decide Pydantic
+    from data.csv_import import import_csv
+    summary = import_csv(io.StringIO("\n".join([
+        "name,price,category,tags",
+        'Cojin Etiquetado,5,home," Rojo, oferta,rojo"',
+        'Cojin Vacio,5,home,"a,,b"',
+        'Cojin Raro,5,home,c#',
+        "Cojin Liso,5,home,",
+    ])))
+    assert (summary["created"], [error["row"] for error in summary["errors"]]) == (3, [2])
+    imported = {name: get_product_by_id(find_product_id_by_name(name)) for name in ("Cojin Etiquetado", "Cojin Raro", "Cojin Liso")}
+    assert [product["tags"] for product in imported.values()] == [["rojo", "oferta"], ["c#"], []]
+
+    # La CLI no escribe en memoria sin WAL: los productos se perderían al salir
+    from data.csv_import import main as import_cli
+    source, report = tmp_path / "again.csv", tmp_path / "errors.csv"
+    source.write_text(csv_text, encoding="utf-8")
+    assert import_cli([str(source)]) == 2
+    assert "POST /products/import" in capsys.readouterr().err
+
+    # Con un backend persistente escribe el informe completo de errores
+    previous = set_backend(SQLiteProductBackend(str(tmp_path / "cli.db"), seed=get_all_products()))
+    try:
+        assert import_cli([str(source), "--report", str(report)]) == 1
+        assert len(report.read_text(encoding="utf-8").splitlines()) == 1 + 6
+    finally:
+        set_backend(previous)
+
+    for product in [silla, estante, *imported.values()]:
+        delete_product(product["id"])
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_uses_versions_and_generation(tmp_path, monkeypatch):
+    import main
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        product = _new_product("Reloj Etag", 80.0)
+        response = await client.get(f"/products/{product['id']}")
+        etag = response.headers["etag"]
+        list_etag = (await client.get("/products")).headers["etag"]
+
+        # Un 304 no lee el producto ni construye modelos
+        def fail(*args, **kwargs):
+            raise AssertionError("no debería leer productos")
+        monkeypatch.setattr(main, "get_product_by_id", fail)
+        monkeypatch.setattr(main, "ProductResponse", fail)
+        response = await client.get(f"/products/{product['id']}", headers={"If-None-Match": f'W/"x", {etag}'})
+        assert response.status_code == 304 and response.headers["etag"] == etag and response.content == b""
+        assert (await client.get("/products", headers={"If-None-Match": list_etag})).status_code == 304
+        monkeypatch.undo()
+        # Los parámetros inválidos dan 400 aunque el ETag coincida
+        for params in ({"facets": "color"}, {"cursor": "no-es-un-cursor"}):
+            response = await client.get("/products", params=params, headers={"If-None-Match": list_etag})
+            assert response.status_code == 400
+
+        # Otro producto no cambia la versión de este, pero sí la generación
+        other = _new_product("Reloj Etag Dos", 81.0)
+        assert (await client.get(f"/products/{product['id']}", headers={"If-None-Match": etag})).status_code == 304
+        assert (await client.get("/products", headers={"If-None-Match": list_etag})).status_code == 200
+
+        update_product(product["id"], {"price": 79.0})
+        response = await client.get(f"/products/{product['id']}", headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+
+    delete_product(product["id"])
+    delete_product(other["id"])
+
+    # SQLite guarda versión y generación en la base de datos
+    backend = SQLiteProductBackend(str(tmp_path / "etag.db"))
+    created = backend.create({"name": "Reloj", "price": 1.0, "description": None,
+                              "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 1})
+    version, generation = backend.version(created["id"]), backend.generation()
+    backend.delete(created["id"])
+    assert backend.generation() > generation >= version and backend.version(created["id"]) is None
+    backend.close()
+    reopened = SQLiteProductBackend(str(tmp_path / "etag.db"))
+    assert reopened.generation() == generation + 1
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_listing_cache_serves_bytes_until_the_next_write():
+    import main
+    from data.query_cache import QueryCache
+    params = {"category": "sports", "in_stock": "true", "page": 1}
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.get("/products", params=params)
+        assert first.headers["x-products-cache"] == "MISS"
+        # Mismos parámetros escritos de otra forma
+        again = await client.get("/products?page=1&in_stock=1&category=sports")
+        assert again.headers["x-products-cache"] == "HIT" and again.content == first.content
+        bypass = await client.get("/products", params=params, headers={"X-Products-Cache": "bypass"})
+        assert bypass.headers["x-products-cache"] == "BYPASS"
+
+        product = _new_product("Balon Cache", 15.0, CategoryEnum.sports)
+        response = await client.get("/products", params=params)
+        assert response.headers["x-products-cache"] == "MISS"
+        assert product["id"] in [p["id"] for p in response.json()["products"]]
+        assert (await client.get("/cache/stats")).json()["hits"] >= 1
+
+    delete_product(product["id"])
+
+    cache = QueryCache(max_bytes=4 * 1024)
+    for key in range(6):
+        cache.put(key, 1, b"x" * 500)
+    assert cache.get(0, 1) is None and cache.get(5, 1) is not None
+    assert cache.get(5, 2) is None and cache.stats()["entries"] == 4
+    assert cache.stats()["bytes"] <= 4 * 1024 and cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_orjson_listing_matches_the_pydantic_schema():
+    from models.product_models import ProductList
+    product = _new_product("Cafetera Orjson", 59.9, CategoryEnum.home)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products", params={"search": "cafetera orjson"})
+        assert response.json() == json.loads(ProductList(**response.json()).model_dump_json())
+        assert response.json()["products"][0]["created_at"] == product["created_at"].isoformat()
+
+        response = await client.get(f"/products/{product['id']}")
+        assert response.json()["category"] == "home"
+    delete_product(product["id"])
+
+
+@pytest.mark.asyncio
+async def test_product_json_fragments_are_reused_until_the_product_changes():
+    from data.products_data import fragment_cache_stats
+    product = _new_product("Tetera Fragmento", 22.0)
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.get(f"/products/{product['id']}")
+        hits = fragment_cache_stats()["hits"]
+        listing = await client.get("/products", params={"search": "tetera fragmento", "include_total": False})
+        assert fragment_cache_stats()["hits"] == hits + 1
+        assert listing.json()["products"] == [first.json()]
+        assert listing.json()["total"] is None
+
+        update_product(product["id"], {"price": 23.5})
+        response = await client.get(f"/products/{product['id']}")
+        assert response.json()["price"] == 23.5 and response.json()["updated_at"] is not None
+
+    delete_product(product["id"])
+
+
+def test_aggregates_follow_every_write_in_every_backend(tmp_path):
+    backends = [
+        MemoryProductBackend(),
+        SQLiteProductBackend(str(tmp_path / "stats.db")),
+        SharedMemoryProductBackend(f"stats_{uuid.uuid4().hex[:8]}", capacity=16, text_bytes=4096,
+                                   lock_path=str(tmp_path / "stats.lock")),
+    ]
+    data = {"description": None, "in_stock": True}
+    for backend in backends:
+        _, (lamp, chair, _) = backend.write_many([
+            ("create", None, {**data, "name": "Lampara", "price": 10.1, "category": CategoryEnum.home, "stock_quantity": 3}),
+            ("create", None, {**data, "name": "Silla", "price": 0.2, "category": CategoryEnum.home, "stock_quantity": 7}),
+            ("create", None, {**data, "name": "Novela", "price": 5.0, "category": CategoryEnum.books, "stock_quantity": 2}),
+        ])
+        backend.update(lamp["id"], {"category": CategoryEnum.sports, "stock_quantity": 1})
+        backend.delete(chair["id"])
+        # Un lote que falla no deja rastro en los totales
+        backend.write_many([("create", None, {**data, "name": "Novela", "price": 1.0,
+                                              "category": CategoryEnum.books, "stock_quantity": 1})])
+
+        kept, fresh = backend.check_aggregates()
+        assert kept == fresh and kept.drift(fresh) == {}
+        stats = backend.aggregates().as_dict()
+        assert stats["total_products"] == 2 and stats["total_stock"] == 3
+        assert stats["average_price"] == 7.55 and stats["total_value"] == 20.1
+        sports = stats["categories"]["sports"]
+        assert sports["products"] == 1 and sports["value"] == 10.1
+        assert sports["price"]["min"] == sports["price"]["max"] == pytest.approx(10.1, rel=0.01)
+        assert sports["stock"] == {"min": 1, "p50": 1, "p90": 1, "p99": 1, "max": 1}
+        home = stats["categories"]["home"]
+        assert home["products"] == 0 and home["price"] is None and home["stock"] is None
+
+        backend.close()
+        if isinstance(backend, SharedMemoryProductBackend):
+            backend.unlink()
+
+
+def test_quantile_sketches_stay_within_their_relative_error():
+    from data.aggregates import SKETCH_RELATIVE_ERROR, CatalogAggregates
+    rng = np.random.default_rng(7)
+    prices = np.round(rng.lognormal(3, 1.5, 5000), 2) + 0.01
+    stock = rng.integers(0, 500, 5000)
+    categories = rng.integers(0, len(CategoryEnum), 5000)
+
+    aggregates = CatalogAggregates()
+    for code, price, quantity in zip(categories.tolist(), prices.tolist(), stock.tolist()):
+        aggregates.add(list(CategoryEnum)[code], price, quantity)
+    # Quitar la mitad deja los bocetos igual que si nunca hubieran estado
+    for code, price, quantity in zip(categories[2500:].tolist(), prices[2500:].tolist(), stock[2500:].tolist()):
+        aggregates.add(list(CategoryEnum)[code], price, quantity, -1)
+    assert aggregates == CatalogAggregates.from_columns(categories[:2500], prices[:2500], stock[:2500])
+
+    stats = aggregates.as_dict()
+    for name, quantile in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        exact = np.quantile(prices[:2500], quantile, method="lower")
+        assert stats["price"][name] == pytest.approx(exact, rel=SKETCH_RELATIVE_ERROR, abs=0.01)
+        exact = np.quantile(stock[:2500], quantile, method="lower")
+        assert stats["stock"][name] == pytest.approx(exact, rel=SKETCH_RELATIVE_ERROR, abs=1)
+    assert stats["price"]["max"] == pytest.approx(prices[:2500].max(), rel=SKETCH_RELATIVE_ERROR)
+    assert stats["stock"]["min"] == stock[:2500].min()
+
+
+@pytest.mark.asyncio
+async def test_stats_are_maintained_and_checked_for_drift():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        before = (await client.get("/stats")).json()["data"]["stats"]
+        product = _new_product("Reloj Estadistica", 12.5, CategoryEnum.electronics, stock_quantity=4)
+        after = (await client.get("/stats")).json()["data"]["stats"]
+        assert after["total_products"] == before["total_products"] + 1
+        assert after["total_stock"] == before["total_stock"] + 4
+        assert after["categories"]["electronics"]["value"] == pytest.approx(
+            before["categories"]["electronics"]["value"] + 50.0
+        )
+
+        check = (await client.get("/stats/check")).json()["data"]
+        assert check["consistent"] and check["drift"] == {}
+        assert check["stats"] == after
+
+        # Un desvío simulado aparece en la comprobación
+        from data import products_data
+        products_data.get_backend()._aggregates.add(CategoryEnum.books, 1.0, 1)
+        check = (await client.get("/stats/check")).json()["data"]
+        assert not check["consistent"]
+        assert check["drift"]["total_products"] == 1 and check["drift"]["categories.books.products"] == 1
+        products_data.get_backend()._aggregates.add(CategoryEnum.books, 1.0, 1, -1)
+
+    delete_product(product["id"])
+
+
+def test_facet_counts_match_count_in_every_backend(tmp_path):
+    backends = [
+        MemoryProductBackend(),
+        SQLiteProductBackend(str(tmp_path / "facets.db")),
+        SharedMemoryProductBackend(f"facets_{uuid.uuid4().hex[:8]}", capacity=64, text_bytes=8192,
+                                   lock_path=str(tmp_path / "facets.lock")),
+    ]
+    rng = np.random.default_rng(3)
+    operations = [
+        ("create", None, {
+            "name": f"Articulo {i}", "price": float(rng.choice([10, 25, 49.99, 120, 999.5, 1500])),
+            "description": "oferta" if i % 3 == 0 else None, "category": list(CategoryEnum)[i % 5],
+            "in_stock": bool(i % 4), "stock_quantity": i
+        })
+        for i in range(40)
+    ]
+    prices = [data["price"] for _, _, data in operations]
+    expected_buckets = {
+        "0-25": sum(price < 25 for price in prices),
+        "25-50": sum(25 <= price < 50 for price in prices),
+        "50-100": 0,
+        "100-250": sum(100 <= price < 250 for price in prices),
+        "250-500": 0,
+        "500-1000": sum(500 <= price < 1000 for price in prices),
+        "1000+": sum(price >= 1000 for price in prices)
+    }
+    for backend in backends:
+        backend.write_many(operations)
+        for filters in ({}, {"category": "books"}, {"min_price": 25, "in_stock": True}, {"search": "oferta"}):
+            facets = backend.facet_counts(["category", "in_stock", "price_bucket"], **filters)
+            total = backend.count(**filters)
+            assert all(sum(counts.values()) == total for counts in facets.values())
+            for value, count in facets["category"].items():
+                if not filters.get("category"):
+                    assert backend.count(**{**filters, "category": value}) == count
+            if "in_stock" not in filters:
+                assert backend.count(**filters, in_stock=True) == facets["in_stock"]["true"]
+            if not filters:
+                assert facets["price_bucket"] == expected_buckets
+
+        backend.close()
+        if isinstance(backend, SharedMemoryProductBackend):
+            backend.unlink()
+
+
+@pytest.mark.asyncio
+async def test_listing_returns_requested_facets():
+    created = [_new_product(f"Cuaderno Faceta {i}", 5.0 + 30 * i, CategoryEnum.books, in_stock=i != 1)
+               for i in range(3)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products", params={
+            "search": "cuaderno faceta", "facets": "price_bucket, in_stock,category", "page_size": 1
+        })
+        body = response.json()
+        assert body["total"] == 3 and len(body["products"]) == 1
+        assert list(body["facets"]) == ["category", "in_stock", "price_bucket"]
+        assert body["facets"]["category"]["books"] == 3 and body["facets"]["category"]["home"] == 0
+        assert body["facets"]["in_stock"] == {"true": 2, "false": 1}
+        assert body["facets"]["price_bucket"]["0-25"] == 1 and body["facets"]["price_bucket"]["25-50"] == 1
+
+        # Sin filtros las cuentas salen de los índices y coinciden con el total
+        body = (await client.get("/products", params={"facets": "category,in_stock,price_bucket"})).json()
+        assert sum(body["facets"]["category"].values()) == body["total"]
+        assert sum(body["facets"]["price_bucket"].values()) == body["total"]
+        assert sum(body["facets"]["in_stock"].values()) == body["total"]
+
+        assert (await client.get("/products")).json()["facets"] is None
+        assert (await client.get("/products", params={"facets": "color"})).status_code == 400
+
+    for product in created:
+        delete_product(product["id"])
+
+
+def test_tag_filters_match_in_every_backend(tmp_path):
+    backends = [
+        MemoryProductBackend(),
+        SQLiteProductBackend(str(tmp_path / "tags.db")),
+        SharedMemoryProductBackend(f"tags_{uuid.uuid4().hex[:8]}", capacity=64, text_bytes=8192,
+                                   lock_path=str(tmp_path / "tags.lock")),
+    ]
+    vocabulary = ["rojo", "oferta", "nuevo", "eco"]
+    operations = [
+        ("create", None, {
+            "name": f"Etiquetado {i}", "price": 10.0 + i, "description": None,
+            "category": list(CategoryEnum)[i % 5], "in_stock": bool(i % 2), "stock_quantity": i,
+            "tags": [tag for bit, tag in enumerate(vocabulary) if i >> bit & 1]
+        })
+        for i in range(32)
+    ]
+    operations += [("update", 4, {"tags": ["oferta", "rojo"]}), ("delete", 7, None)]
+    expected = {i + 1: set(data["tags"]) for i, (_, _, data) in enumerate(operations[:32])}
+    expected[4], _ = {"oferta", "rojo"}, expected.pop(7)
+
+    for backend in backends:
+        backend.write_many(operations)
+        assert backend.get(4)["tags"] == ["oferta", "rojo"]
+        for tags in (["rojo"], ["oferta", "eco"], ["rojo", "nuevo", "eco"], ["inexistente"], ["rojo", "inexistente"]):
+            for mode, matches in (("any", set(tags).intersection), ("all", set(tags).issubset)):
+                wanted = sorted(pid for pid, product_tags in expected.items() if matches(product_tags))
+                assert list(backend.iter_ids(tags=tags, tags_mode=mode)) == wanted
+                assert backend.count(tags=tags, tags_mode=mode) == len(wanted)
+                in_stock = [pid for pid in wanted if backend.get(pid)["in_stock"]]
+                assert list(backend.iter_ids(in_stock=True, tags=tags, tags_mode=mode)) == in_stock
+                by_price = list(backend.iter_ids(sort_by="price", tags=tags, tags_mode=mode))
+                assert sorted(by_price) == wanted
+
+        # name solo mira el nombre; search, también la descripción
+        backend.update(5, {"description": "Como el etiquetado 12"})
+        assert list(backend.iter_ids(name="etiquetado 12")) == [13]
+        assert list(backend.iter_ids(search="etiquetado 12")) == [5, 13]
+        assert backend.count(name="ETIQUETADO 1", tags=["oferta"]) == 6
+        backend.close()
+        if isinstance(backend, SharedMemoryProductBackend):
+            backend.unlink()
+
+
+@pytest.mark.asyncio
+async def test_search_endpoint_filters_the_catalog_by_tags():
+    created = [
+        create_product({
+            "name": f"Mochila Busqueda {i}", "price": 20.0 + i, "description": None,
+            "category": CategoryEnum.sports, "in_stock": True, "stock_quantity": 1, "tags": tags
+        })
+        for i, tags in enumerate([["montaña", "ligera"], ["montaña"], ["ligera", "urbana"]])
+    ]
+    lookalike = create_product({
+        "name": "Bolso Busqueda", "price": 15.0, "description": "Más pequeño que la mochila busqueda",
+        "category": CategoryEnum.sports, "in_stock": True, "stock_quantity": 1, "tags": ["montaña"]
+    })
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/search", params={
+            "name": "mochila busqueda", "tags": ["montaña", "LIGERA"], "limit": 2
+        })
+        assert response.status_code == 200
+        body = response.json()
+        assert body["total"] == 3 and body["total_pages"] == 2
+        assert [product["id"] for product in body["products"]] == [created[0]["id"], created[1]["id"]]
+        assert body["filters_applied"]["tags"] == ["montaña", "ligera"]
+
+        body = (await client.get("/products/search", params={
+            "name": "mochila busqueda", "tags": ["montaña", "ligera"], "tags_mode": "all"
+        })).json()
+        assert [product["id"] for product in body["products"]] == [created[0]["id"]]
+
+        # name solo busca en el nombre; q, también en la descripción
+        body = (await client.get("/products/search", params={"q": "mochila busqueda", "tags": ["montaña"]})).json()
+        assert [product["id"] for product in body["products"]] == [p["id"] for p in created[:2]] + [lookalike["id"]]
+        assert body["filters_applied"]["q"] == "mochila busqueda"
+
+        assert (await client.get("/products/search", params={"tags": ["a,b"]})).status_code == 400
+        assert (await client.get("/products/search", params={"min_price": 5, "max_price": 1})).status_code == 400
+
+    for product in created + [lookalike]:
+        delete_product(product["id"])
+
+
+def test_ranked_search_tolerates_typos_and_follows_writes(tmp_path):
+    backends = [
+        MemoryProductBackend(),
+        SQLiteProductBackend(str(tmp_path / "ranked.db")),
+        SharedMemoryProductBackend(f"ranked_{uuid.uuid4().hex[:8]}", capacity=64, text_bytes=8192,
+                                   lock_path=str(tmp_path / "ranked.lock")),
+    ]
+    names = [
+        ("Laptop Gaming", "Laptop para gaming de alta performance"),
+        ("Mouse Gaming", None),
+        ("Laptop Oficina", "Ligera y silenciosa"),
+        ("Libro De Cocina", None),
+    ] + [(f"Relleno {i}", "sin relacion") for i in range(8)]
+    operations = [
+        ("create", None, {"name": name, "price": 10.0, "description": description,
+                          "category": CategoryEnum.home, "in_stock": True, "stock_quantity": 1})
+        for name, description in names
+    ]
+    for backend in backends:
+        backend.write_many(operations)
+        ranked = backend.ranked_search("lapto gamng", 3)
+        assert [product_id for product_id, _ in ranked][0] == 1
+        assert {product_id for product_id, _ in ranked} == {1, 2, 3}
+        assert all(first[1] >= second[1] for first, second in zip(ranked, ranked[1:]))
+        assert backend.ranked_search("xyzzy", 5) == []
+
+        backend.write_many([("update", 1, {"name": "Tablet Grande", "description": None}), ("delete", 3, None)])
+        assert [product_id for product_id, _ in backend.ranked_search("laptop gaming", 5)] == [2]
+        assert backend.ranked_search("tablte", 5)[0][0] == 1
+        # Una ampliación puntúa por su similitud: "gamer" no pasa por delante de
+        # "gaming" aunque su producto sea más corto
+        _, (gamer,) = backend.write_many([("create", None, {**operations[0][2], "name": "Gamer", "description": None})])
+        ranked = backend.ranked_search("gaming", 5)
+        assert [product_id for product_id, _ in ranked] == [2, gamer["id"]]
+        assert ranked[1][1] < ranked[0][1] * 0.5
+
+        backend.close()
+        if isinstance(backend, SharedMemoryProductBackend):
+            backend.unlink()
+
+
+@pytest.mark.asyncio
+async def test_ranked_search_endpoint_returns_scored_products():
+    created = [
+        _new_product("Zapatillas Trail Ranking", 80.0, CategoryEnum.sports),
+        _new_product("Calcetines Ranking", 8.0, CategoryEnum.sports),
+    ]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/products/search/ranked", params={"q": "zapatilas trial", "limit": 3})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["query"] == "zapatilas trial"
+        assert body["results"][0]["product"]["id"] == created[0]["id"]
+        assert body["results"][0]["product"]["name"] == "Zapatillas Trail Ranking"
+        assert body["results"][0]["score"] > 0
+
+        assert (await client.get("/products/search/ranked")).status_code == 422
+        assert (await client.get("/products/search/ranked", params={"q": "x", "limit": 500})).status_code == 422
+
+    for product in created:
+        delete_product(product["id"])